@@ -43,10 +43,24 @@ DEBUG = False
 DEBUG_DB = False
 DB = "mongodb:///ivre"
 DB_DATA = None  # specific: maxmind:///<ivre_share_path>/geoip
+# With TinyDB, keep in-memory indexes (on addresses, ports, etc.) to
+# avoid testing each query against every document.
+TINYDB_INDEXES = True
+# With TinyDB, store each database as an append-only log of changes,
+# compacted when needed, rather than as a JSON file rewritten after
+# each change; existing JSON files are converted.
+TINYDB_LOG_STORAGE = False
+# With MongoDB, maintain precomputed counts for the most common top
+# values of active (nmap & view) records.
+MONGODB_ROLLUPS = False
 # Begin batch sizes
 LOCAL_BATCH_SIZE = 10000  # used with --local-bulk
 MONGODB_BATCH_SIZE = 100
 POSTGRES_BATCH_SIZE = 10000
+POSTGRES_BINARY_COPY = False  # use the binary format for COPY FROM
+DATA_BATCH_SIZE = 1000  # addresses resolved at once in IP data lookups
+VIEW_BATCH_SIZE = 1000  # hosts merged at once in views
+HOSTS_BATCH_SIZE = 1000  # hosts stored at once in active databases
 # End batch sizes
 # specific: if no value is specified for *_PATH variables, they are
 # going to be constructed by guessing the installation PREFIX (see the
@@ -61,6 +75,20 @@ AGENT_MASTER_PATH = "/var/lib/ivre/master"
 # /opt/nmap/share/nmap, then /usr/share/nmap; same for wireshark.
 NMAP_SHARE_PATH = None
 WIRESHARK_SHARE_PATH = None
+# specific: if no value is specified, uses $XDG_CACHE_HOME/ivre or
+# ~/.cache/ivre; set to an empty string to disable the cache of parsed
+# data files (Nmap service fingerprints, Wireshark manufacturer
+# database, etc.).
+CACHE_PATH = None
+# Number of Nmap service fingerprint matching results kept in memory;
+# 0 disables the cache.
+NMAP_SVC_FP_CACHE_SIZE = 10000
+# Number of ivre.passive.getinfos() results (parsed certificates,
+# banners, etc.) kept in memory; 0 disables the cache.
+PASSIVE_GETINFOS_CACHE_SIZE = 10000
+# Keep the ivre.passive.getinfos() results across runs (in a file
+# under CACHE_PATH).
+PASSIVE_GETINFOS_CACHE_PERSIST = False
 # Begin commands
 TESSERACT_CMD = "tesseract"
 OPENSSL_CMD = "openssl"
@@ -140,6 +168,11 @@ FLOW_TIME_FULL_RANGE = True
 FLOW_TIME_BASE = 0
 # Store high level protocols metadata in flows. It may take much more space.
 FLOW_STORE_METADATA = True
+# With MongoDB, the updates of a flow are merged in memory before
+# being sent to the database; they are sent when that many flows, or
+# that many (added-to-set) values, are held in memory.
+FLOW_AGGREGATE_MAX_FLOWS = 50000
+FLOW_AGGREGATE_MAX_VALUES = 1000000
 # End flows
 
 # Begin IPDATA_URLS
@@ -170,6 +203,9 @@ MAXMIND_LICENSE_KEY = None
 # End IPDATA_URLS
 
 GEOIP_LANG = "en"
+# Number of decoded records kept in memory for each MaxMind database
+# file; 0 disables the cache.
+MAXMIND_CACHE_SIZE = 10000
 
 # Some IP ranges send syn-ack answers for any
 # port. VIEW_SYNACK_HONEYPOT_COUNT is the number of open ports with
@@ -205,6 +241,21 @@ WEB_PUBLIC_SRV = False
 # Feed with a random value, like `openssl rand -base64 42`.
 # *Mandatory* when WEB_PUBLIC_SRV == True
 WEB_SECRET = None
+# Number of results of top values and distinct values queries kept in
+# memory by the Web application; 0 disables the cache.
+WEB_TOP_CACHE_SIZE = 1000
+# Maximum age (in seconds) of a cached result.
+WEB_TOP_CACHE_TTL = 300
+# Time (in seconds) during which an expired result is still returned,
+# while a fresh one is computed in the background; 0 disables this.
+WEB_TOP_CACHE_STALE = 0
+# specific: None by default, which disables the Web application's
+# results cache (see WEB_TOP_CACHE_SIZE); the tools writing to the
+# databases (scan2db, db2view, passiverecon2db) touch a file per
+# purpose in this directory, so that the Web application drops its
+# cached results. It must be writable by the
+# users running these tools, and readable by the Web server.
+DB_STAMPS_PATH = None
 
 
 def get_config_file(paths: Optional[List[str]] = None) -> Generator[str, None, None]:
@@ -306,3 +357,11 @@ if NMAP_SHARE_PATH is None:
 
 if WIRESHARK_SHARE_PATH is None:
     WIRESHARK_SHARE_PATH = guess_share("wireshark")
+
+
+if CACHE_PATH is None:
+    CACHE_PATH = os.path.join(
+        os.environ.get("XDG_CACHE_HOME")
+        or os.path.join(os.path.expanduser("~"), ".cache"),
+        "ivre",
+    )
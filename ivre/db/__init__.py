@@ -117,6 +117,13 @@ class DB:
             help="Display results for specified IP " "addresses or ranges.",
         )
 
+    def invalidate_cache(self):
+        """Drops the data from the database the backend may keep in
+        memory, so that the changes made by other processes are taken
+        into account. Does nothing by default.
+
+        """
+
     def parse_args(self, args, flt=None):
         if flt is None:
             flt = self.flt_empty
@@ -750,6 +757,44 @@ class DB:
             yield "%(_id)s: %(count)d\n" % entry
 
 
+class HostsWriter:
+    """Buffers host records and stores them in an active database
+    (`dbase`), by batches of `batch_size` (default:
+    `config.HOSTS_BATCH_SIZE`) records, using `dbase.store_hosts()`.
+
+    `prepare`, when set, is called with each batch (a list of
+    records) before it gets stored. `callback`, when set, is called
+    with each record once it has been stored.
+
+    The `.flush()` method must be called once all the records have
+    been added.
+
+    """
+
+    def __init__(self, dbase, callback=None, prepare=None, batch_size=None):
+        self.dbase = dbase
+        self.callback = callback
+        self.prepare = prepare
+        self.batch_size = config.HOSTS_BATCH_SIZE if batch_size is None else batch_size
+        self.hosts = []
+
+    def append(self, host):
+        self.hosts.append(host)
+        if len(self.hosts) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.hosts:
+            return
+        hosts, self.hosts = self.hosts, []
+        if self.prepare is not None:
+            self.prepare(hosts)
+        self.dbase.store_hosts(hosts)
+        if self.callback is not None:
+            for host in hosts:
+                self.callback(host)
+
+
 class DBActive(DB):
 
     ipaddr_fields = ["addr", "traces.hops.ipaddr", "ports.state_reason_ip"]
@@ -910,6 +955,23 @@ class DBActive(DB):
 
         """
 
+    def store_hosts(self, hosts):
+        """Stores the host records from the iterable `hosts`.
+
+        This generic implementation calls `.store_host()` for each
+        record; backend-specific subclasses may use bulk inserts.
+
+        """
+        for host in hosts:
+            self.store_host(host)
+
+    def hosts_writer(self, callback=None, prepare=None):
+        """Returns a `HostsWriter` object, used to store host records by
+        batches.
+
+        """
+        return HostsWriter(self, callback=callback, prepare=prepare)
+
     @staticmethod
     def getscreenshot(port):
         """Returns the content of a port's screenshot."""
@@ -1376,6 +1438,18 @@ class DBActive(DB):
         for rec in self.get(flt):
             self.remove(rec)
 
+    def rebuild_rollups(self):
+        """Recomputes the precomputed top values counts (roll-ups) from
+        the host records, when the backend maintains such counts, and
+        returns the number of counts that were wrong or missing.
+
+        This generic implementation does nothing (the backend does
+        not maintain roll-ups) and returns 0.
+
+        """
+        utils.LOGGER.info("This backend does not maintain roll-ups")
+        return 0
+
     def get_mean_open_ports(self, flt):
         """This method returns for a specific query `flt` a list of
         dictionary objects whose keys are `id` and `mean`; the value
@@ -1962,7 +2036,12 @@ class DBNmap(DBActive):
             parser.setEntityResolver(xmlnmap.NoExtResolver())
             parser.setFeature(xml.sax.handler.feature_external_ges, 0)
             parser.setFeature(xml.sax.handler.feature_external_pes, 0)
-            parser.parse(utils.open_file(fname))
+            try:
+                parser.parse(utils.open_file(fname))
+            finally:
+                # Keep the hosts parsed so far, even when the parsing
+                # fails (e.g., truncated result of an interrupted scan)
+                content_handler.flush()
             if self.output_function is not None:
                 self.output_function(content_handler._db, out=self.output)
             self.stop_store_hosts()
@@ -2652,6 +2731,53 @@ class DBView(DBActive):
         self.remove(rec)
         return True
 
+    def store_or_merge_hosts(self, hosts):
+        """Stores or merges (with existing records for the same address)
+        the host records from the iterable `hosts`.
+
+        The records are processed by windows of `config.VIEW_BATCH_SIZE`
+        addresses: the existing records for a window are fetched using
+        one query, merged in memory and replaced at once. `hosts` should
+        be sorted by address.
+
+        """
+        window = {}
+        for host in hosts:
+            addr = utils.force_ip2int(host["addr"])
+            if addr in window:
+                window[addr] = self.merge_host_docs(window[addr], host)
+                continue
+            window[addr] = host
+            if len(window) >= config.VIEW_BATCH_SIZE:
+                self._merge_hosts_window(window)
+                window = {}
+        if window:
+            self._merge_hosts_window(window)
+
+    def _merge_hosts_window(self, hosts):
+        """Merges the records from `hosts`, a dict object mapping
+        addresses (as integers) to host records, with the existing
+        records, and replaces them.
+
+        """
+        oldrecs = list(
+            self.get(self.searchhosts([host["addr"] for host in hosts.values()]))
+        )
+        for rec in oldrecs:
+            addr = utils.force_ip2int(rec["addr"])
+            hosts[addr] = self.merge_host_docs(rec, hosts[addr])
+        self._replace_hosts(oldrecs, list(hosts.values()))
+
+    def _replace_hosts(self, oldrecs, hosts):
+        """Removes the records `oldrecs` (as returned by `.get()`) and
+        stores the records `hosts`. Backend-specific subclasses may
+        use bulk operations.
+
+        """
+        if oldrecs:
+            self.remove_many(self.searchhosts([rec["addr"] for rec in oldrecs]))
+        self.store_hosts(hosts)
+
     @classmethod
     def _searchja3(cls, value_or_hash, script_id, neg):
         if not value_or_hash:
@@ -2708,7 +2834,7 @@ class _RecInfo:
             if self.lastseen is None:
                 self.lastseen = lastseen
             else:
-                self.lastseen = min(self.lastseen, lastseen)
+                self.lastseen = max(self.lastseen, lastseen)
 
     def update(self, timestamp):
         self.count += 1
@@ -3084,6 +3210,32 @@ class DBData(DB):
             return infos
         return None
 
+    def infos_byip_many(self, addrs):
+        """Same as infos_byip(), for several addresses at once. `addrs`
+        can be any iterable of addresses (as strings or integers); a
+        list of results, in the same order, is returned.
+
+        """
+        addrs = [
+            addr if isinstance(addr, str) else utils.force_int2ip(int(addr))
+            for addr in addrs
+        ]
+        results = []
+        for addr, *allinfos in zip(
+            addrs,
+            self.as_byip_many(addrs),
+            self.country_byip_many(addrs),
+            self.location_byip_many(addrs),
+        ):
+            infos = {}
+            addr_type = utils.get_addr_type(addr)
+            if addr_type:
+                infos["address_type"] = addr_type
+            for subinfos in allinfos:
+                infos.update(subinfos or {})
+            results.append(infos or None)
+        return results
+
     def as_byip(self, addr):
         raise NotImplementedError
 
@@ -3093,6 +3245,35 @@ class DBData(DB):
     def country_byip(self, addr):
         raise NotImplementedError
 
+    # The following methods should be overridden by backends that can
+    # resolve several addresses faster than one at a time.
+
+    def as_byip_many(self, addrs):
+        return [self.as_byip(addr) for addr in addrs]
+
+    def location_byip_many(self, addrs):
+        return [self.location_byip(addr) for addr in addrs]
+
+    def country_byip_many(self, addrs):
+        return [self.country_byip(addr) for addr in addrs]
+
+    def add_addr_infos_many(self, records):
+        """Sets the "infos" field of each record of `records` (a list of
+        host records, with an "addr" field), using one batch lookup for
+        each database.
+
+        """
+        addrs = [rec["addr"] for rec in records]
+        for rec, country, asinfo, location in zip(
+            records,
+            self.country_byip_many(addrs),
+            self.as_byip_many(addrs),
+            self.location_byip_many(addrs),
+        ):
+            rec["infos"] = {}
+            for subinfos in [country, asinfo, location]:
+                rec["infos"].update(subinfos or {})
+
 
 class LockError(RuntimeError):
     """A runtime error used when a lock cannot be acquired or released."""
@@ -34,7 +34,7 @@ from elasticsearch_dsl.query import Query
 
 from ivre.active.data import ALIASES_TABLE_ELEMS
 from ivre.db import DB, DBActive, DBView
-from ivre import utils
+from ivre import config, utils
 
 
 PAGESIZE = 250
@@ -264,6 +264,27 @@ class ElasticDBActive(ElasticDB, DBActive):
             host["infos"]["coordinates"] = host["infos"]["coordinates"][::-1]
         self.db_client.index(index=self.indexes[0], body=host)
 
+    def store_hosts(self, hosts):
+        def _actions():
+            for host in hosts:
+                if "coordinates" in host.get("infos", {}):
+                    host = dict(host, infos=dict(host["infos"]))
+                    host["infos"]["coordinates"] = host["infos"]["coordinates"][::-1]
+                yield {"_index": self.indexes[0], "_source": host}
+
+        count = 0
+        for success, result in helpers.streaming_bulk(
+            self.db_client,
+            _actions(),
+            chunk_size=config.HOSTS_BATCH_SIZE,
+            raise_on_error=False,
+        ):
+            if success:
+                count += 1
+            else:
+                utils.LOGGER.warning("Cannot insert host [%r]", result)
+        utils.LOGGER.debug("%d HOSTS STORED in %r", count, self.indexes[0])
+
     def count(self, flt):
         return self.db_client.count(
             body={"query": flt.to_dict()},
@@ -318,6 +318,9 @@ class HttpDBData(HttpDB, DBData):
             k: tuple(v) if isinstance(v, list) else v for k, v in json.load(req).items()
         }
 
+    def infos_byip_many(self, addrs):
+        return [self.infos_byip(addr) for addr in addrs]
+
     def _infos_byip(self, fields, addr):
         infos = self.infos_byip(addr)
         return {key: infos[key] for key in fields if key in infos}
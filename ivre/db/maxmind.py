@@ -23,14 +23,16 @@ files.
 
 
 import codecs
-from functools import partial, reduce
+from collections import OrderedDict
+from functools import partial
+import mmap
 from multiprocessing import Pool
 import os
 import sys
 import struct
 
 
-from ivre import config, utils
+from ivre import config, geoiputils, utils
 from ivre.db import DBData
 
 
@@ -107,6 +109,10 @@ class EmptyMaxMindFile:
     def lookup(_):
         return {}
 
+    @staticmethod
+    def lookup_many(ips):
+        return [{} for _ in ips]
+
 
 class MaxMindFile:
 
@@ -120,15 +126,21 @@ class MaxMindFile:
     METADATA_BEGIN_MARKER = b"\xab\xcd\xefMaxMind.com"
     DATA_SECTION_SEPARATOR_SIZE = 16
     SIZE_BASE_VALUES = [0, 29, 285, 65821]
-    POINTER_BASE_VALUES = [0, 0, 2048, 526336]
+    POINTER_BASE_VALUES = [0, 0, 2048, 526336, 0]
 
-    def __init__(self, path):
+    def __init__(self, path, cache_size=None):
         self.path = path
         self._data = None
-        pos = self.data.rindex(self.METADATA_BEGIN_MARKER) + len(
-            self.METADATA_BEGIN_MARKER
+        self.cache_size = (
+            config.MAXMIND_CACHE_SIZE if cache_size is None else cache_size
         )
-        metadata = self.metadata = self.decode(pos, 0)[1]
+        self._records = OrderedDict()
+        self._ipv4_start = None
+        pos = self.data.rfind(self.METADATA_BEGIN_MARKER)
+        if pos == -1:
+            raise ValueError("Invalid file format (no metadata) in %r" % path)
+        pos += len(self.METADATA_BEGIN_MARKER)
+        metadata = self.metadata = self.decode(0, pos)[1]
         self.ip_version = metadata["ip_version"]
         self.node_count = metadata["node_count"]
         self.node_byte_size = metadata["record_size"] * 2 // 8
@@ -139,23 +151,41 @@ class MaxMindFile:
 
     @property
     def data(self):
+        """The content of the file, memory-mapped (read-only) when
+        possible so that processes using the same file share the same
+        pages instead of each holding a private copy.
+
+        """
         if self._data is None:
             with open(self.path, "rb") as fdesc:
-                self._data = fdesc.read()
+                try:
+                    self._data = mmap.mmap(fdesc.fileno(), 0, access=mmap.ACCESS_READ)
+                except (ValueError, OSError):
+                    # empty file or mmap() not supported
+                    self._data = fdesc.read()
         return self._data
 
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._data = None
+        self._records.clear()
+
+    def __getstate__(self):
+        # mmap objects cannot be pickled; the file will be mapped
+        # again on first use (e.g., in a multiprocessing worker) and
+        # the decoded records cache starts empty.
+        state = self.__dict__.copy()
+        state["_data"] = None
+        state["_records"] = OrderedDict()
+        state["_ipv4_start"] = None
+        return state
+
     def read_byte(self, pos):
         return self.data[pos]
 
     def read_value(self, pos, size):
-        return reduce(
-            lambda x, y: (x << 8) + y,
-            struct.unpack(
-                "%dB" % size,
-                self.data[pos : pos + size],
-            ),
-            0,
-        )
+        return int.from_bytes(self.data[pos : pos + size], "big")
 
     def decode(self, pos, base_pos):
         ctrl = self.data[pos + base_pos]
@@ -164,7 +194,8 @@ class MaxMindFile:
         if type_ == 1:
             # pointer
             size = ((ctrl >> 3) & 0x3) + 1
-            val1 = ctrl & 0x7
+            # for 4-byte pointers, the 3 lowest bits of ctrl are ignored
+            val1 = (ctrl & 0x7) if size < 4 else 0
             val2 = self.read_value(pos + base_pos, size)
             pointer = (val1 << (8 * size)) + val2 + self.POINTER_BASE_VALUES[size]
             return pos + size, self.decode(pointer, base_pos)[1]
@@ -237,36 +268,153 @@ class MaxMindFile:
         return pos, val
 
     def read_record(self, node_no, flag):
-        rec_byte_size = self.node_byte_size // 2
-        pos = self.node_byte_size * node_no
-        middle = self.read_byte(pos + rec_byte_size) if self.node_byte_size % 2 else 0
+        data = self.data
+        node_byte_size = self.node_byte_size
+        rec_byte_size = node_byte_size // 2
+        pos = node_byte_size * node_no
         if flag == 0:  # left
-            val = self.read_value(pos, rec_byte_size)
-            val += ((middle & 0xF0) << 20) if middle else 0
+            val = int.from_bytes(data[pos : pos + rec_byte_size], "big")
+            if node_byte_size % 2:
+                val += (data[pos + rec_byte_size] & 0xF0) << 20
         else:  # right
-            val = self.read_value(
-                pos + self.node_byte_size - rec_byte_size, rec_byte_size
+            val = int.from_bytes(
+                data[pos + node_byte_size - rec_byte_size : pos + node_byte_size],
+                "big",
             )
-            val += ((middle & 0xF) << 24) if middle else 0
+            if node_byte_size % 2:
+                val += (data[pos + rec_byte_size] & 0xF) << 24
         return val
 
     def __repr__(self):
         return "<%s from %s>" % (self.__class__.__name__, self.path)
 
-    def lookup(self, ip):
+    def get_record(self, pos):
+        """Returns the record stored at offset `pos` in the data section.
+
+        Decoded records are kept in a bounded LRU cache since a lot of
+        addresses (typically, every address of a network) share the
+        same record. The returned value must not be modified.
+
+        """
+        records = self._records
+        try:
+            record = records[pos]
+        except KeyError:
+            record = self.decode(pos, self.data_section_start)[1]
+            if self.cache_size:
+                records[pos] = record
+                if len(records) > self.cache_size:
+                    records.popitem(last=False)
+        else:
+            records.move_to_end(pos)
+        return record
+
+    @property
+    def ipv4_start(self):
+        """The node (and the corresponding bit number) where the
+        lookups for IPv4 addresses start; in IPv6 databases, this
+        saves the 96 first steps of the tree walk.
+
+        """
+        if self._ipv4_start is not None:
+            return self._ipv4_start
         node_no = 0
+        if self.ip_version == 4:
+            self._ipv4_start = (node_no, 96)
+            return self._ipv4_start
+        for i in range(96):
+            if node_no >= self.node_count:
+                break
+            node_no = self.read_record(node_no, 0)
+            if node_no == 0:
+                raise Exception("Invalid file format")
+        else:
+            i = 96
+        self._ipv4_start = (node_no, i)
+        return self._ipv4_start
+
+    def lookup(self, ip):
         addr = utils.force_ip2int(ip)
-        for i in range(96 if self.ip_version == 4 else 0, 128):
-            flag = (addr >> (127 - i)) & 1
-            next_node_no = self.read_record(node_no, flag)
-            if next_node_no == 0:
+        if self.ip_version == 4 or addr <= 0xFFFFFFFF:
+            node_no, start = self.ipv4_start
+        else:
+            node_no, start = 0, 0
+        node_count = self.node_count
+        read_record = self.read_record
+        for i in range(start, 128):
+            if node_no >= node_count:
+                break
+            node_no = read_record(node_no, (addr >> (127 - i)) & 1)
+            if node_no == 0:
                 raise Exception("Invalid file format")
-            if next_node_no >= self.node_count:
-                pos = next_node_no - self.node_count - self.DATA_SECTION_SEPARATOR_SIZE
-                return self.decode(pos, self.data_section_start)[1]
-            node_no = next_node_no
+        if node_no >= node_count:
+            return self.get_record(
+                node_no - node_count - self.DATA_SECTION_SEPARATOR_SIZE
+            )
         raise Exception("Invalid file format")
 
+    def lookup_many(self, ips):
+        """Same as lookup(), for several addresses at once; returns a
+        list of records, in the same order as `ips` (which may be any
+        iterable of addresses, as strings or integers, including a
+        NumPy array).
+
+        The addresses are sorted and resolved in one walk of the
+        search tree: the part of the path shared with the previous
+        address is reused, and addresses that belong to the same
+        network as the previous one cost nothing.
+
+        """
+        addrs = [int(utils.force_ip2int(ip)) for ip in ips]
+        node_count = self.node_count
+        read_record = self.read_record
+        ipv4_start = self.ipv4_start
+        results = {}
+        # path[i] is the node reached after reading the bits before
+        # bit i of prev_addr, for start <= i <= end
+        path = {}
+        prev_addr = prev_record = None
+        start = end = 0
+        for addr in sorted(set(addrs)):
+            if self.ip_version == 4 or addr <= 0xFFFFFFFF:
+                cur_start = ipv4_start[1]
+            else:
+                cur_start = 0
+            if prev_addr is not None and cur_start == start:
+                # first bit that differs from the previous address
+                common = 128 - (addr ^ prev_addr).bit_length()
+                if common >= end:
+                    # same network as the previous address
+                    results[addr] = prev_record
+                    prev_addr = addr
+                    continue
+            else:
+                common = -1
+            if common < cur_start:
+                start = cur_start
+                node_no = ipv4_start[0] if start else 0
+                path = {start: node_no}
+                i = start
+            else:
+                i = common
+                node_no = path[i]
+                for j in range(i + 1, end + 1):
+                    del path[j]
+            while node_no < node_count and i < 128:
+                node_no = read_record(node_no, (addr >> (127 - i)) & 1)
+                if node_no == 0:
+                    raise Exception("Invalid file format")
+                i += 1
+                path[i] = node_no
+            if node_no < node_count:
+                raise Exception("Invalid file format")
+            end = i
+            prev_addr = addr
+            prev_record = results[addr] = self.get_record(
+                node_no - node_count - self.DATA_SECTION_SEPARATOR_SIZE
+            )
+        return [results[addr] for addr in addrs]
+
     def __iter__(self):
         return MaxMindFileIter(self)
 
@@ -364,14 +512,32 @@ class MaxMindDBData(DBData):
                     name = name[9:]
                 setattr(self, "_db_%s" % name, subdb)
 
+    @staticmethod
+    def _many(converter, raws):
+        """Applies `converter` to each record of `raws`; records shared by
+        several addresses (which are the same objects, as returned by
+        MaxMindFile.lookup_many()) are converted only once.
+
+        """
+        done = {}
+        result = []
+        for raw in raws:
+            try:
+                result.append(done[id(raw)])
+            except KeyError:
+                result.append(done.setdefault(id(raw), converter(raw)))
+        return result
+
+    def _as_infos(self, raw):
+        return {self.AS_KEYS.get(key, key): value for key, value in raw.items()}
+
     def as_byip(self, addr):
-        return {
-            self.AS_KEYS.get(key, key): value
-            for key, value in self.db_asn.lookup(addr).items()
-        }
+        return self._as_infos(self.db_asn.lookup(addr))
 
-    def location_byip(self, addr):
-        raw = self.db_city.lookup(addr)
+    def as_byip_many(self, addrs):
+        return self._many(self._as_infos, self.db_asn.lookup_many(addrs))
+
+    def _location_infos(self, raw):
         result = {}
         sub = raw.get("subdivisions")
         if sub:
@@ -421,9 +587,14 @@ class MaxMindDBData(DBData):
             return result
         return None
 
-    def country_byip(self, addr):
+    def location_byip(self, addr):
+        return self._location_infos(self.db_city.lookup(addr))
+
+    def location_byip_many(self, addrs):
+        return self._many(self._location_infos, self.db_city.lookup_many(addrs))
+
+    def _country_infos(self, raw):
         result = {}
-        raw = self.db_country.lookup(addr)
         sub = raw.get("country")
         if sub:
             value = sub.get("iso_code")
@@ -434,6 +605,12 @@ class MaxMindDBData(DBData):
                 result["country_name"] = value
         return result
 
+    def country_byip(self, addr):
+        return self._country_infos(self.db_country.lookup(addr))
+
+    def country_byip_many(self, addrs):
+        return self._many(self._country_infos, self.db_country.lookup_many(addrs))
+
     def dump_as_ranges(self, fdesc):
         for data in self.db_asn.get_ranges(
             ["autonomous_system_number"],
@@ -489,8 +666,8 @@ class MaxMindDBData(DBData):
             )
 
     def build_dumps(self, force=False):
-        """Produces CSV dump (.dump-IPv4.csv) files from Maxmind database
-        (.mmdb) files.
+        """Produces CSV dump (.dump-IPv4.csv) files, and their indexes
+        (.dump-IPv4.<index>.idx), from Maxmind database (.mmdb) files.
 
         This function creates uses multiprocessing pool and makes several
         calls to self._build_dump().
@@ -552,3 +729,8 @@ class MaxMindDBData(DBData):
         )
         with codecs.open(csv_file, mode="w", encoding="utf-8") as fdesc:
             dumper(fdesc)
+        if os.path.basename(csv_file) in geoiputils.DUMP_INDEXES:
+            utils.LOGGER.info("Indexing %r", os.path.basename(csv_file))
+            geoiputils.build_dump_indexes(
+                os.path.basename(csv_file), path=os.path.dirname(csv_file)
+            )
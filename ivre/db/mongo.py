@@ -23,7 +23,7 @@ databases.
 """
 
 
-from collections import OrderedDict
+from collections import Counter, OrderedDict
 from copy import deepcopy
 import datetime
 import hashlib
@@ -1243,6 +1243,18 @@ class MongoDBActive(MongoDB, DBActive):
 
         """
         MongoDB.migrate_schema(self, self.column_hosts, version)
+        # The records have changed: the roll-ups must be rebuilt
+        self._set_rollups_state(False)
+
+    def init(self):
+        """Initializes the columns and the roll-ups (the counts of an
+        empty database are complete, unless MONGODB_ROLLUPS is False).
+
+        """
+        super().init()
+        self._reset_rollups()
+        if config.MONGODB_ROLLUPS:
+            self._set_rollups_state(True)
 
     @classmethod
     def migrate_schema_hosts_0_1(cls, doc):
@@ -2012,7 +2024,11 @@ class MongoDBActive(MongoDB, DBActive):
             cur.count(),
         )
 
-    def store_host(self, host):
+    def _host2dbrec(self, host):
+        """Returns a copy of `host`, converted to the format used in the
+        database.
+
+        """
         host = deepcopy(host)
         # Convert IP addresses to internal DB format
         try:
@@ -2043,16 +2059,330 @@ class MongoDBActive(MongoDB, DBActive):
                 "type": "Point",
                 "coordinates": host["infos"].pop("coordinates")[::-1],
             }
+        return host
+
+    # Pseudo-fields whose top values are precomputed (see
+    # `._rollup_values()`), in addition to script:<scriptid>
+    rollup_fields = {"port:open", "service", "product", "country", "asnum", "cpe"}
+    # Maximum number of seconds the roll-ups state is cached
+    rollups_state_ttl = 60
+    # The purpose of the database stamp ("nmap" or "view", see
+    # ivre.utils.touch_db_stamp()), set by the subclasses
+    stamp_purpose: Optional[str] = None
+    rollup_projection = [
+        "categories",
+        "infos.country_code",
+        "infos.country_name",
+        "infos.as_num",
+        "ports.state_state",
+        "ports.protocol",
+        "ports.port",
+        "ports.service_name",
+        "ports.service_product",
+        "ports.scripts.id",
+        "ports.scripts.output",
+        "cpes",
+    ]
+
+    @property
+    def _rollups_column(self):
+        return "%s_rollups" % self.columns[self.column_hosts]
+
+    @property
+    def _rollups_enabled(self):
+        """True when the roll-ups are complete, and should hence be
+        maintained and used. The state is stored in the database (a
+        document with no "field" in the roll-ups collection) and
+        cached for at most `.rollups_state_ttl` seconds, or until the
+        database stamp changes (see `._cache_rollups_state()`).
+
+        """
+        if not config.MONGODB_ROLLUPS:
+            return False
+        stamp = utils.get_db_stamp(self.stamp_purpose)
+        try:
+            state, cached_stamp, cached_time = self._rollups_state
+        except AttributeError:
+            pass
+        else:
+            if (
+                stamp == cached_stamp
+                and time.time() - cached_time < self.rollups_state_ttl
+            ):
+                return state
+        state = self.db[self._rollups_column].find_one({"_id": "state"}) is not None
+        self._rollups_state = (state, stamp, time.time())
+        return state
+
+    def _cache_rollups_state(self, complete):
+        """Records a change of the roll-ups state: the database stamp
+        is touched so that the other processes (e.g., the Web server)
+        read the new state.
+
+        """
+        utils.touch_db_stamp(self.stamp_purpose)
+        self._rollups_state = (
+            complete,
+            utils.get_db_stamp(self.stamp_purpose),
+            time.time(),
+        )
+
+    def _reset_rollups(self):
+        """Drops the roll-ups collection (including the state) and
+        creates its index.
+
+        """
+        column = self.db[self._rollups_column]
+        column.drop()
+        column.create_index(
+            [
+                ("field", pymongo.ASCENDING),
+                ("category", pymongo.ASCENDING),
+                ("count", pymongo.ASCENDING),
+            ]
+        )
+        self._cache_rollups_state(False)
+
+    def _set_rollups_state(self, complete):
+        if complete:
+            self.db[self._rollups_column].replace_one(
+                {"_id": "state"}, {"_id": "state"}, upsert=True
+            )
+        else:
+            self.db[self._rollups_column].delete_one({"_id": "state"})
+        self._cache_rollups_state(complete)
+
+    @staticmethod
+    def _rollup_values(host):
+        """Yields the (pseudo-field, value) tuples counted by
+        `.topvalues()` for the record `host`, as returned by the
+        aggregation pipelines (before the `outputproc` functions).
+
+        """
+        infos = host.get("infos", {})
+        if "country_code" in infos:
+            country_name = infos.get("country_name")
+            yield (
+                "country",
+                (infos["country_code"], "?" if country_name is None else country_name),
+            )
+        if "as_num" in infos:
+            yield ("asnum", infos["as_num"])
+        for port in host.get("ports", []):
+            if port.get("state_state") == "open":
+                yield ("port:open", (port.get("protocol"), port.get("port")))
+                service_name = port.get("service_name")
+                yield ("service", "" if service_name is None else service_name)
+                yield ("product", (service_name, port.get("service_product")))
+            for script in port.get("scripts", []):
+                if "id" in script and "output" in script:
+                    yield ("script:%s" % script["id"], script["output"])
+        for cpe in host.get("cpes", []):
+            values = [cpe.get(key) for key in ["type", "vendor", "product", "version"]]
+            if all(isinstance(value, str) for value in values):
+                yield ("cpe", ":".join(values))
+
+    @classmethod
+    def _rollup_counts(cls, hosts, counts=None, sign=1):
+        """Adds (or subtracts, when `sign` is -1) to the Counter
+        `counts` the contributions of the records `hosts`, with
+        (pseudo-field, category, value) keys (category is None for all
+        the records).
+
+        """
+        if counts is None:
+            counts = Counter()
+        for host in hosts:
+            categories = [None] + list(host.get("categories", []))
+            for field, value in cls._rollup_values(host):
+                for category in categories:
+                    counts[(field, category, value)] += sign
+        return counts
+
+    @staticmethod
+    def _rollup_id(field, category, value):
+        return hashlib.sha1(json.dumps([field, category, value]).encode()).hexdigest()
+
+    def _update_rollups(self, counts):
+        """Applies the changes `counts`, as returned by
+        `._rollup_counts()`, to the roll-ups collection.
+
+        """
+        requests = []
+        decremented = []
+        for (field, category, value), count in counts.items():
+            if not count:
+                continue
+            ident = self._rollup_id(field, category, value)
+            requests.append(
+                pymongo.UpdateOne(
+                    {"_id": ident},
+                    {
+                        "$inc": {"count": count},
+                        "$setOnInsert": {
+                            "field": field,
+                            "category": category,
+                            "value": value,
+                        },
+                    },
+                    upsert=True,
+                )
+            )
+            if count < 0:
+                decremented.append(ident)
+        if not requests:
+            return
+        column = self.db[self._rollups_column]
+        column.bulk_write(requests, ordered=False)
+        for i in range(0, len(decremented), config.MONGODB_BATCH_SIZE):
+            column.delete_many(
+                {
+                    "_id": {"$in": decremented[i : i + config.MONGODB_BATCH_SIZE]},
+                    "count": {"$lte": 0},
+                }
+            )
+
+    def _rollup_key(
+        self, field, flt, sort, limit, skip, aggrflt, specialproj, specialflt
+    ):
+        """Returns the (pseudo-field, category) key of the roll-ups
+        that can answer a `.topvalues()` call, or None.
+
+        """
+        if not (
+            field in self.rollup_fields
+            or (field.startswith("script:") and field.count(":") == 1)
+        ):
+            return None
+        if any(
+            arg is not None
+            for arg in [sort, limit, skip, aggrflt, specialproj, specialflt]
+        ):
+            return None
+        if not flt:
+            category = None
+        elif list(flt) == ["categories"] and isinstance(flt["categories"], str):
+            category = flt["categories"]
+        else:
+            return None
+        if not self._rollups_enabled:
+            return None
+        return field, category
+
+    def _rollup_topvalues(self, field, category, topnbr, least):
+        cursor = (
+            self.db[self._rollups_column]
+            .find(
+                {"field": field, "category": category},
+                projection={"_id": 0, "value": 1, "count": 1},
+            )
+            .sort([("count", pymongo.ASCENDING if least else pymongo.DESCENDING)])
+        )
+        if topnbr is not None:
+            cursor = cursor.limit(topnbr)
+        return ({"_id": doc["value"], "count": doc["count"]} for doc in cursor)
+
+    def rebuild_rollups(self):
+        """Recomputes the roll-ups (precomputed top values for the
+        most common pseudo-fields, see `.topvalues()`) from the host
+        records, replaces the existing ones and returns the number of
+        counts that were wrong or missing.
+
+        This should not run while other processes write to the
+        database.
+
+        """
+        if not config.MONGODB_ROLLUPS:
+            utils.LOGGER.info("Roll-ups are disabled (see MONGODB_ROLLUPS)")
+            return 0
+        counts = self._rollup_counts(
+            self.find(
+                self.columns[self.column_hosts],
+                {},
+                projection=self.rollup_projection,
+                no_cursor_timeout=True,
+            ).batch_size(config.MONGODB_BATCH_SIZE)
+        )
+        column = self.db[self._rollups_column]
+        current = {
+            doc["_id"]: doc["count"]
+            for doc in column.find({"field": {"$exists": True}}, projection=["count"])
+        }
+        errors = sum(
+            1
+            for key, count in counts.items()
+            if current.pop(self._rollup_id(*key), None) != count
+        ) + len(current)
+        self._reset_rollups()
+        docs = (
+            {
+                "_id": self._rollup_id(*key),
+                "field": key[0],
+                "category": key[1],
+                "value": key[2],
+                "count": count,
+            }
+            for key, count in counts.items()
+        )
+        batch = []
+        for doc in docs:
+            batch.append(doc)
+            if len(batch) >= config.MONGODB_BATCH_SIZE:
+                column.insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            column.insert_many(batch, ordered=False)
+        self._set_rollups_state(True)
+        return errors
+
+    def store_host(self, host):
+        host = self._host2dbrec(host)
         try:
             ident = self.db[self.columns[self.column_hosts]].insert(host)
         except Exception:
             utils.LOGGER.warning("Cannot insert host %r", host, exc_info=True)
             return None
+        if self._rollups_enabled:
+            self._update_rollups(self._rollup_counts([host]))
         utils.LOGGER.debug(
             "HOST STORED: %r in %r", ident, self.columns[self.column_hosts]
         )
         return ident
 
+    def _store_hosts_batch(self, hosts):
+        try:
+            self.db[self.columns[self.column_hosts]].insert_many(hosts, ordered=False)
+        except BulkWriteError as exc:
+            failed = set()
+            for error in exc.details["writeErrors"]:
+                utils.LOGGER.warning(
+                    "Cannot insert host %r [%s]", hosts[error["index"]], error["errmsg"]
+                )
+                failed.add(error["index"])
+            count = exc.details["nInserted"]
+            stored = [host for i, host in enumerate(hosts) if i not in failed]
+        except Exception:
+            utils.LOGGER.warning("Cannot insert %d hosts", len(hosts), exc_info=True)
+            return
+        else:
+            count = len(hosts)
+            stored = hosts
+        if self._rollups_enabled:
+            self._update_rollups(self._rollup_counts(stored))
+        utils.LOGGER.debug(
+            "%d HOSTS STORED in %r", count, self.columns[self.column_hosts]
+        )
+
+    def store_hosts(self, hosts):
+        batch = []
+        for host in hosts:
+            batch.append(self._host2dbrec(host))
+            if len(batch) >= config.HOSTS_BATCH_SIZE:
+                self._store_hosts_batch(batch)
+                batch = []
+        if batch:
+            self._store_hosts_batch(batch)
+
     def merge_host_docs(self, rec1, rec2):
         """Merge two host records and return the result. Unmergeable /
         hard-to-merge fields are lost (e.g., extraports).
@@ -2074,11 +2404,39 @@ class MongoDBActive(MongoDB, DBActive):
         as returned by `.get()`.
 
         """
-        self.db[self.columns[self.column_hosts]].delete_one({"_id": host["_id"]})
+        if not self._rollups_enabled:
+            self.db[self.columns[self.column_hosts]].delete_one({"_id": host["_id"]})
+            return
+        # Use the removed document rather than `host`, which may be
+        # outdated.
+        rec = self.db[self.columns[self.column_hosts]].find_one_and_delete(
+            {"_id": host["_id"]}, projection=self.rollup_projection
+        )
+        if rec is not None:
+            self._update_rollups(self._rollup_counts([rec], sign=-1))
 
     def remove_many(self, flt):
         """Removes hosts from the active column, based on the filter `flt`."""
-        self.db[self.columns[self.column_hosts]].delete_many(flt)
+        if not self._rollups_enabled:
+            self.db[self.columns[self.column_hosts]].delete_many(flt)
+            return
+        cursor = self.find(
+            self.columns[self.column_hosts], flt, projection=self.rollup_projection
+        ).batch_size(config.MONGODB_BATCH_SIZE)
+        batch = []
+        for rec in cursor:
+            batch.append(rec)
+            if len(batch) >= config.MONGODB_BATCH_SIZE:
+                self._remove_batch(batch)
+                batch = []
+        if batch:
+            self._remove_batch(batch)
+
+    def _remove_batch(self, recs):
+        self.db[self.columns[self.column_hosts]].delete_many(
+            {"_id": {"$in": [rec["_id"] for rec in recs]}}
+        )
+        self._update_rollups(self._rollup_counts(recs, sign=-1))
 
     def store_or_merge_host(self, host):
         raise NotImplementedError
@@ -2883,6 +3241,9 @@ class MongoDBActive(MongoDB, DBActive):
         outputproc = None
         if flt is None:
             flt = self.flt_empty
+        rollup = self._rollup_key(
+            field, flt, sort, limit, skip, aggrflt, specialproj, specialflt
+        )
         if aggrflt is None:
             aggrflt = self.flt_empty
         if specialflt is None:
@@ -3773,22 +4134,26 @@ class MongoDBActive(MongoDB, DBActive):
                 return {"count": x["count"], "_id": self.internal2ip(x["_id"])}
 
             field = "traces.hops.ipaddr"
-        pipeline = self._topvalues(
-            field,
-            flt=flt,
-            topnbr=topnbr,
-            sort=sort,
-            limit=limit,
-            skip=skip,
-            least=least,
-            aggrflt=aggrflt,
-            specialproj=specialproj,
-            specialflt=specialflt,
-        )
-        log_pipeline(pipeline)
-        cursor = self.set_limits(
-            self.db[self.columns[self.column_hosts]].aggregate(pipeline, cursor={})
-        )
+        if rollup is not None:
+            # precomputed counts, same values as the pipeline below
+            cursor = self._rollup_topvalues(*rollup, topnbr, least)
+        else:
+            pipeline = self._topvalues(
+                field,
+                flt=flt,
+                topnbr=topnbr,
+                sort=sort,
+                limit=limit,
+                skip=skip,
+                least=least,
+                aggrflt=aggrflt,
+                specialproj=specialproj,
+                specialflt=specialflt,
+            )
+            log_pipeline(pipeline)
+            cursor = self.set_limits(
+                self.db[self.columns[self.column_hosts]].aggregate(pipeline, cursor={})
+            )
         if outputproc is not None:
             return (outputproc(res) for res in cursor)
         return cursor
@@ -3893,6 +4258,7 @@ class MongoDBActive(MongoDB, DBActive):
 class MongoDBNmap(MongoDBActive, DBNmap):
 
     column_scans = 1
+    stamp_purpose = "nmap"
     content_handler = Nmap2Mongo
 
     def __init__(self, url):
@@ -3976,6 +4342,9 @@ class MongoDBNmap(MongoDBActive, DBNmap):
 
 
 class MongoDBView(MongoDBActive, DBView):
+
+    stamp_purpose = "view"
+
     def __init__(self, url):
         super().__init__(url)
         self.columns = [self.params.pop("colname_hosts", "views")]
@@ -3984,6 +4353,46 @@ class MongoDBView(MongoDBActive, DBView):
         if not self.merge_host(host):
             self.store_host(host)
 
+    def _replace_hosts(self, oldrecs, hosts):
+        newrecs = [self._host2dbrec(host) for host in hosts]
+        requests = [pymongo.DeleteOne({"_id": rec["_id"]}) for rec in oldrecs]
+        requests.extend(pymongo.InsertOne(rec) for rec in newrecs)
+        # The records to remove and to insert have different _id
+        # values, so the order of the operations does not matter.
+        try:
+            self.db[self.columns[self.column_hosts]].bulk_write(requests, ordered=False)
+        except BulkWriteError as exc:
+            failed = set()
+            for error in exc.details["writeErrors"]:
+                utils.LOGGER.warning(
+                    "Cannot replace host %r [%s]", error["op"], error["errmsg"]
+                )
+                failed.add(error["index"])
+            if self._rollups_enabled:
+                counts = self._rollup_counts(
+                    (rec for i, rec in enumerate(oldrecs) if i not in failed),
+                    sign=-1,
+                )
+                self._rollup_counts(
+                    (
+                        rec
+                        for i, rec in enumerate(newrecs, len(oldrecs))
+                        if i not in failed
+                    ),
+                    counts=counts,
+                )
+                self._update_rollups(counts)
+            return
+        if self._rollups_enabled:
+            counts = self._rollup_counts(oldrecs, sign=-1)
+            self._update_rollups(self._rollup_counts(newrecs, counts=counts))
+        utils.LOGGER.debug(
+            "%d HOSTS STORED in %r (%d removed)",
+            len(hosts),
+            self.columns[self.column_hosts],
+            len(oldrecs),
+        )
+
 
 class MongoDBPassive(MongoDB, DBPassive):
 
@@ -4355,14 +4764,33 @@ class MongoDBPassive(MongoDB, DBPassive):
         even when the spec already exists in the database and the call
         was hence unnecessary.
 
+        Identical specs within a batch (of `config.MONGODB_BATCH_SIZE`
+        specs) are merged in memory, so that only one upsert (and one
+        `getinfos` call) is needed for each of them.
+
         It's up to you to decide whether having bulk insert is worth
         it or if you want to go with the regular `.insert_or_update()`
         method.
 
         """
-        bulk = self.db[self.columns[self.column_passive]].initialize_unordered_bulk_op()
+        records = {}
         count = 0
 
+        def _bulk_execute(final=False):
+            bulk = self.db[
+                self.columns[self.column_passive]
+            ].initialize_unordered_bulk_op()
+            for findspec, updatespec in records.values():
+                bulk.find(findspec).upsert().update(updatespec)
+            utils.LOGGER.debug(
+                "DB:MongoDB bulk upsert: %d (%d specs, dedup ratio %.2f)%s",
+                len(records),
+                count,
+                count / len(records),
+                " (final)" if final else "",
+            )
+            bulk.execute()
+
         if separated_timestamps:
 
             def generator(specs):
@@ -4381,44 +4809,59 @@ class MongoDBPassive(MongoDB, DBPassive):
             for firstseen, lastseen, spec in generator(specs):
                 if spec is None:
                     continue
-                updatespec = {
-                    "$min": {"firstseen": firstseen},
-                    "$max": {"lastseen": lastseen},
-                }
-                if replacecount:
-                    updatespec["$set"] = {"count": spec.pop("count", 1)}
+                count += 1
+                spec_count = spec.pop("count", 1)
+                # "infos" depends on the other fields
+                key = tuple(sorted(item for item in spec.items() if item[0] != "infos"))
+                if key in records:
+                    updatespec = records[key][1]
+                    cur_firstseen = updatespec["$min"]["firstseen"]
+                    if cur_firstseen is None or (
+                        firstseen is not None and firstseen < cur_firstseen
+                    ):
+                        updatespec["$min"]["firstseen"] = firstseen
+                    cur_lastseen = updatespec["$max"]["lastseen"]
+                    if cur_lastseen is None or (
+                        lastseen is not None and lastseen > cur_lastseen
+                    ):
+                        updatespec["$max"]["lastseen"] = lastseen
+                    if replacecount:
+                        updatespec["$set"]["count"] = spec_count
+                    else:
+                        updatespec["$inc"]["count"] += spec_count
                 else:
-                    updatespec["$inc"] = {"count": spec.pop("count", 1)}
-                if getinfos is not None:
-                    spec.update(getinfos(spec))
-                    try:
-                        infos = {"infos": spec["infos"]}
-                    except KeyError:
-                        pass
+                    updatespec = {
+                        "$min": {"firstseen": firstseen},
+                        "$max": {"lastseen": lastseen},
+                    }
+                    if replacecount:
+                        updatespec["$set"] = {"count": spec_count}
                     else:
-                        self._fix_sizes(infos)
-                        updatespec["$setOnInsert"] = infos
-                spec = self.rec2internal(spec)
-                findspec = deepcopy(spec)
-                for key in ["infos", "fullinfos"]:
-                    try:
-                        del findspec[key]
-                    except KeyError:
-                        pass
-                bulk.find(findspec).upsert().update(updatespec)
-                count += 1
+                        updatespec["$inc"] = {"count": spec_count}
+                    if getinfos is not None:
+                        spec.update(getinfos(spec))
+                        try:
+                            infos = {"infos": spec["infos"]}
+                        except KeyError:
+                            pass
+                        else:
+                            self._fix_sizes(infos)
+                            updatespec["$setOnInsert"] = infos
+                    spec = self.rec2internal(spec)
+                    findspec = {
+                        field: value
+                        for field, value in spec.items()
+                        if field not in {"infos", "fullinfos"}
+                    }
+                    records[key] = (findspec, updatespec)
                 if count >= config.MONGODB_BATCH_SIZE:
-                    utils.LOGGER.debug("DB:MongoDB bulk upsert: %d", count)
-                    bulk.execute()
-                    bulk = self.db[
-                        self.columns[self.column_passive]
-                    ].initialize_unordered_bulk_op()
+                    _bulk_execute()
+                    records = {}
                     count = 0
         except IOError:
             pass
-        if count > 0:
-            utils.LOGGER.debug("DB:MongoDB bulk upsert: %d (final)", count)
-            bulk.execute()
+        if records:
+            _bulk_execute(final=True)
 
     def insert_or_update_mix(self, spec, getinfos=None, replacecount=False):
         """Updates the first record matching "spec" (without
@@ -5030,6 +5473,145 @@ class MongoDBAgent(MongoDB, DBAgent):
         )
 
 
+def _hashable(value):
+    """Returns a hashable value that can be used to compare `value`
+    (a value added to a set in MongoDB, possibly a dict or a list) to
+    other values.
+
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((key, _hashable(val)) for key, val in value.items()))
+    if isinstance(value, list):
+        return tuple(_hashable(val) for val in value)
+    return value
+
+
+class MongoDBFlowBulk:
+    """Aggregates in memory the flow upserts before sending them to
+    MongoDB: the updates of the same flow (i.e., with the same
+    `findspec`) are merged (counters are summed, "$min" / "$max"
+    values are kept, "$addToSet" values are merged), the same way
+    MongoDB would apply them: null is lower than any other value, and
+    an update with a non-numeric "$inc" value is rejected.
+
+    The aggregated upserts are sent (using a MongoDB bulk) when
+    `config.FLOW_AGGREGATE_MAX_FLOWS` flows or
+    `config.FLOW_AGGREGATE_MAX_VALUES` "$addToSet" values are held
+    in memory, and when `.execute()` is called.
+
+    The (source, destination, protocol) values of the flows that may
+    need to be switched are kept in `.hosts` (see
+    `MongoDBFlow.cleanup_flows()`).
+
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.flows = {}
+        self.hosts = set()
+        self.updates = 0
+        self.values = 0
+        self.result = {"nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0}
+
+    def add(self, findspec, updatespec):
+        if any(
+            isinstance(value, bool) or not isinstance(value, (int, float))
+            for value in updatespec.get("$inc", {}).values()
+        ):
+            # MongoDB would reject the whole update
+            utils.LOGGER.error(
+                "Cannot increment with non-numeric argument, ignoring update "
+                "(flow %r, update %r)",
+                findspec,
+                updatespec,
+            )
+            return
+        key = tuple(sorted(findspec.items()))
+        try:
+            aggr = self.flows[key][1]
+        except KeyError:
+            aggr = {}
+            self.flows[key] = (findspec, aggr)
+            if (findspec.get("dport") or 0) > 128:
+                self.hosts.add(
+                    tuple(findspec[field] for field in MongoDBFlow.cleanup_fields)
+                )
+        for op, fields in updatespec.items():
+            current = aggr.setdefault(op, {})
+            for field, value in fields.items():
+                if op == "$addToSet":
+                    values = current.setdefault(field, {})
+                    if isinstance(value, dict) and "$each" in value:
+                        value = value["$each"]
+                    else:
+                        value = [value]
+                    for val in value:
+                        hval = _hashable(val)
+                        if hval not in values:
+                            values[hval] = val
+                            self.values += 1
+                elif op == "$inc":
+                    current[field] = current.get(field, 0) + value
+                elif op not in {"$min", "$max"}:
+                    raise ValueError("Operation not supported [%r]" % op)
+                elif field not in current:
+                    current[field] = value
+                # for MongoDB, null is lower than any other value
+                elif op == "$min":
+                    if current[field] is not None and (
+                        value is None or value < current[field]
+                    ):
+                        current[field] = value
+                elif value is not None and (
+                    current[field] is None or value > current[field]
+                ):
+                    current[field] = value
+        self.updates += 1
+        if (
+            len(self.flows) >= config.FLOW_AGGREGATE_MAX_FLOWS
+            or self.values >= config.FLOW_AGGREGATE_MAX_VALUES
+        ):
+            self.flush()
+
+    def flush(self):
+        """Sends the aggregated upserts to MongoDB."""
+        if not self.flows:
+            return
+        bulk = self.collection.initialize_unordered_bulk_op()
+        for findspec, aggr in self.flows.values():
+            updatespec = {op: fields for op, fields in aggr.items() if fields}
+            if "$addToSet" in updatespec:
+                updatespec["$addToSet"] = {
+                    field: {"$each": list(values.values())}
+                    for field, values in updatespec["$addToSet"].items()
+                }
+            bulk.find(findspec).upsert().update(updatespec)
+        utils.LOGGER.debug(
+            "DB:MongoDB flow bulk upsert: %d (%d updates, aggregation ratio %.2f)",
+            len(self.flows),
+            self.updates,
+            self.updates / len(self.flows),
+        )
+        self.flows = {}
+        self.updates = 0
+        self.values = 0
+        try:
+            result = bulk.execute()
+        except BulkWriteError as exc:
+            utils.LOGGER.error("Bulk Write Error", exc_info=True)
+            result = exc.details
+        for key in self.result:
+            self.result[key] += result.get(key, 0)
+
+    def execute(self):
+        """Sends the remaining aggregated upserts to MongoDB, and
+        returns the (cumulated) results.
+
+        """
+        self.flush()
+        return self.result
+
+
 class MongoDBFlow(MongoDB, DBFlow, metaclass=DBFlowMeta):
     column_flow = 0
 
@@ -5044,6 +5626,9 @@ class MongoDBFlow(MongoDB, DBFlow, metaclass=DBFlowMeta):
     # insertion in db.
     meta_kinds = {"keys": "$addToSet", "counters": "$inc"}
 
+    # The flows considered together by .cleanup_flows()
+    cleanup_fields = ["src_addr_0", "src_addr_1", "dst_addr_0", "dst_addr_1", "proto"]
+
     indexes: List[List[Tuple[List[SortKey], Dict[str, Any]]]] = [
         # flows
         [
@@ -5077,10 +5662,10 @@ class MongoDBFlow(MongoDB, DBFlow, metaclass=DBFlowMeta):
     def start_bulk_insert(self):
         """
         Initialize bulks for inserting data in MongoDB.
-        Returns flow_bulk
+        Returns flow_bulk (a MongoDBFlowBulk instance)
         """
         utils.LOGGER.debug("start_bulk_insert called")
-        return self.db[self.columns[self.column_flow]].initialize_unordered_bulk_op()
+        return MongoDBFlowBulk(self.db[self.columns[self.column_flow]])
 
     @staticmethod
     def _get_flow_key(rec):
@@ -5153,7 +5738,7 @@ class MongoDBFlow(MongoDB, DBFlow, metaclass=DBFlowMeta):
 
         cls._update_timeslots(updatespec, rec)
 
-        bulk.find(findspec).upsert().update(updatespec)
+        bulk.add(findspec, updatespec)
 
     @classmethod
     def conn2flow(cls, bulk, rec):
@@ -5183,7 +5768,7 @@ class MongoDBFlow(MongoDB, DBFlow, metaclass=DBFlowMeta):
         elif rec["proto"] == "icmp":
             updatespec.setdefault("$addToSet", {})["codes"] = rec["code"]
 
-        bulk.find(findspec).upsert().update(updatespec)
+        bulk.add(findspec, updatespec)
 
     @classmethod
     def flow2flow(cls, bulk, rec):
@@ -5213,7 +5798,7 @@ class MongoDBFlow(MongoDB, DBFlow, metaclass=DBFlowMeta):
         elif rec["proto"] == "icmp":
             updatespec.setdefault("$addToSet", {})["codes"] = rec["code"]
 
-        bulk.find(findspec).upsert().update(updatespec)
+        bulk.add(findspec, updatespec)
 
     @staticmethod
     def bulk_commit(bulk):
@@ -6112,18 +6697,53 @@ class MongoDBFlow(MongoDB, DBFlow, metaclass=DBFlowMeta):
 
         return True
 
-    def cleanup_flows(self):
+    def cleanup_flows(self, bulk=None):
         """
         Cleanup flows which source and destination seem to have been switched.
+
+        When `bulk` (a MongoDBFlowBulk instance, as returned by
+        `.start_bulk_insert()`, once committed) is provided, only the
+        flows between the same hosts, with the same protocol, as the
+        flows updated using `bulk` are considered.
         """
         # Get flows which have a unique source port
+        match = {
+            "sports": {"$size": 1},
+            "dport": {"$gt": 128},
+        }
+        if bulk is None:
+            matches = [match]
+        else:
+            hosts = list(bulk.hosts)
+            matches = [
+                dict(
+                    match,
+                    **{
+                        "$or": [
+                            dict(zip(self.cleanup_fields, values))
+                            for values in hosts[i : i + config.MONGODB_BATCH_SIZE]
+                        ]
+                    },
+                )
+                for i in range(0, len(hosts), config.MONGODB_BATCH_SIZE)
+            ]
+        # not a MongoDBFlowBulk: flows are also removed
+        switch_bulk = self.db[
+            self.columns[self.column_flow]
+        ].initialize_unordered_bulk_op()
+        counter = 0
+        for match in matches:
+            counter += self._cleanup_flows(switch_bulk, match)
+        self.bulk_commit(switch_bulk)
+        utils.LOGGER.debug("%d flows switched.", counter)
+
+    def _cleanup_flows(self, bulk, match):
+        """Adds to `bulk` the operations needed to switch the flows
+        matching `match`, returns the number of flows removed.
+
+        """
         pipeline = [
-            {
-                "$match": {
-                    "sports": {"$size": 1},
-                    "dport": {"$gt": 128},
-                }
-            },
+            {"$match": match},
             {"$unwind": "$sports"},
             {"$unwind": "$times"},
             {
@@ -6150,7 +6770,6 @@ class MongoDBFlow(MongoDB, DBFlow, metaclass=DBFlowMeta):
             },
         ]
         res = self.db[self.columns[self.column_flow]].aggregate(pipeline)
-        bulk = self.start_bulk_insert()
         counter = 0
         for rec in res:
             rec["_id"]["src_addr"] = self.internal2ip(
@@ -6204,6 +6823,4 @@ class MongoDBFlow(MongoDB, DBFlow, metaclass=DBFlowMeta):
                 bulk.find(findspec).upsert().update(updatespec)
                 bulk.find(removespec).remove()
                 counter += len(rec["_ids"])
-
-        self.bulk_commit(bulk)
-        utils.LOGGER.debug("%d flows switched.", counter)
+        return counter
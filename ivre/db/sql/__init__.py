@@ -30,8 +30,11 @@ import codecs
 from collections import namedtuple
 import csv
 import datetime
+import itertools
 import json
 import re
+import socket
+import struct
 
 
 from sqlalchemy import (
@@ -100,6 +103,14 @@ class CSVFile:
 
     """
 
+    # Subclasses may generate bytes rather than str, and need a header
+    # and / or a trailer
+    empty = ""
+    header = ""
+    trailer = ""
+    _buffer = None
+    _done = False
+
     def __init__(self, fname, skip=0, limit=None):
         # pylint: disable=consider-using-with
         self.fdesc = codecs.open(fname, encoding="latin-1")
@@ -119,24 +130,75 @@ class CSVFile:
         """
         return line
 
-    def read(self, size=None):
+    @staticmethod
+    def format_line(line):
+        """Subclasses can override this method to change how the values
+        returned by .fixline() are formatted.
+
+        """
+        return "%s\n" % "\t".join(line)
+
+    def _next_line(self):
+        """Returns the next formatted line, or None when the `limit` has
+        been reached or when there is no more data to read.
+
+        """
         if self.limit is not None:
             if self.count >= self.limit:
                 self.more_to_read = True
-                return ""
+                return None
         try:
             line = None
             while line is None:
                 line = self.fixline(next(self.inp))
-            if self.limit is not None:
-                self.count += 1
-            return "%s\n" % "\t".join(line)
         except StopIteration:
             self.more_to_read = False
-            return ""
+            return None
+        if self.limit is not None:
+            self.count += 1
+        return self.format_line(line)
+
+    def read(self, size=-1):
+        """Returns (at most) `size` characters (or bytes), or everything
+        when `size` is negative or None. Lines are generated until
+        `size` is reached, so that the consumer (e.g., psycopg2's
+        copy_from()) gets full chunks.
+
+        """
+        if self._buffer is None:
+            self._buffer = self.header
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while not self._done and (size is None or size < 0 or length < size):
+            line = self._next_line()
+            if line is None:
+                self._done = True
+                line = self.trailer
+            chunks.append(line)
+            length += len(line)
+        data = self.empty.join(chunks)
+        if size is None or size < 0:
+            self._buffer = self.empty
+            return data
+        self._buffer = data[size:]
+        return data[:size]
 
     def readline(self):
-        return self.read()
+        if self._buffer is None:
+            self._buffer = self.header
+        while not self._done and "\n" not in self._buffer:
+            line = self._next_line()
+            if line is None:
+                self._done = True
+                line = self.trailer
+            self._buffer += line
+        try:
+            idx = self._buffer.index("\n") + 1
+        except ValueError:
+            idx = len(self._buffer)
+        data = self._buffer[:idx]
+        self._buffer = self._buffer[idx:]
+        return data
 
     def __exit__(self, *args):
         if self.fdesc is not None:
@@ -197,6 +259,15 @@ class ScanCSVFile(CSVFile):
 
 
 # Passive
+
+# Non-printable (Latin-1) characters are replaced by \xNN, and
+# backslashes are escaped (PostgreSQL COPY text format)
+_PASSIVE_CSV_ESCAPE = {
+    c: "\\\\x%02x" % c for c in itertools.chain(range(32), range(127, 256))
+}
+_PASSIVE_CSV_ESCAPE[ord("\\")] = "\\\\"
+
+
 class PassiveCSVFile(CSVFile):
     info_fields = set(["distance", "signature", "version"])
 
@@ -218,8 +289,10 @@ class PassiveCSVFile(CSVFile):
             self.count = 0
         self.getinfos = getinfos
         self.timestamps = separated_timestamps
+        self.columns = [col.name for col in table.columns]
+        self.colnames = set(self.columns)
 
-    def fixline(self, line):
+    def _fixvalues(self, line):
         if self.timestamps:
             timestamp, line = line
             line["firstseen"] = line["lastseen"] = utils.all2datetime(timestamp)
@@ -253,13 +326,7 @@ class PassiveCSVFile(CSVFile):
                     line[fld] = utils.all2datetime(line[fld]).timestamp()
         for key, value in line.items():
             if key not in ["info", "moreinfo"] and isinstance(value, str):
-                try:
-                    value = value.encode("latin-1")
-                except Exception:
-                    pass
-                line[key] = "".join(
-                    chr(c) if 32 <= c <= 126 else "\\x%02x" % c for c in value
-                ).replace("\\", "\\\\")
+                line[key] = value.translate(_PASSIVE_CSV_ESCAPE)
         line["info"] = (
             "%s"
             % json.dumps(
@@ -276,15 +343,102 @@ class PassiveCSVFile(CSVFile):
                 dict(
                     (key, line.pop(key))
                     for key in list(line)
-                    if key not in self.table.columns
+                    if key not in self.colnames
                 ),
             ).replace("\\", "\\\\")
         )
+        return line
+
+    def fixline(self, line):
+        line = self._fixvalues(line)
         return [
-            "\\N" if line.get(col.name) is None else str(line.get(col.name))
-            for col in self.table.columns
+            "\\N" if line.get(col) is None else str(line.get(col))
+            for col in self.columns
+        ]
+
+
+def _copy_unescape(value):
+    """Reverts the escaping of backslashes (from PostgreSQL COPY text
+    format) of the values prepared by PassiveCSVFile._fixvalues().
+
+    """
+    return value.replace("\\\\", "\\")
+
+
+_COPY_BINARY_INT2 = struct.Struct(">h")
+_COPY_BINARY_INT4 = struct.Struct(">i")
+_COPY_BINARY_INT8 = struct.Struct(">q")
+_COPY_BINARY_NULL = _COPY_BINARY_INT4.pack(-1)
+_COPY_BINARY_EPOCH = datetime.datetime(2000, 1, 1)
+_COPY_BINARY_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def _copy_binary_text(value):
+    return _copy_unescape(str(value)).encode()
+
+
+def _copy_binary_jsonb(value):
+    return b"\x01" + _copy_unescape(value).encode()
+
+
+def _copy_binary_inet(value):
+    if ":" in value:
+        return b"\x03\x80\x00\x10" + socket.inet_pton(socket.AF_INET6, value)
+    return b"\x02\x20\x00\x04" + socket.inet_pton(socket.AF_INET, value)
+
+
+def _copy_binary_timestamp(value):
+    # PostgreSQL ignores the time zone for "timestamp without time
+    # zone" values
+    return _COPY_BINARY_INT8.pack(
+        (value.replace(tzinfo=None) - _COPY_BINARY_EPOCH) // _COPY_BINARY_MICROSECOND
+    )
+
+
+class PassiveBinaryFile(PassiveCSVFile):
+    """Like PassiveCSVFile, but generates data in PostgreSQL binary COPY
+    format, suitable for use with PostgresDB.copy_from_binary(). This
+    saves the parsing of the text values on the server side.
+
+    """
+
+    empty = b""
+    header = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+    trailer = _COPY_BINARY_INT2.pack(-1)
+    encoders = {
+        "id": _COPY_BINARY_INT4.pack,
+        "addr": _copy_binary_inet,
+        "count": _COPY_BINARY_INT4.pack,
+        "firstseen": _copy_binary_timestamp,
+        "lastseen": _copy_binary_timestamp,
+        "port": _COPY_BINARY_INT4.pack,
+        "info": _copy_binary_jsonb,
+        "moreinfo": _copy_binary_jsonb,
+        "schema_version": _COPY_BINARY_INT4.pack,
+    }
+
+    def __init__(self, *args, **kargs):
+        super().__init__(*args, **kargs)
+        self.fieldcount = _COPY_BINARY_INT2.pack(len(self.table.columns))
+        self.colencoders = [
+            self.encoders.get(col, _copy_binary_text) for col in self.columns
         ]
 
+    def fixline(self, line):
+        line = self._fixvalues(line)
+        return [line.get(col) for col in self.columns]
+
+    def format_line(self, line):
+        data = [self.fieldcount]
+        for encoder, value in zip(self.colencoders, line):
+            if value is None:
+                data.append(_COPY_BINARY_NULL)
+                continue
+            value = encoder(value)
+            data.append(_COPY_BINARY_INT4.pack(len(value)))
+            data.append(value)
+        return b"".join(data)
+
 
 class SQLDB(DB):
 
@@ -611,7 +765,7 @@ class SQLDBFlow(SQLDB, DBFlow):
         """
         raise NotImplementedError()
 
-    def cleanup_flows(self):
+    def cleanup_flows(self, bulk=None):
         raise NotImplementedError()
 
 
@@ -2506,6 +2660,13 @@ class SQLDBView(SQLDBActive, DBView):
         self.store_host(host)
         self.stop_store_hosts()
 
+    def store_or_merge_hosts(self, hosts):
+        # records are merged by .store_host()
+        self.start_store_hosts()
+        for host in hosts:
+            self.store_host(host)
+        self.stop_store_hosts()
+
     @classmethod
     def searchsource(cls, src, neg=False):
         return cls.base_filter(
@@ -32,10 +32,7 @@ import time
 
 
 from sqlalchemy import (
-    ARRAY,
-    Column,
     Index,
-    LargeBinary,
     String,
     Table,
     and_,
@@ -60,8 +57,8 @@ from sqlalchemy.sql.sqltypes import TupleType
 
 from ivre import config, utils, xmlnmap
 from ivre.db.sql import (
+    PassiveBinaryFile,
     PassiveCSVFile,
-    ScanCSVFile,
     SQLDB,
     SQLDBActive,
     SQLDBFlow,
@@ -92,6 +89,18 @@ class PostgresDB(SQLDB):
         trans.commit()
         conn.close()
 
+    def copy_from_binary(self, fdesc, table):
+        """Like .copy_from(), but `fdesc` generates data in PostgreSQL
+        binary COPY format.
+
+        """
+        cursor = self.db.raw_connection().cursor()
+        conn = self.db.connect()
+        trans = conn.begin()
+        cursor.copy_expert("COPY %s FROM STDIN WITH (FORMAT binary)" % table, fdesc)
+        trans.commit()
+        conn.close()
+
     def create_tmp_table(self, table, extracols=None):
         cols = [c.copy() for c in table.__table__.columns]
         for c in cols:
@@ -1369,25 +1378,6 @@ class PostgresDBNmap(PostgresDBActive, SQLDBNmap):
             ).on_conflict_do_nothing()
         )
 
-    def store_hosts(self, hosts):
-        tmp = self.create_tmp_table(
-            self.tables.scan,
-            extracols=[
-                Column("scanfileid", ARRAY(LargeBinary(32))),
-                Column("categories", ARRAY(String(32))),
-                Column("source", String(32)),
-                # Column("cpe", postgresql.JSONB),
-                # Column("extraports", postgresql.JSONB),
-                Column("hostnames", postgresql.JSONB),
-                # openports
-                # Column("os", postgresql.JSONB),
-                Column("ports", postgresql.JSONB),
-                # Column("traceroutes", postgresql.JSONB),
-            ],
-        )
-        with ScanCSVFile(hosts, self.ip2internal, tmp) as fdesc:
-            self.copy_from(fdesc, tmp.name)
-
 
 class PostgresDBView(PostgresDBActive, SQLDBView):
     def _store_host(self, host):
@@ -1630,10 +1620,14 @@ class PostgresDBPassive(PostgresDB, SQLDBPassive):
         if config.DEBUG_DB:
             total_upserted = 0
             total_start_time = time.time()
+        if config.POSTGRES_BINARY_COPY:
+            fileclass, copy_from = PassiveBinaryFile, self.copy_from_binary
+        else:
+            fileclass, copy_from = PassiveCSVFile, self.copy_from
         while more_to_read:
             if config.DEBUG_DB:
                 start_time = time.time()
-            with PassiveCSVFile(
+            with fileclass(
                 specs,
                 self.ip2internal,
                 tmp,
@@ -1641,7 +1635,7 @@ class PostgresDBPassive(PostgresDB, SQLDBPassive):
                 separated_timestamps=separated_timestamps,
                 limit=config.POSTGRES_BATCH_SIZE,
             ) as fdesc:
-                self.copy_from(fdesc, tmp.name)
+                copy_from(fdesc, tmp.name)
                 more_to_read = fdesc.more_to_read
                 if config.DEBUG_DB:
                     count_upserted = fdesc.count
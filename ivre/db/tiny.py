@@ -28,21 +28,48 @@ databases.
 
 
 from collections import defaultdict, Counter
+from collections.abc import Mapping, MutableMapping
+from contextlib import contextmanager
 from copy import deepcopy
 from datetime import datetime, time, timedelta
-from functools import cmp_to_key
+from functools import partial
+import hashlib
 from itertools import product as cartesian_prod
+import json
+import mmap
 import operator
 import os
 import re
 import socket
+import stat
 import struct
+import tempfile
 from uuid import uuid1, UUID
 
+try:
+    import fcntl
+except ImportError:
+    # Windows: no LogStorage (it relies on flock())
+    HAVE_FCNTL = False
+else:
+    HAVE_FCNTL = True
+
 
 from tinydb import TinyDB as TDB, Query
 from tinydb.database import Document
 from tinydb.operations import add, increment
+from tinydb.storages import JSONStorage, Storage
+
+try:
+    from tinydb.queries import QueryInstance
+    from tinydb.table import Table
+
+    HAVE_TABLE = True
+except ImportError:
+    # TinyDB < 4: no index support
+    QueryInstance = None
+    Table = object
+    HAVE_TABLE = False
 
 
 from ivre.active.data import ALIASES_TABLE_ELEMS
@@ -69,25 +96,839 @@ except TypeError:
     EMPTY_QUERY = Query()
 
 
+# types of the values stored in the indexes
+INDEX_TYPES = (str, int, float, type(None))
+
+
+def _index_values(record, path):
+    """Yields the values of `path` (a tuple of field names) in `record`,
+    going through lists.
+
+    """
+    if isinstance(record, list):
+        for subrec in record:
+            yield from _index_values(subrec, path)
+        return
+    if not path:
+        if isinstance(record, INDEX_TYPES):
+            yield record
+        return
+    if isinstance(record, dict) and path[0] in record:
+        yield from _index_values(record[path[0]], path[1:])
+
+
+class LogStorage(Storage):
+
+    """A TinyDB storage that keeps the database in an append-only log
+    of changes, rather than in a JSON file rewritten after each
+    change.
+
+    Each line of the file records a change: "<table>\\t<doc_id>\\t<doc>"
+    where <doc> is the JSON-encoded document, or is empty when the
+    document has been removed; "<table>\\t\\t" means the table has been
+    dropped.
+
+    The file is mapped in memory and only the position of the current
+    version of each document is kept; the documents are decoded when
+    they are read. The file is compacted (rewritten with only the
+    current version of each document) when it has more obsolete lines
+    than current ones, and at least `compact_min` obsolete lines.
+
+    The changes appended by other processes are read before each
+    operation. The file is modified (appended, compacted, or truncated
+    after a failed write) with an exclusive lock held (see `lock()`),
+    and read with a shared lock.
+
+    """
+
+    compact_min = 10000
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._handle = None
+        self._map = None
+        self._locked = False
+        self._open()
+
+    def _open(self, handle=None):
+        if handle is None:
+            # pylint: disable=consider-using-with
+            handle = open(self.path, "ab+")
+        self._handle = handle
+        self._ino = os.fstat(self._handle.fileno()).st_ino
+        # table name -> {doc_id: (start, end) of the JSON document}
+        self._tables = {}
+        # number of bytes read, of lines read, of current documents
+        self._size = 0
+        self._lines = 0
+        self._count = 0
+        self._scan()
+
+    def _unmap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def close(self):
+        self._unmap()
+        if self._handle is not None:
+            # closing the file releases the lock
+            self._handle.close()
+            self._handle = None
+            self._locked = False
+
+    def _data(self, size):
+        """Returns the file, mapped in memory at least up to `size`."""
+        if self._map is None or len(self._map) < size:
+            self._unmap()
+            self._map = mmap.mmap(self._handle.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def _scan(self, truncate=False):
+        """Reads the changes appended to the file since the last call.
+
+        An incomplete last line is left for a later call, unless
+        `truncate` is True (the lock must then be held, so no write is in
+        progress), in which case it is considered as a failed write and
+        removed. Without the lock, a shared lock is held while the file is
+        read, so that such a line cannot be removed meanwhile.
+
+        """
+        fileno = self._handle.fileno()
+        if os.fstat(fileno).st_size <= self._size:
+            return
+        if self._locked:
+            self._read_lines(truncate)
+            return
+        fcntl.flock(fileno, fcntl.LOCK_SH)
+        try:
+            self._read_lines(truncate)
+        finally:
+            fcntl.flock(fileno, fcntl.LOCK_UN)
+
+    def _read_lines(self, truncate):
+        size = os.fstat(self._handle.fileno()).st_size
+        if size <= self._size:
+            return
+        data = self._data(size)
+        find = data.find
+        tables = self._tables
+        pos = self._size
+        while True:
+            end = find(b"\n", pos, size)
+            if end == -1:
+                break
+            tab1 = find(b"\t", pos, end)
+            tab2 = -1 if tab1 == -1 else find(b"\t", tab1 + 1, end)
+            if tab2 == -1:
+                utils.LOGGER.warning(
+                    "Invalid line in %r at offset %d, skipping it", self.path, pos
+                )
+                pos = end + 1
+                continue
+            name = data[pos:tab1].decode()
+            doc_id = data[tab1 + 1 : tab2].decode()
+            pos = end + 1
+            self._lines += 1
+            if not doc_id:
+                table = tables.pop(name, None)
+                if table is not None:
+                    self._count -= len(table)
+                continue
+            table = tables.setdefault(name, {})
+            if end == tab2 + 1:
+                if table.pop(doc_id, None) is not None:
+                    self._count -= 1
+            else:
+                if doc_id not in table:
+                    self._count += 1
+                table[doc_id] = (tab2 + 1, end)
+        if pos < size and truncate:
+            utils.LOGGER.warning(
+                "Incomplete line at the end of %r, removing it", self.path
+            )
+            self._unmap()
+            self._handle.truncate(pos)
+        self._size = pos
+
+    def _acquire(self):
+        """Takes the exclusive lock on the file, which is reopened when it
+        has been replaced (compacted) or removed by another process, and
+        reads the changes.
+
+        """
+        while True:
+            fcntl.flock(self._handle.fileno(), fcntl.LOCK_EX)
+            try:
+                if os.stat(self.path).st_ino == self._ino:
+                    break
+            except FileNotFoundError:
+                pass
+            self.close()
+            self._open()
+        self._locked = True
+        self._scan(truncate=True)
+
+    @contextmanager
+    def lock(self):
+        """Holds the exclusive lock on the file, used to modify it; the
+        changes made by other processes have been read when the lock is
+        acquired.
+
+        """
+        if self._locked:
+            yield
+            return
+        self._acquire()
+        try:
+            yield
+        finally:
+            self._locked = False
+            if self._handle is not None:
+                fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """Reads the changes made by other processes."""
+        try:
+            filestat = os.stat(self.path)
+        except FileNotFoundError:
+            filestat = None
+        if (
+            filestat is None
+            or filestat.st_ino != self._ino
+            or filestat.st_size < self._size
+        ):
+            # compacted, truncated or removed
+            self.close()
+            self._open()
+        else:
+            self._scan()
+
+    def state(self):
+        """Returns a value that changes when the database is modified."""
+        self._refresh()
+        return (self._ino, self._size)
+
+    def decode(self, span):
+        start, end = span
+        return json.loads(self._data(end)[start:end])
+
+    @staticmethod
+    def _line(name, doc_id, value=b""):
+        if "\t" in name or "\n" in name:
+            raise ValueError("Invalid table name %r" % name)
+        return b"%s\t%s\t%s\n" % (name.encode(), doc_id.encode(), value)
+
+    def _put_line(self, name, doc_id, doc, span):
+        """Returns the line that records `doc` as the new version of
+        the document, or None when it is the same as the version at
+        `span`.
+
+        """
+        value = json.dumps(doc).encode()
+        if span is not None and self._data(span[1])[span[0] : span[1]] == value:
+            return None
+        return self._line(name, doc_id, value)
+
+    def _append(self, lines):
+        """Appends `lines` to the file; the lock must be held."""
+        if not lines:
+            return
+        self._handle.write(b"".join(lines))
+        self._handle.flush()
+        self._scan()
+        if self._lines - self._count > max(self.compact_min, self._count):
+            self.compact()
+
+    def compact(self):
+        """Rewrites the file with only the current version of each
+        document.
+
+        """
+        with self.lock():
+            data = self._data(self._size)
+            # a new, empty file: nothing is left from a failed attempt
+            fdesc, tmppath = tempfile.mkstemp(
+                prefix="%s." % os.path.basename(self.path),
+                suffix=".tmp",
+                dir=os.path.dirname(self.path),
+            )
+            os.close(fdesc)
+            handle = None
+            try:
+                # mkstemp() creates the file with mode 0600
+                os.chmod(tmppath, stat.S_IMODE(os.fstat(self._handle.fileno()).st_mode))
+                # the handle is kept to append to the new file
+                # pylint: disable=consider-using-with
+                handle = open(tmppath, "ab+")
+                # the new file is locked before it replaces the current
+                # one, so that the lock is held during the whole
+                # operation; the other processes waiting for the lock on
+                # the current file will reopen the new one
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+                for name, table in self._tables.items():
+                    for doc_id, (start, end) in table.items():
+                        handle.write(self._line(name, doc_id, data[start:end]))
+                handle.flush()
+                os.fsync(handle.fileno())
+                os.replace(tmppath, self.path)
+            except BaseException:
+                if handle is not None:
+                    handle.close()
+                if os.path.exists(tmppath):
+                    os.unlink(tmppath)
+                raise
+            self.close()
+            self._locked = True
+            self._open(handle=handle)
+
+    def read(self):
+        self._refresh()
+        return {name: LogTableData(self, table) for name, table in self._tables.items()}
+
+    def write(self, data):
+        with self.lock():
+            lines = [self._line(name, "") for name in self._tables if name not in data]
+            for name, table in data.items():
+                if isinstance(table, LogTableData) and table.storage is self:
+                    # from read(), unchanged
+                    continue
+                current = self._tables.get(name, {})
+                lines.extend(
+                    self._line(name, doc_id)
+                    for doc_id in current
+                    if doc_id not in table
+                )
+                for doc_id, doc in table.items():
+                    doc_id = str(doc_id)
+                    line = self._put_line(name, doc_id, doc, current.get(doc_id))
+                    if line is not None:
+                        lines.append(line)
+            self._append(lines)
+
+    def changes(self, name, document_id_class=int):
+        """Returns a LogTableChanges instance for the table `name`, to
+        be modified and passed to .commit(); the lock should be held
+        until then (see `lock()`).
+
+        """
+        self._refresh()
+        return LogTableChanges(
+            self, name, self._tables.get(name, {}), document_id_class
+        )
+
+    def commit(self, changes):
+        """Appends the changes recorded in `changes` (a LogTableChanges
+        instance) to the file.
+
+        """
+        name = changes.name
+        if changes.cleared:
+            lines = [self._line(name, "")]
+            current = {}
+        else:
+            current = changes.offsets
+            lines = [
+                self._line(name, str(doc_id))
+                for doc_id in changes.removed
+                if str(doc_id) in current
+            ]
+        for doc_id, doc in changes.docs.items():
+            doc_id = str(doc_id)
+            line = self._put_line(name, doc_id, doc, current.get(doc_id))
+            if line is not None:
+                lines.append(line)
+        with self.lock():
+            self._append(lines)
+
+
+class LogTableData(Mapping):
+
+    """The documents of a table in a LogStorage, as returned by
+    LogStorage.read(); the documents are decoded when accessed.
+
+    """
+
+    def __init__(self, storage, offsets):
+        self.storage = storage
+        self.offsets = offsets
+
+    def __getitem__(self, doc_id):
+        return self.storage.decode(self.offsets[doc_id])
+
+    def __contains__(self, doc_id):
+        return doc_id in self.offsets
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+class LogTableChanges(MutableMapping):
+
+    """The documents of a table in a LogStorage, as passed to the
+    updaters by LogTable._update_table(); the documents are decoded
+    when accessed, and the changes are recorded to be appended by
+    LogStorage.commit().
+
+    The documents that have been accessed are compared with their
+    stored version, so that only those actually modified are written.
+
+    """
+
+    def __init__(self, storage, name, offsets, document_id_class):
+        self.storage = storage
+        self.name = name
+        self.offsets = offsets
+        self.document_id_class = document_id_class
+        self.docs = {}
+        self.removed = set()
+        self.cleared = False
+
+    def _stored(self, doc_id):
+        return (
+            not self.cleared
+            and doc_id not in self.removed
+            and str(doc_id) in self.offsets
+        )
+
+    def __contains__(self, doc_id):
+        return doc_id in self.docs or self._stored(doc_id)
+
+    def __getitem__(self, doc_id):
+        try:
+            return self.docs[doc_id]
+        except KeyError:
+            pass
+        if not self._stored(doc_id):
+            raise KeyError(doc_id)
+        doc = self.docs[doc_id] = self.storage.decode(self.offsets[str(doc_id)])
+        return doc
+
+    def __setitem__(self, doc_id, doc):
+        self.docs[doc_id] = doc
+        self.removed.discard(doc_id)
+
+    def __delitem__(self, doc_id):
+        if doc_id not in self:
+            raise KeyError(doc_id)
+        self.docs.pop(doc_id, None)
+        self.removed.add(doc_id)
+
+    def __iter__(self):
+        if not self.cleared:
+            for doc_id in self.offsets:
+                doc_id = self.document_id_class(doc_id)
+                if doc_id not in self.removed:
+                    yield doc_id
+        for doc_id in list(self.docs):
+            if self.cleared or str(doc_id) not in self.offsets:
+                yield doc_id
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def clear(self):
+        self.cleared = True
+        self.docs.clear()
+        self.removed.clear()
+
+
+class LogTable(Table):
+
+    """A TinyDB table that, when used with a LogStorage, only decodes
+    and writes the documents used by each modification.
+
+    The query cache and the next document ID are reset when the
+    database file has been modified by another process.
+
+    """
+
+    _cache_state = None
+
+    def _storage_state(self):
+        if isinstance(self._storage, LogStorage):
+            return self._storage.state()
+        # A JSON file rewritten by another process may keep the same
+        # size and modification time (its resolution is coarse), hence
+        # the digest of its content
+        try:
+            handle = self._storage._handle
+            handle.seek(0)
+            return hashlib.sha256(handle.read().encode()).digest()
+        except (AttributeError, OSError, ValueError):
+            return None
+
+    def _check_state(self):
+        """Resets the cached values when the database file has been
+        modified by another process; returns True in that case.
+
+        """
+        state = self._storage_state()
+        if state == self._cache_state:
+            return False
+        self.clear_cache()
+        self._next_id = None
+        self._cache_state = state
+        return True
+
+    def search(self, cond):
+        self._check_state()
+        return super().search(cond)
+
+    def insert(self, document):
+        # insert_multiple() gets the document ID while the table is
+        # updated, after the changes from other processes have been read
+        return self.insert_multiple([document])[0]
+
+    def _update_table(self, updater):
+        if not isinstance(self._storage, LogStorage):
+            self._check_state()
+            super()._update_table(updater)
+            self._cache_state = self._storage_state()
+            return
+        # the state is checked and recorded with the lock held, so that
+        # the changes from other processes cannot be missed
+        with self._storage.lock():
+            self._check_state()
+            table = self._storage.changes(self.name, self.document_id_class)
+            updater(table)
+            self._storage.commit(table)
+            self._cache_state = self._storage_state()
+        self.clear_cache()
+
+
+class IndexedTable(LogTable):
+
+    """A TinyDB table with in-memory hash indexes, used to avoid
+    evaluating a query against every document when possible.
+
+    `indexes` is a list of indexes, each one being a tuple of field
+    names (possibly going through lists, e.g., "ports.port"). An index
+    on several fields can also be used for a query on its first
+    field(s).
+
+    The indexes are built when they are first needed and are
+    maintained when the table is modified; they are rebuilt when the
+    database file has been modified by another process.
+
+    The queries are analyzed using their hash values (built by TinyDB
+    for its query cache): equality tests, .one_of() and .any() tests,
+    combined with & and |, can use the indexes. The candidate
+    documents are then tested against the query.
+
+    """
+
+    def __init__(self, storage, name, indexes=(), **kargs):
+        super().__init__(storage, name, **kargs)
+        self.indexes = []
+        for index in indexes:
+            paths = tuple(tuple(field.split(".")) for field in index)
+            # an index on several fields is also an index on its
+            # first field(s)
+            for i in range(len(paths)):
+                if paths[: i + 1] not in self.indexes:
+                    self.indexes.append(paths[: i + 1])
+        self._index = None
+        self._doc_keys = {}
+        self._table = None
+
+    def _check_state(self):
+        if not super()._check_state():
+            return False
+        self._index = None
+        return True
+
+    def _get_index(self):
+        self._check_state()
+        if self._index is None:
+            self._index = {paths: {} for paths in self.indexes}
+            self._doc_keys = {}
+            for doc_id, doc in self._read_table().items():
+                self._index_doc(self.document_id_class(doc_id), doc)
+        return self._index
+
+    def _index_doc(self, doc_id, doc):
+        keys = []
+        for paths, entries in self._index.items():
+            for key in set(
+                cartesian_prod(*(_index_values(doc, path) for path in paths))
+            ):
+                if len(key) == 1:
+                    key = key[0]
+                entries.setdefault(key, set()).add(doc_id)
+                keys.append((paths, key))
+        self._doc_keys[doc_id] = keys
+
+    def _unindex_doc(self, doc_id):
+        for paths, key in self._doc_keys.pop(doc_id, []):
+            entries = self._index[paths]
+            entries[key].discard(doc_id)
+            if not entries[key]:
+                del entries[key]
+
+    def _reindex(self, doc_ids):
+        """Updates the indexes for `doc_ids` after a modification of the
+        table.
+
+        """
+        table, self._table = self._table, None
+        if self._index is None or table is None:
+            return
+        for doc_id in doc_ids:
+            self._unindex_doc(doc_id)
+            if doc_id in table:
+                self._index_doc(doc_id, table[doc_id])
+
+    def _lookup_values(self, path, values):
+        try:
+            entries = self._index[(path,)]
+        except KeyError:
+            return None
+        if not isinstance(values, (tuple, frozenset)):
+            return None
+        result = set()
+        for value in values:
+            if not isinstance(value, INDEX_TYPES):
+                return None
+            result.update(entries.get(value, ()))
+        return result
+
+    def _lookup_and(self, hashvals, prefix):
+        results = []
+        equals = {}
+        hashvals = list(hashvals)
+        while hashvals:
+            hashval = hashvals.pop()
+            if not isinstance(hashval, tuple) or not hashval:
+                continue
+            if hashval[0] == "and":
+                hashvals.extend(hashval[1])
+                continue
+            if hashval[0] == "==" and isinstance(hashval[2], INDEX_TYPES):
+                equals[prefix + hashval[1]] = hashval[2]
+                continue
+            result = self._lookup(hashval, prefix)
+            if result is not None:
+                results.append(result)
+        # use every index that covers the equality tests; the
+        # intersection starts with the smallest set
+        for paths, entries in self._index.items():
+            if equals and all(path in equals for path in paths):
+                key = tuple(equals[path] for path in paths)
+                if len(key) == 1:
+                    key = key[0]
+                results.append(entries.get(key, set()))
+        if not results:
+            return None
+        results.sort(key=len)
+        return set(results[0]).intersection(*results[1:])
+
+    def _lookup(self, hashval, prefix):
+        """Returns the set of the IDs of the documents that may match the
+        query whose hash value is `hashval`, or None when the indexes
+        cannot be used.
+
+        """
+        if not isinstance(hashval, tuple) or not hashval:
+            return None
+        if hashval[0] == "and":
+            return self._lookup_and(hashval[1], prefix)
+        if hashval[0] == "or":
+            result = set()
+            for subhashval in hashval[1]:
+                subresult = self._lookup(subhashval, prefix)
+                if subresult is None:
+                    return None
+                result.update(subresult)
+            return result
+        if hashval[0] == "==":
+            return self._lookup_values(prefix + hashval[1], (hashval[2],))
+        if hashval[0] == "one_of":
+            return self._lookup_values(prefix + hashval[1], hashval[2])
+        if hashval[0] == "any":
+            if isinstance(hashval[2], QueryInstance):
+                return self._lookup(hashval[2]._hash, prefix + hashval[1])
+            return self._lookup_values(prefix + hashval[1], hashval[2])
+        return None
+
+    def _candidates(self, cond):
+        hashval = getattr(cond, "_hash", None)
+        if not self.indexes or not hashval:
+            return None
+        self._get_index()
+        result = self._lookup(hashval, ())
+        if result is None:
+            return None
+        return sorted(result)
+
+    def search(self, cond):
+        self._check_state()
+        cached_results = self._query_cache.get(cond)
+        if cached_results is not None:
+            return cached_results[:]
+        candidates = self._candidates(cond)
+        if candidates is None:
+            return super().search(cond)
+        table = self._read_table()
+        docs = []
+        for doc_id in candidates:
+            doc = table.get(str(doc_id))
+            if doc is not None and cond(doc):
+                docs.append(self.document_class(doc, doc_id))
+        if cond.is_cacheable():
+            self._query_cache[cond] = docs[:]
+        return docs
+
+    def get(self, cond=None, doc_id=None, doc_ids=None):
+        if cond is None or doc_id is not None or doc_ids is not None:
+            return super().get(cond=cond, doc_id=doc_id, doc_ids=doc_ids)
+        candidates = self._candidates(cond)
+        if candidates is None:
+            return super().get(cond=cond)
+        table = self._read_table()
+        for cand_id in candidates:
+            doc = table.get(str(cand_id))
+            if doc is not None and cond(doc):
+                return self.document_class(doc, cand_id)
+        return None
+
+    def _update_table(self, updater):
+        def _updater(table):
+            updater(table)
+            self._table = table
+
+        super()._update_table(_updater)
+
+    def insert_multiple(self, documents):
+        doc_ids = super().insert_multiple(documents)
+        self._reindex(doc_ids)
+        return doc_ids
+
+    def update(self, fields, cond=None, doc_ids=None):
+        candidates = None if doc_ids is not None else self._candidates(cond)
+        if candidates is None:
+            doc_ids = super().update(fields, cond=cond, doc_ids=doc_ids)
+        else:
+            doc_ids = []
+
+            def updater(table):
+                # the candidates are looked up again once the table is
+                # being updated, to include the changes from other
+                # processes
+                for doc_id in self._candidates(cond):
+                    if doc_id in table and cond(table[doc_id]):
+                        doc_ids.append(doc_id)
+                        if callable(fields):
+                            fields(table[doc_id])
+                        else:
+                            table[doc_id].update(fields)
+
+            self._update_table(updater)
+        self._reindex(doc_ids)
+        return doc_ids
+
+    def update_multiple(self, updates):
+        doc_ids = super().update_multiple(updates)
+        self._reindex(doc_ids)
+        return doc_ids
+
+    def remove(self, cond=None, doc_ids=None):
+        candidates = None if doc_ids is not None else self._candidates(cond)
+        if candidates is None:
+            doc_ids = super().remove(cond=cond, doc_ids=doc_ids)
+        else:
+            doc_ids = []
+
+            def updater(table):
+                # see update()
+                for doc_id in self._candidates(cond):
+                    if doc_id in table and cond(table[doc_id]):
+                        doc_ids.append(doc_id)
+                        del table[doc_id]
+
+            self._update_table(updater)
+        self._reindex(doc_ids)
+        return doc_ids
+
+    def truncate(self):
+        super().truncate()
+        self._table = None
+        self._index = None
+
+
 class TinyDB(DB):
 
     """A DB using TinyDB backend"""
 
     flt_empty = EMPTY_QUERY
     no_limit = None
+    # see IndexedTable
+    indexes = []
 
     def __init__(self, url):
         super().__init__()
         self.basepath = url.path
         utils.makedirs(self.basepath)
 
+    def _open_db(self, dbname, indexes=None):
+        """Opens the TinyDB database `dbname`, using a LogStorage when
+        config.TINYDB_LOG_STORAGE is set (an existing JSON file is then
+        converted, and renamed to <dbname>.json.bak).
+
+        """
+        path = os.path.join(self.basepath, "%s.json" % dbname)
+        logpath = os.path.join(self.basepath, "%s.tinylog" % dbname)
+        if not (HAVE_TABLE and HAVE_FCNTL and config.TINYDB_LOG_STORAGE):
+            if os.path.exists(logpath):
+                utils.LOGGER.warning(
+                    "%r exists but is not used (TINYDB_LOG_STORAGE is not set, "
+                    "or not supported): the data it holds is ignored",
+                    logpath,
+                )
+            tdb = TDB(path)
+            if HAVE_TABLE:
+                if config.TINYDB_INDEXES and indexes:
+                    tdb.table_class = partial(IndexedTable, indexes=indexes)
+                else:
+                    tdb.table_class = LogTable
+            return tdb
+        convert = not os.path.exists(logpath) and os.path.exists(path)
+        tdb = TDB(logpath, storage=LogStorage)
+        if convert:
+            storage = JSONStorage(path, access_mode="r")
+            try:
+                data = storage.read()
+            finally:
+                storage.close()
+            if data:
+                tdb.storage.write(data)
+            # so that the JSON file cannot be used by mistake (without
+            # TINYDB_LOG_STORAGE, or by an older IVRE version) while
+            # it is no longer updated
+            os.replace(path, "%s.bak" % path)
+            utils.LOGGER.warning(
+                "%r has been converted to %r, and renamed to %r",
+                path,
+                logpath,
+                "%s.bak" % path,
+            )
+        if config.TINYDB_INDEXES and indexes:
+            tdb.table_class = partial(IndexedTable, indexes=indexes)
+        else:
+            tdb.table_class = LogTable
+        return tdb
+
     @property
     def db(self):
         """The DB"""
         try:
             return self._db
         except AttributeError:
-            self._db = TDB(os.path.join(self.basepath, "%s.json" % self.dbname))
+            self._db = self._open_db(self.dbname, indexes=self.indexes)
             return self._db
 
     def invalidate_cache(self):
@@ -161,26 +1002,20 @@ class TinyDB(DB):
                 return [_extractor(rec, fields) for rec in result]
             return result
 
-        def _cmp(v1, v2):
-            for (k, o) in sort:
-                f1 = v1
-                f2 = v2
-                for sk in k.split("."):
-                    f1 = (f1 or {}).get(sk)
-                    f2 = (f2 or {}).get(sk)
-                if f1 == f2:
-                    continue
-                if f1 is None:
-                    # None is lower than anything
-                    return -o
-                if f2 is None:
-                    return o
-                if f1 < f2:
-                    return -o
-                return o
-            return 0
-
-        result = sorted(result, key=cmp_to_key(_cmp))
+        def _key(subkeys):
+            def _getkey(rec):
+                for sk in subkeys:
+                    rec = (rec or {}).get(sk)
+                # None is lower than anything
+                return (rec is not None, rec)
+
+            return _getkey
+
+        # Python's sort is stable (including with reverse=True), so
+        # sorting by each key, starting with the last one, sorts by
+        # all the keys.
+        for (k, o) in reversed(list(sort)):
+            result.sort(key=_key(k.split(".")), reverse=o < 0)
         if skip is not None:
             result = result[skip:]
         if limit is not None:
@@ -441,6 +1276,8 @@ class TinyDBActive(TinyDB, DBActive):
 
     """
 
+    indexes = [("addr",), ("ports.port",), ("ports.service_name",)]
+
     def _get(self, *args, **kargs):
         for host in self._db_get(*args, **kargs):
             host = deepcopy(host)
@@ -473,7 +1310,11 @@ class TinyDBActive(TinyDB, DBActive):
                     pass
             yield host
 
-    def store_host(self, host):
+    def _host2dbrec(self, host):
+        """Returns a copy of `host`, converted to the format used in the
+        database.
+
+        """
         # `host` may be an instance of Document, and have its own
         # doc_id: convert it to a dict instance instead.
         host = deepcopy(dict(host))
@@ -515,10 +1356,19 @@ class TinyDBActive(TinyDB, DBActive):
             elif isinstance(host[fld], str):
                 host[fld] = utils.all2datetime(host[fld]).timestamp()
         if "_id" not in host:
-            _id = host["_id"] = str(uuid1())
+            host["_id"] = str(uuid1())
+        return host
+
+    def store_host(self, host):
+        host = self._host2dbrec(host)
         self.db.insert(host)
-        utils.LOGGER.debug("HOST STORED: %r in %r", _id, self.dbname)
-        return _id
+        utils.LOGGER.debug("HOST STORED: %r in %r", host["_id"], self.dbname)
+        return host["_id"]
+
+    def store_hosts(self, hosts):
+        hosts = [self._host2dbrec(host) for host in hosts]
+        self.db.insert_multiple(hosts)
+        utils.LOGGER.debug("%d HOSTS STORED in %r", len(hosts), self.dbname)
 
     @staticmethod
     def getscanids(host):
@@ -2200,9 +3050,7 @@ class TinyDBNmap(TinyDBActive, DBNmap):
         try:
             return self._db_scans
         except AttributeError:
-            self._db_scans = TDB(
-                os.path.join(self.basepath, "%s.json" % self.dbname_scans)
-            )
+            self._db_scans = self._open_db(self.dbname_scans)
             return self._db_scans
 
     def init(self):
@@ -2319,6 +3167,7 @@ class TinyDBPassive(TinyDB, DBPassive):
     """A Passive-specific DB using TinyDB backend"""
 
     dbname = "passive"
+    indexes = [("addr",), ("recontype", "source", "value")]
 
     @classmethod
     def rec2internal(cls, rec):
@@ -2925,9 +3774,7 @@ class TinyDBAgent(TinyDB, DBAgent):
         try:
             return self._db_scans
         except AttributeError:
-            self._db_scans = TDB(
-                os.path.join(self.basepath, "%s.json" % self.dbname_scans)
-            )
+            self._db_scans = self._open_db(self.dbname_scans)
             return self._db_scans
 
     @property
@@ -2936,12 +3783,7 @@ class TinyDBAgent(TinyDB, DBAgent):
         try:
             return self._db_masters
         except AttributeError:
-            self._db_masters = TDB(
-                os.path.join(
-                    self.basepath,
-                    "%s.json" % self.dbname_masters,
-                )
-            )
+            self._db_masters = self._open_db(self.dbname_masters)
             return self._db_masters
 
     def init(self):
@@ -3177,6 +4019,7 @@ class TinyDBFlow(TinyDB, DBFlow, metaclass=DBFlowMeta):
     """A Flow-specific DB using TinyDB backend"""
 
     dbname = "flows"
+    indexes = [("src_addr", "dst_addr")]
 
     datefields = [
         "firstseen",
@@ -3284,7 +4127,7 @@ class TinyDBFlow(TinyDB, DBFlow, metaclass=DBFlowMeta):
         if config.FLOW_STORE_METADATA:
             for kind, op in self.meta_kinds.items():
                 for key, value in self.meta_desc[name].get(kind, {}).items():
-                    if not rec[value]:
+                    if not rec.get(value):
                         continue
                     if "%s.%s.%s" % (name, kind, key) in flow.META_DESC_ARRAYS:
                         for val in rec[value]:
@@ -3502,7 +4345,12 @@ class TinyDBFlow(TinyDB, DBFlow, metaclass=DBFlowMeta):
 
         return True
 
-    def cleanup_flows(self):
+    def cleanup_flows(self, bulk=None):
+        """Cleanup flows which source and destination seem to have been
+        switched. Bulks are not used with TinyDB, so `bulk` is ignored
+        and all the flows are considered.
+
+        """
         q = Query()
         res = {}
         flt = q.sports.test(lambda val: len(val) == 1) & (q.dport > 128)
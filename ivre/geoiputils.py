@@ -23,12 +23,27 @@ information about IP addresses (mostly from Maxmind GeoIP files).
 """
 
 
+from bisect import bisect_right
 import codecs
 import csv
+import heapq
+import mmap
 import os.path
+import struct
 import sys
 import tarfile
-from typing import Any, Callable, Dict, Generator, Iterable, List, Optional, Tuple
+import tempfile
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 from urllib.request import build_opener
 import zipfile
 
@@ -279,86 +294,80 @@ class IPRanges:
         overlap.
 
         """
-        self.ranges: Dict[int, Tuple[int, int]] = {}
+        # Three "parallel" lists: for each range, the index (in the
+        # whole IPRanges object) of its first address, its first
+        # address and its length. The first one is sorted and used
+        # with bisect to get an address by its index.
+        self.offsets: List[int] = []
+        self.starts: List[int] = []
+        self.lengths: List[int] = []
         self.length = 0
+        self._sorted = True
         if ranges is not None:
             for rnge in ranges:
                 self.append(*rnge)
 
     def append(self, start: int, stop: int) -> None:
         length = stop - start + 1
-        self.ranges[self.length] = (start, length)
+        if self.starts and start <= self.starts[-1] + self.lengths[-1] - 1:
+            self._sorted = False
+        self.offsets.append(self.length)
+        self.starts.append(start)
+        self.lengths.append(length)
         self.length += int(length)  # in case it's a long
 
+    @property
+    def ranges(self) -> Dict[int, Tuple[int, int]]:
+        """For compatibility: a dict mapping the index of the first
+        address of each range to its (start, length) tuple.
+
+        """
+        return dict(zip(self.offsets, zip(self.starts, self.lengths)))
+
     def union(self, *others: "IPRanges") -> "IPRanges":
+        """Merges (with one sweep over the sorted ranges) `self` and
+        `others` into a new IPRanges object.
+
+        """
         res = IPRanges()
-        gens = [self.iter_int_ranges()] + [o.iter_int_ranges() for o in others]
-        curs = []
-        # We cannot use a `for itr in itrs` loop here because itrs is
-        # modified in the loop.
-        i = 0
-        while i < len(gens):
-            try:
-                curs.append(list(next(gens[i])))
-            except StopIteration:
-                # We need to remove the corresponding generator from
-                # gens, which happens to be the n-th where n is the
-                # current length of next_recs.
-                del gens[len(curs)]  # Do not increment i here
+        cur_start: Optional[int] = None
+        cur_stop = 0
+        for start, stop in heapq.merge(
+            self.iter_int_ranges(), *(o.iter_int_ranges() for o in others)
+        ):
+            if cur_start is None:
+                cur_start, cur_stop = start, stop
+            elif start <= cur_stop + 1:
+                cur_stop = max(cur_stop, stop)
             else:
-                i += 1
-        while curs:
-            cur_range = min(curs, key=lambda k: k[0])
-            while True:
-                # We cannot use a `for i in range(len(itrs))` loop because
-                # itrs is modified in the loop.
-                i = 0
-                cur_range_modified = False
-                while i < len(gens):
-                    needs_continue = False
-                    while curs[i][1] < cur_range[1]:
-                        try:
-                            curs[i] = list(next(gens[i]))
-                        except StopIteration:
-                            del gens[i]
-                            del curs[i]
-                            needs_continue = True
-                            break  # Do not increment i
-                        i += 1
-                    if needs_continue:
-                        continue
-                    if curs[i][0] <= cur_range[1] + 1:
-                        cur_range[1] = curs[i][1]
-                        cur_range_modified = True
-                        try:
-                            curs[i] = list(next(gens[i]))
-                        except StopIteration:
-                            del gens[i]
-                            del curs[i]
-                            continue  # Do not increment i
-                    i += 1
-                if not cur_range_modified:
-                    break
-            res.append(*cur_range)
+                res.append(cur_start, cur_stop)
+                cur_start, cur_stop = start, stop
+        if cur_start is not None:
+            res.append(cur_start, cur_stop)
         return res
 
+    def _iter_start_length(self) -> Iterable[Tuple[int, int]]:
+        if self._sorted:
+            return zip(self.starts, self.lengths)
+        return sorted(zip(self.starts, self.lengths))
+
     def iter_int_ranges(self) -> Generator[Tuple[int, int], None, None]:
-        for start, length in sorted(self.ranges.values()):
+        for start, length in self._iter_start_length():
             yield start, start + length - 1
 
     def iter_ranges(self) -> Generator[Tuple[str, str], None, None]:
-        for start, length in sorted(self.ranges.values()):
+        for start, length in self._iter_start_length():
             yield utils.int2ip(start), utils.int2ip(start + length - 1)
 
     def iter_nets(self) -> Generator[str, None, None]:
-        for start, length in sorted(self.ranges.values()):
+        for start, length in self._iter_start_length():
             for net in utils.range2nets(
                 (utils.int2ip(start), utils.int2ip(start + length - 1))
             ):
                 yield net
 
     def iter_addrs(self) -> Generator[str, None, None]:
-        for start, length in sorted(self.ranges.values()):
+        for start, length in self._iter_start_length():
             for val in range(start, start + length):
                 yield utils.int2ip(val)
 
@@ -366,15 +375,14 @@ class IPRanges:
         return self.length
 
     def __getitem__(self, item: int) -> int:
-        rangeindex = max(k for k in self.ranges if k <= item)
-        item -= rangeindex
-        rnge = self.ranges[rangeindex]
-        if item < rnge[1]:
-            return rnge[0] + item
-        raise IndexError("index out of range")
+        if item < 0 or item >= self.length:
+            raise IndexError("index out of range")
+        rangeindex = bisect_right(self.offsets, item) - 1
+        return self.starts[rangeindex] + item - self.offsets[rangeindex]
 
 
 ConditionCallback = Callable[[List[str]], bool]
+KeyCallback = Callable[[List[str]], str]
 
 
 def _get_by_data(
@@ -395,44 +403,262 @@ def get_ranges_by_data(datafile: str, condition: ConditionCallback) -> IPRanges:
     return rnge
 
 
+# Indexes of the CSV dump files, used to get the ranges for a given
+# key (a country, an AS number, etc.) without reading the whole
+# file. For each dump file, the index name is mapped to a function
+# that gets the key from a (parsed) line.
+DUMP_INDEXES: Dict[str, Dict[str, KeyCallback]] = {
+    "GeoLite2-ASN.dump-IPv4.csv": {"asnum": lambda line: line[2]},
+    "GeoLite2-Country.dump-IPv4.csv": {"country": lambda line: line[2]},
+    "GeoLite2-RegisteredCountry.dump-IPv4.csv": {"country": lambda line: line[2]},
+    "GeoLite2-City.dump-IPv4.csv": {
+        "region": lambda line: "%s,%s" % (line[2], line[3]),
+        "city": lambda line: "%s,%s" % (line[2], line[4]),
+        "location": lambda line: line[5],
+    },
+}
+
+
+class DumpIndex:
+    """Binary index of a CSV dump file (.dump-IPv4.csv), as written by
+    DumpIndex.write().
+
+    The file contains, after a header (magic, number of keys, number
+    of ranges), a table of keys sorted by their UTF-8 value (each
+    entry holds the offset and length of the key value, and the offset
+    and number of its ranges), the ranges (start and stop, grouped by
+    key and sorted), and the key values. All the integers are 32-bit,
+    little-endian, unsigned integers, so the ranges can also be read
+    with NumPy, e.g., numpy.frombuffer(data, dtype="<u4").
+
+    """
+
+    MAGIC = b"IVREIDX\x01"
+    HEADER = struct.Struct("<8sII")
+    ENTRY = struct.Struct("<IIII")
+    RANGE = struct.Struct("<II")
+
+    def __init__(self, fname: str) -> None:
+        self.fname = fname
+        self.data: Union[bytes, mmap.mmap]
+        with open(fname, "rb") as fdesc:
+            try:
+                self.data = mmap.mmap(fdesc.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                self.data = fdesc.read()
+        magic, self.nkeys, self.nranges = self.HEADER.unpack_from(self.data, 0)
+        if magic != self.MAGIC:
+            raise ValueError("Invalid index file %r" % fname)
+        self.ranges_offset = self.HEADER.size + self.nkeys * self.ENTRY.size
+
+    def _entry(self, index: int) -> Tuple[bytes, int, int]:
+        key_offset, key_length, offset, count = self.ENTRY.unpack_from(
+            self.data, self.HEADER.size + index * self.ENTRY.size
+        )
+        return self.data[key_offset : key_offset + key_length], offset, count
+
+    def get(self, key: str) -> List[Tuple[int, int]]:
+        """Returns the (sorted) ranges for `key`, using a binary search
+        in the key table.
+
+        """
+        bkey = key.encode("utf-8")
+        low, high = 0, self.nkeys
+        while low < high:
+            mid = (low + high) // 2
+            cur_key, offset, count = self._entry(mid)
+            if cur_key < bkey:
+                low = mid + 1
+            elif cur_key > bkey:
+                high = mid
+            else:
+                values = struct.unpack_from(
+                    "<%dI" % (2 * count),
+                    self.data,
+                    self.ranges_offset + offset * self.RANGE.size,
+                )
+                return list(zip(values[::2], values[1::2]))
+        return []
+
+    def close(self) -> None:
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    @classmethod
+    def write(cls, fname: str, ranges: Dict[str, List[int]]) -> None:
+        """Writes an index file from `ranges`, a dict mapping each key to
+        a flat list of start, stop values.
+
+        """
+        keys = sorted((key.encode("utf-8"), key) for key in ranges)
+        entries = []
+        offset = 0
+        key_offset = (
+            cls.HEADER.size
+            + len(keys) * cls.ENTRY.size
+            + sum(len(values) for values in ranges.values()) // 2 * cls.RANGE.size
+        )
+        for bkey, key in keys:
+            count = len(ranges[key]) // 2
+            entries.append(cls.ENTRY.pack(key_offset, len(bkey), offset, count))
+            offset += count
+            key_offset += len(bkey)
+        # Several processes may build the same index at the same time
+        # (see get_dump_index()): each one writes its own temporary
+        # file.
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(fname) or ".", delete=False
+        ) as fdesc:
+            try:
+                fdesc.write(cls.HEADER.pack(cls.MAGIC, len(keys), offset))
+                for entry in entries:
+                    fdesc.write(entry)
+                for _, key in keys:
+                    values = ranges[key]
+                    fdesc.write(struct.pack("<%dI" % len(values), *values))
+                for bkey, _ in keys:
+                    fdesc.write(bkey)
+            except BaseException:
+                os.unlink(fdesc.name)
+                raise
+        # NamedTemporaryFile() creates the file with mode 0600; the
+        # index must be readable by the same users as the CSV files
+        # (e.g., the Web server).
+        try:
+            os.chmod(fdesc.name, 0o644)
+            os.replace(fdesc.name, fname)
+        except BaseException:
+            os.unlink(fdesc.name)
+            raise
+
+
+def _index_fname(datafile: str, index: str, path: Optional[str] = None) -> str:
+    if path is None:
+        assert config.GEOIP_PATH is not None
+        path = config.GEOIP_PATH
+    return os.path.join(path, "%s.%s.idx" % (datafile[:-4], index))
+
+
+def build_dump_indexes(datafile: str, path: Optional[str] = None) -> None:
+    """Creates the index files (.<index>.idx) for the CSV dump file
+    `datafile` (a file name in `path`, defaults to GEOIP_PATH),
+    reading it only once.
+
+    """
+    if path is None:
+        assert config.GEOIP_PATH is not None
+        path = config.GEOIP_PATH
+    indexes = DUMP_INDEXES[datafile]
+    values: Dict[str, Dict[str, List[int]]] = {index: {} for index in indexes}
+    with open(os.path.join(path, datafile)) as fdesc:
+        for line in fdesc:
+            line_parsed = line[:-1].split(",")
+            start, stop = int(line_parsed[0]), int(line_parsed[1])
+            for index, keyfunc in indexes.items():
+                values[index].setdefault(keyfunc(line_parsed), []).extend([start, stop])
+    for index, ranges in values.items():
+        DumpIndex.write(_index_fname(datafile, index, path=path), ranges)
+
+
+def get_dump_index(datafile: str, index: str) -> Optional[DumpIndex]:
+    """Returns the DumpIndex `index` for the CSV dump file `datafile`,
+    creating (or updating) the index files when needed. Returns None
+    when the index cannot be used (e.g., when the index files are
+    missing and GEOIP_PATH is not writable).
+
+    """
+    assert config.GEOIP_PATH is not None
+    fname = _index_fname(datafile, index)
+    try:
+        csv_mtime = os.path.getmtime(os.path.join(config.GEOIP_PATH, datafile))
+    except OSError:
+        csv_mtime = None
+    try:
+        if csv_mtime is not None and os.path.getmtime(fname) < csv_mtime:
+            raise OSError("index file %r is outdated" % fname)
+        return DumpIndex(fname)
+    except (OSError, ValueError, struct.error):
+        pass
+    if csv_mtime is None:
+        return None
+    try:
+        build_dump_indexes(datafile)
+        return DumpIndex(fname)
+    except (OSError, ValueError, struct.error):
+        utils.LOGGER.warning(
+            "Cannot use index %r for %r", index, datafile, exc_info=True
+        )
+    return None
+
+
+def get_ranges_by_key(
+    datafile: str, index: str, key: str, condition: ConditionCallback
+) -> IPRanges:
+    """Returns the ranges for `key`, using the index `index` of
+    `datafile` when possible, and reading the whole file, using
+    `condition`, otherwise.
+
+    """
+    idx = get_dump_index(datafile, index)
+    if idx is None:
+        return get_ranges_by_data(datafile, condition)
+    try:
+        return IPRanges(ranges=idx.get(key))
+    finally:
+        idx.close()
+
+
 def get_ranges_by_country(code: str) -> IPRanges:
-    return get_ranges_by_data(
+    return get_ranges_by_key(
         "GeoLite2-Country.dump-IPv4.csv",
+        "country",
+        code,
         lambda line: line[2] == code,
     )
 
 
 def get_ranges_by_registered_country(code: str) -> IPRanges:
-    return get_ranges_by_data(
+    return get_ranges_by_key(
         "GeoLite2-RegisteredCountry.dump-IPv4.csv",
+        "country",
+        code,
         lambda line: line[2] == code,
     )
 
 
 def get_ranges_by_location(locid: int) -> IPRanges:
-    return get_ranges_by_data(
-        "GeoLite2-City.dump-IPv4.csv", lambda line: line[5] == str(locid)
+    return get_ranges_by_key(
+        "GeoLite2-City.dump-IPv4.csv",
+        "location",
+        str(locid),
+        lambda line: line[5] == str(locid),
     )
 
 
 def get_ranges_by_city(country_code: str, city: str) -> IPRanges:
-    return get_ranges_by_data(
+    city = utils.encode_b64((city or "").encode("utf-8")).decode("utf-8")
+    return get_ranges_by_key(
         "GeoLite2-City.dump-IPv4.csv",
-        lambda line: line[2] == country_code
-        and line[4] == utils.encode_b64((city or "").encode("utf-8")).decode("utf-8"),
+        "city",
+        "%s,%s" % (country_code, city),
+        lambda line: line[2] == country_code and line[4] == city,
     )
 
 
 def get_ranges_by_region(country_code: str, reg_code: str) -> IPRanges:
-    return get_ranges_by_data(
+    return get_ranges_by_key(
         "GeoLite2-City.dump-IPv4.csv",
+        "region",
+        "%s,%s" % (country_code, reg_code),
         lambda line: line[2] == country_code and line[3] == reg_code,
     )
 
 
 def get_ranges_by_asnum(asnum: int) -> IPRanges:
-    return get_ranges_by_data(
+    return get_ranges_by_key(
         "GeoLite2-ASN.dump-IPv4.csv",
+        "asnum",
+        str(asnum),
         lambda line: line[2] == str(asnum),
     )
 
@@ -0,0 +1,354 @@
+#! /usr/bin/env python
+
+# This file is part of IVRE.
+# Copyright 2011 - 2021 Pierre LALET <pierre@droids-corp.org>
+#
+# IVRE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# IVRE is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with IVRE. If not, see <http://www.gnu.org/licenses/>.
+
+"""Support for ARP packets in PCAP & PCAP-NG files"""
+
+
+import datetime
+import io
+import mmap
+import socket
+import struct
+from types import TracebackType
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple, Type, Union
+
+
+from ivre import utils
+from ivre.parser import Parser
+
+
+PCAP_MAGICS = {
+    # magic: (endianness, nanosecond resolution)
+    b"\xd4\xc3\xb2\xa1": ("<", False),
+    b"\xa1\xb2\xc3\xd4": (">", False),
+    b"\x4d\x3c\xb2\xa1": ("<", True),
+    b"\xa1\xb2\x3c\x4d": (">", True),
+}
+PCAPNG_MAGIC = b"\x0a\x0d\x0d\x0a"
+PCAPNG_BYTE_ORDER = {
+    b"\x4d\x3c\x2b\x1a": "<",
+    b"\x1a\x2b\x3c\x4d": ">",
+}
+ETHERTYPE_ARP = b"\x08\x06"
+ETHERTYPES_VLAN = {b"\x81\x00", b"\x88\xa8", b"\x91\x00"}
+# link type: (offset of the EtherType, offset of the payload)
+LINK_TYPES = {
+    1: (12, 14),  # Ethernet
+    113: (14, 16),  # Linux cooked capture (SLL)
+    276: (0, 20),  # Linux cooked capture v2 (SLL2)
+}
+# same values as "%ARP.op%" with Scapy, .upper().replace("-", "_")
+ARP_OPS = {
+    1: "WHO_HAS",
+    2: "IS_AT",
+    3: "RARP_REQ",
+    4: "RARP_REP",
+    5: "DYN_RARP_REQ",
+    6: "DYN_RAR_REP",
+    7: "DYN_RARP_ERR",
+    8: "INARP_REQ",
+    9: "INARP_REP",
+}
+
+
+class ArpPcapFile(Parser):
+    """Reader for the ARP packets (over Ethernet, possibly with VLAN
+    tags, or Linux cooked captures) from PCAP or PCAP-NG files, without
+    Scapy.
+
+    The file is mapped in memory, the record headers are read using
+    precompiled structures, and only the ARP frames are decoded. The
+    records have the format used by arp2db.
+
+    A ValueError exception is raised for unsupported files (compressed
+    files, files that cannot be mapped, other link types); use Scapy
+    for those.
+
+    """
+
+    pcap_header_size = 24
+    # hardware type, protocol type, hardware address length, protocol
+    # address length, opcode, sender hardware & protocol addresses,
+    # target hardware & protocol addresses
+    arp = struct.Struct(">HHBBH6B4s6B4s")
+
+    def __init__(self, fdesc: Union[str, BinaryIO]) -> None:
+        """Creates the ArpPcapFile object.
+
+        fdesc: a file-like object or a filename
+
+        """
+        super().__init__(fdesc)
+        self.data: Optional[mmap.mmap] = None
+        try:
+            if not isinstance(self.fdesc, io.BufferedReader):
+                raise ValueError("Compressed file")
+            try:
+                self.data = mmap.mmap(self.fdesc.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError) as exc:
+                raise ValueError("Cannot map file (%s)" % exc) from exc
+            magic = self.data[:4]
+            if magic == PCAPNG_MAGIC:
+                self.check_pcapng()
+                self.frames = self.iter_pcapng_frames()
+            elif magic in PCAP_MAGICS:
+                endian, nano = PCAP_MAGICS[magic]
+                if len(self.data) < self.pcap_header_size:
+                    raise ValueError("File too short")
+                linktype = struct.unpack_from(endian + "20xI", self.data)[0] & 0xFFFF
+                if linktype not in LINK_TYPES:
+                    raise ValueError("Unsupported link type %d" % linktype)
+                self.frames = self.iter_pcap_frames(endian, nano, linktype)
+            else:
+                raise ValueError("Not a PCAP or PCAP-NG file")
+        except Exception:
+            self.close()
+            raise
+        self.records: Optional[Iterator[Dict[str, Any]]] = None
+
+    def __next__(self) -> Dict[str, Any]:
+        if self.records is None:
+            self.records = self.iter_records()
+        return next(self.records)
+
+    def unmap(self) -> None:
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+
+    def close(self) -> None:
+        self.unmap()
+        super().close()
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        self.unmap()
+        super().__exit__(exc_type, exc_val, exc_tb)
+
+    @staticmethod
+    def arp_offset(data: mmap.mmap, offset: int, end: int, linktype: int) -> int:
+        """Returns the offset of the ARP payload in the frame between
+        offset and end, or -1 when the frame is not an ARP packet.
+
+        """
+        type_off, payload_off = LINK_TYPES[linktype]
+        offset += type_off
+        ethertype = data[offset : offset + 2]
+        if linktype == 1:
+            while ethertype in ETHERTYPES_VLAN:
+                offset += 4
+                ethertype = data[offset : offset + 2]
+        if ethertype != ETHERTYPE_ARP:
+            return -1
+        offset += payload_off - type_off
+        if offset + 28 > end:
+            # truncated
+            return -1
+        return offset
+
+    def iter_pcap_frames(
+        self, endian: str, nano: bool, linktype: int
+    ) -> Iterator[Tuple[int, int, int]]:
+        """Yields, for each ARP frame of a PCAP file, a tuple (seconds,
+        microseconds, offset of the ARP payload). Nanosecond timestamps
+        are rounded, so the microseconds can be 1000000.
+
+        """
+        data = self.data
+        assert data is not None
+        datalen = len(data)
+        record_header = struct.Struct(endian + "III4x")
+        type_off = LINK_TYPES[linktype][0]
+        ethertypes = {ETHERTYPE_ARP}
+        if linktype == 1:
+            ethertypes.update(ETHERTYPES_VLAN)
+        arp_offset = self.arp_offset
+        offset = self.pcap_header_size
+        while offset + 16 <= datalen:
+            sec, frac, caplen = record_header.unpack_from(data, offset)
+            start = offset + 16
+            offset = start + caplen
+            if offset > datalen:
+                utils.LOGGER.warning("Truncated PCAP file")
+                return
+            if data[start + type_off : start + type_off + 2] not in ethertypes:
+                continue
+            start = arp_offset(data, start, offset, linktype)
+            if start != -1:
+                yield sec, (frac + 500) // 1000 if nano else frac, start
+
+    def iter_pcapng_blocks(self) -> Iterator[Tuple[str, int, int, int]]:
+        """Yields, for each block of a PCAP-NG file, a tuple
+        (endianness, block type, offset of the block body, offset of
+        the end of the block body).
+
+        """
+        data = self.data
+        assert data is not None
+        datalen = len(data)
+        endian = "<"
+        offset = 0
+        while offset + 12 <= datalen:
+            if data[offset : offset + 4] == PCAPNG_MAGIC:
+                try:
+                    endian = PCAPNG_BYTE_ORDER[data[offset + 8 : offset + 12]]
+                except KeyError:
+                    utils.LOGGER.warning("Invalid PCAP-NG section header")
+                    return
+            btype, blen = struct.unpack_from(endian + "II", data, offset)
+            if blen < 12 or blen % 4 or offset + blen > datalen:
+                utils.LOGGER.warning("Invalid or truncated PCAP-NG block")
+                return
+            yield endian, btype, offset + 8, offset + blen - 4
+            offset += blen
+
+    @staticmethod
+    def pcapng_interface(
+        data: mmap.mmap, endian: str, offset: int, end: int
+    ) -> Tuple[int, int]:
+        """Returns the link type and the timestamp units per second of
+        an interface from its description block.
+
+        """
+        linktype = struct.unpack_from(endian + "H", data, offset)[0]
+        units = 1000000
+        offset += 8
+        while offset + 4 <= end:
+            code, length = struct.unpack_from(endian + "HH", data, offset)
+            if code == 0:
+                break
+            if code == 9 and length == 1:
+                # if_tsresol
+                tsresol = data[offset + 4]
+                if tsresol & 0x80:
+                    units = 1 << (tsresol & 0x7F)
+                else:
+                    units = 10**tsresol
+            offset += 4 + (length + 3) // 4 * 4
+        return linktype, units
+
+    def check_pcapng(self) -> None:
+        """Checks the link types of the interfaces described before
+        the first packet of a PCAP-NG file; raises ValueError when one
+        is not supported.
+
+        """
+        assert self.data is not None
+        for endian, btype, offset, end in self.iter_pcapng_blocks():
+            if btype in {2, 3, 6}:
+                return
+            if btype == 1:
+                linktype = self.pcapng_interface(self.data, endian, offset, end)[0]
+                if linktype not in LINK_TYPES:
+                    raise ValueError("Unsupported link type %d" % linktype)
+
+    def iter_pcapng_frames(self) -> Iterator[Tuple[int, int, int]]:
+        """Yields, for each ARP frame of a PCAP-NG file, a tuple
+        (seconds, microseconds, offset of the ARP payload). Timestamps
+        are rounded to the microsecond, so the microseconds can be
+        1000000.
+
+        Simple packet blocks (which have no timestamp) and packets
+        from interfaces with an unsupported link type (when those
+        interfaces are described after the first packet) are skipped.
+
+        """
+        data = self.data
+        assert data is not None
+        arp_offset = self.arp_offset
+        interfaces: List[Tuple[int, int]] = []
+        for endian, btype, offset, end in self.iter_pcapng_blocks():
+            if btype == 6:
+                # enhanced packet block
+                iface, ts_high, ts_low, caplen = struct.unpack_from(
+                    endian + "IIII", data, offset
+                )
+            elif btype == 2:
+                # (obsolete) packet block
+                iface, ts_high, ts_low, caplen = struct.unpack_from(
+                    endian + "H2xIII", data, offset
+                )
+            elif btype == 1:
+                interfaces.append(self.pcapng_interface(data, endian, offset, end))
+                if interfaces[-1][0] not in LINK_TYPES:
+                    utils.LOGGER.warning(
+                        "Unsupported link type %d, skipping packets",
+                        interfaces[-1][0],
+                    )
+                continue
+            elif btype == 0x0A0D0D0A:
+                # new section
+                interfaces = []
+                continue
+            else:
+                continue
+            try:
+                linktype, units = interfaces[iface]
+            except IndexError:
+                utils.LOGGER.warning("Packet from an unknown interface")
+                continue
+            if linktype not in LINK_TYPES:
+                continue
+            start = offset + 20
+            start = arp_offset(data, start, min(start + caplen, end), linktype)
+            if start == -1:
+                continue
+            timestamp = ts_high << 32 | ts_low
+            yield (
+                timestamp // units,
+                (timestamp % units * 1000000 + units // 2) // units,
+                start,
+            )
+
+    def iter_records(self) -> Iterator[Dict[str, Any]]:
+        """Yields the records for the (IPv4 over Ethernet) ARP packets."""
+        data = self.data
+        assert data is not None
+        unpack_from = self.arp.unpack_from
+        inet_ntoa = socket.inet_ntoa
+        fromtimestamp = datetime.datetime.fromtimestamp
+        macfmt = "%02x:%02x:%02x:%02x:%02x:%02x"
+        last_sec = None
+        base = datetime.datetime.fromtimestamp(0)
+        for sec, usec, offset in self.frames:
+            values = unpack_from(data, offset)
+            if values[1] != 0x0800 or values[2] != 6 or values[3] != 4:
+                continue
+            if usec >= 1000000:
+                # rounded up
+                sec += 1
+                usec -= 1000000
+            if sec != last_sec:
+                base = fromtimestamp(sec)
+                last_sec = sec
+            timestamp = base.replace(microsecond=usec)
+            op = values[4]
+            yield {
+                "dst": inet_ntoa(values[18]),
+                "src": inet_ntoa(values[11]),
+                "mac_src": macfmt % values[5:11],
+                "mac_dst": macfmt % values[12:18],
+                "start_time": timestamp,
+                "end_time": timestamp,
+                "op": ARP_OPS.get(op, str(op)),
+                "proto": "arp",
+            }
@@ -18,12 +18,39 @@
 
 """Support for NetFlow files"""
 
+import bz2
 import datetime
-from typing import Any, BinaryIO, Dict, Optional, Union, cast
+import struct
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+    cast,
+)
+
+
+try:
+    import lz4.block  # type: ignore
+
+    HAVE_LZ4 = True
+except ImportError:
+    HAVE_LZ4 = False
+try:
+    import lzo  # type: ignore
+
+    HAVE_LZO = True
+except ImportError:
+    HAVE_LZO = False
 
 
 from ivre import utils
-from ivre.parser import CmdParser
+from ivre.parser import CmdParser, Parser
 
 
 class NetFlow(CmdParser):
@@ -90,27 +117,39 @@ class NetFlow(CmdParser):
             for name, val in zip(cls.fields, line.decode().split(","))
         )
         fields["proto"] = fields["proto"].lower()
-        srv_idx = None
         if fields["proto"] == "icmp":
-            # Looks like an nfdump anomaly, keeping "0.8" leads to nonsense
-            # flows, whereas switching to "8.0" makes it sane again.
-            if fields["port2"] == "0.8":
-                fields["port2"] = "8.0"
             fields["type"], fields["code"] = [
                 int(x) for x in fields.pop("port2").split(".")
             ]
-            # ICMP 0 is an answer to ICMP 8
-            if fields["type"] == 0:
-                fields["type"] = 8
-                srv_idx = 1
-            else:
-                srv_idx = 2
             del fields["port1"]
         else:
             for field in ["port1", "port2"]:
                 fields[field] = int(fields[field])
         for field in ["start_time", "end_time"]:
             fields[field] = datetime.datetime.strptime(fields[field], cls.timefmt)
+        for field in ["pkts1", "pkts2", "bytes1", "bytes2"]:
+            fields[field] = cls.str2int(fields[field])
+        return cls.fix_record(fields)
+
+    @staticmethod
+    def fix_record(fields: Dict[str, Any]) -> Dict[str, Any]:
+        """Converts a NetFlow record, with the fields from nfdump
+        (converted to int or datetime), to the format used by
+        flow2flow().
+
+        """
+        srv_idx = None
+        if fields["proto"] == "icmp":
+            # Looks like an nfdump anomaly, keeping "0.8" leads to nonsense
+            # flows, whereas switching to "8.0" makes it sane again.
+            if fields["type"] == 0 and fields["code"] == 8:
+                fields["type"], fields["code"] = 8, 0
+            # ICMP 0 is an answer to ICMP 8
+            if fields["type"] == 0:
+                fields["type"] = 8
+                srv_idx = 1
+            else:
+                srv_idx = 2
         if srv_idx is None:
             srv_idx = (
                 1
@@ -132,8 +171,341 @@ class NetFlow(CmdParser):
             fields["flow_name"] = "%(proto)s %(type)s" % fields
         else:
             fields["flow_name"] = fields["proto"]
-        fields["scbytes"] = cls.str2int(fields.pop("bytes%d" % cli_idx))
-        fields["scpkts"] = cls.str2int(fields.pop("pkts%d" % cli_idx))
-        fields["csbytes"] = cls.str2int(fields.pop("bytes%d" % srv_idx))
-        fields["cspkts"] = cls.str2int(fields.pop("pkts%d" % srv_idx))
+        fields["scbytes"] = fields.pop("bytes%d" % cli_idx)
+        fields["scpkts"] = fields.pop("pkts%d" % cli_idx)
+        fields["csbytes"] = fields.pop("bytes%d" % srv_idx)
+        fields["cspkts"] = fields.pop("pkts%d" % srv_idx)
         return fields
+
+
+# nfdump protocol names (as displayed by nfdump with %pr), for the
+# most common protocols
+PROTOCOLS = {
+    1: "ICMP",
+    2: "IGMP",
+    4: "IPIP",
+    6: "TCP",
+    17: "UDP",
+    41: "IPv6",
+    47: "GRE",
+    50: "ESP",
+    51: "AH",
+    58: "ICMP6",
+    89: "OSPF",
+    103: "PIM",
+    112: "VRRP",
+    132: "SCTP",
+}
+
+# nfcapd files (nfdump's "layout version 1")
+NFCAPD_MAGIC = 0xA50C
+NFCAPD_FLAG_LZO = 0x1
+NFCAPD_FLAG_BZ2 = 0x8
+NFCAPD_FLAG_LZ4 = 0x10
+# the maximum size of an uncompressed data block
+NFCAPD_BUFFSIZE = 5 * 1048576
+
+
+class NfcapdFile(Parser):
+    """Reader for nfcapd files (as written by nfcapd or nfdump 1.6,
+    from NetFlow v5 / v9 or IPFIX data), without nfdump.
+
+    The records are decoded using precompiled structures (one for each
+    record layout), and aggregated like `nfdump -a` does (by
+    protocol, addresses and ports), which is why the records are only
+    available once the whole file has been read. They are returned in
+    the same format as the records from `NetFlow`.
+
+    A ValueError exception is raised for unsupported files (other
+    nfdump layouts, LZO or LZ4 compression without the lzo or lz4
+    Python module); use `NetFlow` (which runs nfdump) for those.
+
+    """
+
+    file_header = struct.Struct("<HHII128s")
+    stat_record_size = 136
+    block_header = struct.Struct("<IIHH")
+    record_header = struct.Struct("<HH")
+    # type, size, flags, ext_map, msec_first, msec_last, first, last,
+    # fwd_status, tcp_flags, prot, tos, srcport, dstport
+    common_record = struct.Struct("<HHHHHHIIBBBBHH")
+    # exporter_sysid, biFlowDir and flowEndReason follow
+    common_record_size = 32
+    # sizes of the optional extensions (nfdump's extension_descriptor),
+    # up to the ones we use
+    extension_sizes = {
+        4: 4,
+        5: 8,
+        6: 4,
+        7: 8,
+        8: 4,
+        9: 4,
+        10: 16,
+        11: 4,
+        12: 16,
+        13: 4,
+        14: 4,
+        15: 8,
+        16: 4,
+        17: 8,
+    }
+    out_pkts_extensions = {14: "I", 15: "Q"}
+    out_bytes_extensions = {16: "I", 17: "Q"}
+    # record flags
+    flag_ipv6 = 0x1
+    flag_pkts_64 = 0x2
+    flag_bytes_64 = 0x4
+
+    def __init__(
+        self, fdesc: Union[str, BinaryIO], pcap_filter: Optional[str] = None
+    ) -> None:
+        """Creates the NfcapdFile object.
+
+        fdesc: a file-like object or a filename
+        pcap_filter: not supported (must be None)
+
+        """
+        if pcap_filter is not None:
+            raise ValueError("Filters are not supported by NfcapdFile")
+        super().__init__(fdesc)
+        try:
+            data = self.fdesc.read(self.file_header.size + self.stat_record_size)
+            if len(data) < self.file_header.size + self.stat_record_size:
+                raise ValueError("File too short")
+            magic, version, flags, _, _ = self.file_header.unpack_from(data)
+            if magic != NFCAPD_MAGIC or version != 1:
+                raise ValueError(
+                    "Unsupported file (magic %04x, version %d)" % (magic, version)
+                )
+            self.decompress: Optional[Callable[[bytes], bytes]]
+            if flags & NFCAPD_FLAG_LZO:
+                if not HAVE_LZO:
+                    raise ValueError("LZO compressed file, lzo module missing")
+                self.decompress = lambda data: cast(
+                    bytes, lzo.decompress(data, False, NFCAPD_BUFFSIZE)
+                )
+            elif flags & NFCAPD_FLAG_BZ2:
+                self.decompress = bz2.decompress
+            elif flags & NFCAPD_FLAG_LZ4:
+                if not HAVE_LZ4:
+                    raise ValueError("LZ4 compressed file, lz4 module missing")
+                self.decompress = lambda data: cast(
+                    bytes, lz4.block.decompress(data, uncompressed_size=NFCAPD_BUFFSIZE)
+                )
+            else:
+                self.decompress = None
+        except Exception:
+            self.close()
+            raise
+        self.maps: Dict[int, List[int]] = {}
+        self.layouts: Dict[Tuple[int, int], Tuple[struct.Struct, int, int]] = {}
+        self.records: Optional[Iterator[Dict[str, Any]]] = None
+
+    def __next__(self) -> Dict[str, Any]:
+        if self.records is None:
+            self.records = self.iter_records()
+        return next(self.records)
+
+    def read_blocks(self) -> Iterator[bytes]:
+        """Yields the (uncompressed) content of the data blocks"""
+        while True:
+            header = self.fdesc.read(self.block_header.size)
+            if len(header) < self.block_header.size:
+                return
+            _, size, block_id, _ = self.block_header.unpack(header)
+            data = self.fdesc.read(size)
+            if len(data) < size:
+                utils.LOGGER.warning("Truncated nfcapd file")
+                return
+            if block_id != 2:
+                # not a data block
+                continue
+            if self.decompress is not None:
+                data = self.decompress(data)
+            yield data
+
+    def layout(self, flags: int, map_id: int) -> Tuple[struct.Struct, int, int]:
+        """Returns the structure used to decode the data of a record
+        (after the common part), and the indexes of the output
+        packets and bytes in the decoded values (-1 when missing).
+
+        """
+        fmt = ["<", "QQQQ" if flags & self.flag_ipv6 else "II"]
+        fmt.append("Q" if flags & self.flag_pkts_64 else "I")
+        fmt.append("Q" if flags & self.flag_bytes_64 else "I")
+        nvalues = 6 if flags & self.flag_ipv6 else 4
+        out_pkts = out_bytes = -1
+        for ext_id in self.maps.get(map_id, []):
+            if out_pkts != -1 and out_bytes != -1:
+                break
+            if ext_id in self.out_pkts_extensions:
+                fmt.append(self.out_pkts_extensions[ext_id])
+                out_pkts = nvalues
+                nvalues += 1
+            elif ext_id in self.out_bytes_extensions:
+                fmt.append(self.out_bytes_extensions[ext_id])
+                out_bytes = nvalues
+                nvalues += 1
+            elif ext_id in self.extension_sizes:
+                fmt.append("%dx" % self.extension_sizes[ext_id])
+            else:
+                # unknown size, following extensions cannot be read
+                break
+        return struct.Struct("".join(fmt)), out_pkts, out_bytes
+
+    def iter_raw_records(self) -> Iterator[Tuple[Any, ...]]:
+        """Yields, for each flow record, a tuple ((prot, ipv6, srcaddr,
+        dstaddr, srcport, dstport), first, last, pkts, bytes,
+        out_pkts, out_bytes, tcp_flags), where first and last are in
+        milliseconds.
+
+        """
+        common_record = self.common_record
+        common_record_size = self.common_record_size
+        record_header = self.record_header
+        layouts = self.layouts
+        for data in self.read_blocks():
+            offset = 0
+            datalen = len(data)
+            while offset + record_header.size <= datalen:
+                rec_type, rec_size = record_header.unpack_from(data, offset)
+                if rec_size < record_header.size:
+                    utils.LOGGER.warning("Invalid record size in nfcapd file")
+                    break
+                if rec_type == 10:
+                    (
+                        _,
+                        _,
+                        flags,
+                        map_id,
+                        msec_first,
+                        msec_last,
+                        first,
+                        last,
+                        _,
+                        tcp_flags,
+                        prot,
+                        _,
+                        srcport,
+                        dstport,
+                    ) = common_record.unpack_from(data, offset)
+                    try:
+                        layout, out_pkts, out_bytes = layouts[flags & 7, map_id]
+                    except KeyError:
+                        layout, out_pkts, out_bytes = layouts[
+                            flags & 7, map_id
+                        ] = self.layout(flags, map_id)
+                    values = layout.unpack_from(data, offset + common_record_size)
+                    if flags & self.flag_ipv6:
+                        key = (
+                            prot,
+                            True,
+                            values[0] << 64 | values[1],
+                            values[2] << 64 | values[3],
+                            srcport,
+                            dstport,
+                        )
+                        pkts, nbytes = values[4:6]
+                    else:
+                        key = (prot, False, values[0], values[1], srcport, dstport)
+                        pkts, nbytes = values[2:4]
+                    yield (
+                        key,
+                        first * 1000 + msec_first,
+                        last * 1000 + msec_last,
+                        pkts,
+                        nbytes,
+                        0 if out_pkts == -1 else values[out_pkts],
+                        0 if out_bytes == -1 else values[out_bytes],
+                        tcp_flags,
+                    )
+                elif rec_type == 2:
+                    # extension map
+                    map_id = struct.unpack_from("<H", data, offset + 4)[0]
+                    ext_ids = struct.unpack_from(
+                        "<%dH" % ((rec_size - 8) // 2), data, offset + 8
+                    )
+                    if 0 in ext_ids:
+                        ext_ids = ext_ids[: ext_ids.index(0)]
+                    self.maps[map_id] = list(ext_ids)
+                    self.layouts = layouts = {}
+                offset += rec_size
+
+    def iter_records(self) -> Iterator[Dict[str, Any]]:
+        """Yields the records, aggregated like `nfdump -a` does."""
+        flows: Dict[Tuple[int, bool, int, int, int, int], List[int]] = {}
+        for (
+            key,
+            first,
+            last,
+            pkts,
+            nbytes,
+            out_pkts,
+            out_bytes,
+            tcp_flags,
+        ) in self.iter_raw_records():
+            if key in flows:
+                flw = flows[key]
+                if first < flw[0]:
+                    flw[0] = first
+                if last > flw[1]:
+                    flw[1] = last
+                flw[2] += pkts
+                flw[3] += nbytes
+                flw[4] += out_pkts
+                flw[5] += out_bytes
+                flw[6] |= tcp_flags
+            else:
+                flows[key] = [first, last, pkts, nbytes, out_pkts, out_bytes, tcp_flags]
+        fromtimestamp = datetime.datetime.fromtimestamp
+        timedelta = datetime.timedelta
+        for (prot, ipv6, srcaddr, dstaddr, srcport, dstport), (
+            first,
+            last,
+            pkts,
+            nbytes,
+            out_pkts,
+            out_bytes,
+            tcp_flags,
+        ) in flows.items():
+            int2ip = utils.int2ip6 if ipv6 else utils.int2ip
+            fields: Dict[str, Any] = {
+                "start_time": fromtimestamp(first // 1000)
+                + timedelta(milliseconds=first % 1000),
+                "end_time": fromtimestamp(last // 1000)
+                + timedelta(milliseconds=last % 1000),
+                "proto": PROTOCOLS.get(prot, str(prot)).lower(),
+                "addr1": int2ip(srcaddr),
+                "addr2": int2ip(dstaddr),
+                "pkts1": out_pkts,
+                "pkts2": pkts,
+                "bytes1": out_bytes,
+                "bytes2": nbytes,
+                "flags": "".join(
+                    char if tcp_flags & (1 << bit) else "."
+                    for bit, char in zip(range(5, -1, -1), "UAPRSF")
+                ),
+            }
+            if prot == 1:
+                fields["type"], fields["code"] = dstport >> 8, dstport & 0xFF
+            else:
+                fields["port1"], fields["port2"] = srcport, dstport
+            yield NetFlow.fix_record(fields)
+
+
+def netflow_parser(
+    fdesc: Union[str, BinaryIO], pcap_filter: Optional[str] = None
+) -> Union[NfcapdFile, NetFlow]:
+    """Returns a parser for a NetFlow (nfcapd) file: an NfcapdFile
+    instance when possible, a NetFlow instance (which runs nfdump)
+    otherwise.
+
+    """
+    if pcap_filter is None and isinstance(fdesc, str):
+        try:
+            return NfcapdFile(fdesc)
+        except ValueError as exc:
+            utils.LOGGER.debug(
+                "Cannot read %r without nfdump (%s), using nfdump", fdesc, exc
+            )
+    return NetFlow(fdesc, pcap_filter=pcap_filter)
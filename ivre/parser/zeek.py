@@ -18,9 +18,23 @@
 
 """Support for Zeek log files"""
 
+from collections import deque
 import datetime
+import json
+import os
 import re
-from typing import Any, BinaryIO, Dict, List, Optional, Tuple, Union
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
 
 from ivre.parser import Parser
@@ -28,14 +42,70 @@ from ivre.utils import LOGGER, decode_hex
 
 
 CONTAINER_TYPE = re.compile(b"^(table|set|vector)\\[([a-z]+)\\]$")
+Converter = Callable[[bytes], Any]
+# Size of the chunks read from JSON logs
+JSON_CHUNK_SIZE = 1 << 20
+
+
+def _json_time(val: Union[int, float, str]) -> datetime.datetime:
+    """Converts a timestamp from a Zeek JSON log (depending on
+    LogAscii::json_timestamps: seconds since epoch, ISO 8601 string or
+    milliseconds since epoch) to the value used for TSV logs.
+
+    """
+    if isinstance(val, str):
+        if val.endswith("Z"):
+            val = val[:-1]
+        value = datetime.datetime.strptime(
+            val, "%Y-%m-%dT%H:%M:%S.%f" if "." in val else "%Y-%m-%dT%H:%M:%S"
+        )
+        return datetime.datetime.fromtimestamp(
+            value.replace(tzinfo=datetime.timezone.utc).timestamp()
+        )
+    if isinstance(val, int) and val > 100000000000:
+        return datetime.datetime.fromtimestamp(val / 1000.0)
+    return datetime.datetime.fromtimestamp(val)
 
 
 class ZeekFile(Parser):
-    """Zeek log generator"""
+    """Zeek log generator, for logs written using the default TSV
+    format or using JSON (one record per line, detected from the
+    first line). The records read from JSON logs are normalized to
+    match the ones read from TSV logs: the fields of type time are
+    converted and the omitted (unset) fields are set to None, when
+    they appear in another record of the same chunk or of a previous
+    one.
+
+    """
 
     int_types = set([b"port", b"count"])
     float_types = set([b"interval"])
     time_types = set([b"time"])
+    # JSON logs do not carry the types of the fields: these are the
+    # fields of type time in the logs written by Zeek's default
+    # scripts
+    json_time_fields = set(
+        [
+            "ts",
+            "certificate.not_valid_after",
+            "certificate.not_valid_before",
+            "compile_ts",
+            "from",
+            "nextUpdate",
+            "org_time",
+            "rec_time",
+            "ref_time",
+            "revoketime",
+            "thisUpdate",
+            "till",
+            "times.accessed",
+            "times.changed",
+            "times.created",
+            "times.modified",
+            "up_since",
+            "xmt_time",
+        ]
+    )
 
     def __init__(self, fname: Union[BinaryIO, str]) -> None:
         self.sep = b" "  # b"\t"
@@ -45,21 +115,40 @@ class ZeekFile(Parser):
         self.fields: List[bytes] = []
         self.types: List[bytes] = []
         self.path: Optional[str] = None
-        self.nextlines = []
+        self.nextlines: Deque[bytes] = deque()
+        self._converters: Optional[List[Tuple[str, Converter]]] = None
+        self.json = False
+        self.records: Deque[Dict[str, Any]] = deque()
+        self._json_keys: Dict[str, Optional[str]] = {}
+        # the fields seen so far in a JSON log (used as an ordered set)
+        self._json_fields: Dict[str, None] = {}
+        self._json_buffer = b""
         super().__init__(fname)
         for line in self.fdesc:
             line = line.strip()
             if not line.startswith(b"#"):
-                self.nextlines.append(line)
+                if line.startswith(b"{"):
+                    self.json = True
+                    self._json_buffer = line + b"\n"
+                else:
+                    self.nextlines.append(line)
                 break
             self.parse_header_line(line)
+        if self.json and self.path is None and isinstance(fname, str):
+            # JSON logs have no #path header, use the file name
+            # (e.g., conn.log, conn.00:00:00-01:00:00.log.gz)
+            self.path = os.path.basename(fname).split(".", 1)[0]
 
     def __enter__(self) -> "ZeekFile":
         return self
 
     def __next__(self) -> Dict[str, Any]:
+        if self.json:
+            if not self.records and not self._fill_records():
+                raise StopIteration
+            return self.records.popleft()
         return self.parse_line(
-            self.nextlines.pop(0) if self.nextlines else next(self.fdesc).strip()
+            self.nextlines.popleft() if self.nextlines else next(self.fdesc).strip()
         )
 
     def parse_header_line(self, line: bytes) -> None:
@@ -79,6 +168,8 @@ class ZeekFile(Parser):
 
         directive = keyval[0]
         arg = keyval[1]
+        # the converters depend on the fields, types and special values
+        self._converters = None
 
         if directive == b"separator":
             self.sep = decode_hex(arg[2:]) if arg.startswith(b"\\x") else arg
@@ -97,39 +188,273 @@ class ZeekFile(Parser):
         elif directive == b"types":
             self.types = arg.split(self.sep)
 
+    @property
+    def converters(self) -> List[Tuple[str, Converter]]:
+        """The (key, converter) pairs for the current fields, computed
+        once for each header.
+
+        """
+        if self._converters is None:
+            self._converters = [
+                (name.replace(b".", b"_").decode(), self.converter(typ))
+                for name, typ in zip(self.fields, self.types)
+            ]
+        return self._converters
+
+    def converter(self, typ: bytes) -> Converter:
+        """Returns a function that converts a value of type `typ` (see
+        .fix_value()).
+
+        """
+        unset_field = self.unset_field
+        empty_field = self.empty_field
+        if typ == b"bool":
+
+            def convert_bool(val: bytes) -> Optional[bool]:
+                if val == unset_field:
+                    return None
+                return val == b"T"
+
+            return convert_bool
+        container_type = CONTAINER_TYPE.search(typ)
+        if container_type is not None:
+            convert_elt = self.converter(container_type.group(2))
+            set_sep = self.set_sep
+
+            def convert_container(val: bytes) -> Optional[List[Any]]:
+                if val == unset_field:
+                    return None
+                if val == empty_field:
+                    return []
+                return [convert_elt(x) for x in val.split(set_sep)]
+
+            return convert_container
+        if typ in self.int_types:
+
+            def convert_int(val: bytes) -> Optional[int]:
+                if val == unset_field:
+                    return None
+                return int(val)
+
+            return convert_int
+        if typ in self.float_types:
+
+            def convert_float(val: bytes) -> Optional[float]:
+                if val == unset_field:
+                    return None
+                return float(val)
+
+            return convert_float
+        if typ in self.time_types:
+            fromtimestamp = datetime.datetime.fromtimestamp
+
+            def convert_time(val: bytes) -> Optional[datetime.datetime]:
+                if val == unset_field:
+                    return None
+                return fromtimestamp(float(val))
+
+            return convert_time
+
+        def convert_str(val: bytes) -> Optional[str]:
+            if val == unset_field:
+                return None
+            if val == empty_field:
+                return ""
+            return val.decode()
+
+        return convert_str
+
     def parse_line(self, line: bytes) -> Dict[str, Any]:
         if line.startswith(b"#"):
             self.parse_header_line(line)
             return next(self)
-        res = {}
-        fields = line.split(self.sep)
+        return {
+            key: convert(field)
+            for (key, convert), field in zip(self.converters, line.split(self.sep))
+        }
+
+    def _next_raw_line(self) -> Optional[bytes]:
+        if self.nextlines:
+            return self.nextlines.popleft()
+        line = next(self.fdesc, None)
+        if line is None:
+            return None
+        return line.strip()
+
+    def _json_key(self, key: str) -> Optional[str]:
+        """Returns the key used in the records for the key `key` of a
+        JSON log, or None when it should be dropped (e.g., _path and
+        _write_ts added by the json-streaming-logs package).
+
+        """
+        try:
+            return self._json_keys[key]
+        except KeyError:
+            pass
+        newkey = None if key.startswith("_") else key.replace(".", "_")
+        self._json_keys[key] = newkey
+        return newkey
+
+    def _json_record(self, rec: Dict[str, Any]) -> Dict[str, Any]:
+        """Normalizes a record read from a JSON log so that it looks
+        like the ones read from TSV logs.
+
+        """
+        result = {}
+        for key, value in rec.items():
+            newkey = self._json_key(key)
+            if newkey is None:
+                continue
+            if key in self.json_time_fields:
+                value = _json_time(value)
+            result[newkey] = value
+        return result
+
+    def _fill_records(self) -> bool:
+        """Reads a chunk of a JSON log and adds the records to
+        `.records`. Returns False when there is nothing left to read.
+
+        """
+        while True:
+            data = self.fdesc.read(JSON_CHUNK_SIZE)
+            if data:
+                data = self._json_buffer + data
+                idx = data.rfind(b"\n") + 1
+                if not idx:
+                    # no complete line yet
+                    self._json_buffer = data
+                    continue
+                self._json_buffer = data[idx:]
+                data = data[:idx]
+            else:
+                data = self._json_buffer
+                self._json_buffer = b""
+                if not data.strip():
+                    return False
+            lines = [line for line in data.split(b"\n") if line.strip()]
+            if not lines:
+                continue
+            try:
+                records = json.loads(b"[%s]" % b",".join(lines))
+            except ValueError:
+                records = []
+                for line in lines:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        LOGGER.warning("Invalid JSON line %r", line)
+            if not records:
+                continue
+            if self.path is None and "_path" in records[0]:
+                self.path = records[0]["_path"]
+            records = [self._json_record(rec) for rec in records]
+            # unset fields are omitted in JSON logs: set them to None,
+            # as in TSV logs
+            fields = self._json_fields
+            for rec in records:
+                for key in rec:
+                    if key not in fields:
+                        fields[key] = None
+            for rec in records:
+                if len(rec) < len(fields):
+                    for key in fields:
+                        rec.setdefault(key, None)
+            self.records.extend(records)
+            return True
+
+    def read_records(self, count: int = 1000) -> List[Dict[str, Any]]:
+        """Returns a list of (at most `count`) records, parsed like
+        the ones returned when iterating over the file. An empty list
+        means that there is no more record to read.
+
+        """
+        records: List[Dict[str, Any]] = []
+        if self.json:
+            while len(self.records) < count and self._fill_records():
+                pass
+            while self.records and len(records) < count:
+                records.append(self.records.popleft())
+            return records
+        sep = self.sep
+        converters = self.converters
+        while len(records) < count:
+            line = self._next_raw_line()
+            if line is None:
+                break
+            if line.startswith(b"#"):
+                self.parse_header_line(line)
+                sep = self.sep
+                converters = self.converters
+                continue
+            records.append(
+                {
+                    key: convert(field)
+                    for (key, convert), field in zip(converters, line.split(sep))
+                }
+            )
+        return records
+
+    def read_columns(self, count: int = 1000) -> Dict[str, List[Any]]:
+        """Returns (at most `count`) records, as a dict of lists of
+        values (one for each field). Since all the records of a chunk
+        have the same fields, a chunk stops when a new header
+        changes the fields. An empty dict means that there is no more
+        record to read.
 
-        for field, name, typ in zip(fields, self.fields, self.types):
-            res[name.replace(b".", b"_").decode()] = self.fix_value(field, typ)
-        return res
+        """
+        columns: Dict[str, List[Any]] = {}
+        if self.json:
+            records = self.read_records(count)
+            for rec in records:
+                for key in rec:
+                    if key not in columns:
+                        columns[key] = [record.get(key) for record in records]
+            return columns
+        appenders: List[Tuple[Callable[[Any], None], Converter]] = []
+        nfields = 0
+        read = 0
+        while read < count:
+            line = self._next_raw_line()
+            if line is None:
+                break
+            if line.startswith(b"#"):
+                if read:
+                    self.nextlines.appendleft(line)
+                    break
+                self.parse_header_line(line)
+                continue
+            if not read:
+                columns = {key: [] for key, _ in self.converters}
+                appenders = [
+                    (columns[key].append, convert) for key, convert in self.converters
+                ]
+                nfields = len(appenders)
+            fields = line.split(self.sep)
+            if len(fields) < nfields:
+                fields.extend([self.unset_field] * (nfields - len(fields)))
+            for (append, convert), field in zip(appenders, fields):
+                append(convert(field))
+            read += 1
+        return columns
+
+    def iter_records(self, count: int = 1000) -> Iterator[Dict[str, Any]]:
+        """Like iterating over the file, but `count` lines are read
+        and parsed at once.
+
+        """
+        while True:
+            records = self.read_records(count)
+            if not records:
+                return
+            yield from records
 
     def fix_value(
         self, val: bytes, typ: bytes
     ) -> Optional[Union[bool, str, int, float, datetime.datetime, list]]:
-        if val == self.unset_field:
-            return None
-        if typ == b"bool":
-            return val == b"T"
-        container_type = CONTAINER_TYPE.search(typ)
-        if container_type is not None:
-            if val == self.empty_field:
-                return []
-            _, elt_type = container_type.groups()
-            return [self.fix_value(x, elt_type) for x in val.split(self.set_sep)]
-        if typ in self.int_types:
-            return int(val)
-        if typ in self.float_types:
-            return float(val)
-        if typ in self.time_types:
-            return datetime.datetime.fromtimestamp(float(val))
-        if val == self.empty_field:
-            return ""
-        return val.decode()
+        value: Optional[
+            Union[bool, str, int, float, datetime.datetime, list]
+        ] = self.converter(typ)(val)
+        return value
 
     @property
     def field_types(self) -> List[Tuple[bytes, bytes]]:
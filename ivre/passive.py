@@ -22,13 +22,20 @@
 """
 
 
+from bisect import bisect_right
+from collections import OrderedDict
+from copy import deepcopy
+import atexit
 import hashlib
+import os
+import pickle
 import re
 import struct
 import binascii
+import tempfile
 
 
-from ivre import utils, config
+from ivre import VERSION, utils, config
 from ivre.analyzer import ntlm
 from ivre.data import scanners
 
@@ -208,14 +215,66 @@ def _prepare_rec_ntlm(spec, new_recontype):
     yield spec
 
 
+class IgnoreRanges:
+    """Address ranges, as compiled by compile_ignorenets(): `starts`
+    and `stops` are two sorted lists, the first and last addresses (as
+    integers) of the (merged) ranges.
+
+    """
+
+    __slots__ = ["starts", "stops"]
+
+    def __init__(self, starts, stops):
+        self.starts = starts
+        self.stops = stops
+
+    def __contains__(self, addr):
+        idx = bisect_right(self.starts, addr) - 1
+        return idx >= 0 and addr <= self.stops[idx]
+
+
+def compile_ignorenets(ignorenets):
+    """Compiles the IGNORENETS rules (a dict mapping recontypes to
+    lists of (start, stop) address ranges, as strings or integers) to
+    a dict mapping recontypes to IgnoreRanges instances, to be used by
+    _prepare_rec().
+
+    """
+    result = {}
+    for recontype, ranges in ignorenets.items():
+        starts = []
+        stops = []
+        for start, stop in sorted(
+            (utils.force_ip2int(start), utils.force_ip2int(stop))
+            for start, stop in ranges
+        ):
+            if stops and start <= stops[-1] + 1:
+                if stop > stops[-1]:
+                    stops[-1] = stop
+                continue
+            starts.append(start)
+            stops.append(stop)
+        result[recontype] = IgnoreRanges(starts, stops)
+    return result
+
+
 def _prepare_rec(spec, ignorenets, neverignore):
     # First of all, let's see if we are supposed to ignore this spec,
-    # and if so, do so.
+    # and if so, do so. ignorenets must have been compiled by
+    # compile_ignorenets().
     if "addr" in spec and spec.get("source") not in neverignore.get(
         spec["recontype"], []
     ):
-        for start, stop in ignorenets.get(spec["recontype"], []):
-            if start <= utils.force_ip2int(spec["addr"]) <= stop:
+        try:
+            ranges = ignorenets[spec["recontype"]]
+        except KeyError:
+            pass
+        else:
+            if not isinstance(ranges, IgnoreRanges):
+                raise TypeError(
+                    "IGNORENETS rules must be compiled by compile_ignorenets()"
+                )
+            if utils.force_ip2int(spec["addr"]) in ranges:
                 return
     # Then, let's clean up the records.
     # Change Symantec's random user agents (matching SYMANTEC_UA) to
@@ -732,14 +791,144 @@ _GETINFOS_FUNCTIONS = {
 }
 
 
+_GETINFOS_CACHE = OrderedDict()
+_GETINFOS_CACHE_STATS = {"hits": 0, "misses": 0}
+_GETINFOS_CACHE_LOADED = False
+# True when the cache has changed since it has been loaded or saved
+_GETINFOS_CACHE_MODIFIED = False
+
+
+def _getinfos_cache_fname():
+    return os.path.join(config.CACHE_PATH, "passive-getinfos.pickle")
+
+
+def _load_getinfos_cache():
+    """Loads the getinfos() results stored by a previous run, when
+    config.PASSIVE_GETINFOS_CACHE_PERSIST is set (and when the file
+    passes the checks of utils.check_cache_file()), and makes sure
+    they will be stored again at exit.
+
+    """
+    global _GETINFOS_CACHE_LOADED
+    _GETINFOS_CACHE_LOADED = True
+    if not (config.PASSIVE_GETINFOS_CACHE_PERSIST and config.CACHE_PATH):
+        return
+    fname = _getinfos_cache_fname()
+    version = cache = None
+    try:
+        with open(fname, "rb") as fdesc:
+            if utils.check_cache_file(fdesc):
+                version, cache = pickle.load(fdesc)
+            else:
+                utils.LOGGER.warning(
+                    "Ignoring cache file %r: not owned by the current user or "
+                    "writable by other users",
+                    fname,
+                )
+    except FileNotFoundError:
+        pass
+    except Exception:
+        utils.LOGGER.warning("Cannot read cache file %r", fname, exc_info=True)
+    else:
+        # The results may change from one version to another
+        if version == VERSION:
+            _GETINFOS_CACHE.update(cache)
+            while len(_GETINFOS_CACHE) > config.PASSIVE_GETINFOS_CACHE_SIZE:
+                _GETINFOS_CACHE.popitem(last=False)
+    atexit.register(save_getinfos_cache)
+
+
+def save_getinfos_cache():
+    """Stores the getinfos() results kept in memory to a file under
+    config.CACHE_PATH, so that they can be used by the next runs. This
+    is done automatically at exit when
+    config.PASSIVE_GETINFOS_CACHE_PERSIST is set (but the exit handlers
+    do not run in multiprocessing workers, which must call this
+    function). Does nothing when the results have not changed.
+
+    """
+    global _GETINFOS_CACHE_MODIFIED
+    if not (_GETINFOS_CACHE_MODIFIED and config.CACHE_PATH):
+        return
+    fname = _getinfos_cache_fname()
+    tmpfname = None
+    try:
+        utils.makedirs(config.CACHE_PATH)
+        with tempfile.NamedTemporaryFile(dir=config.CACHE_PATH, delete=False) as fdesc:
+            tmpfname = fdesc.name
+            pickle.dump(
+                (VERSION, _GETINFOS_CACHE), fdesc, protocol=pickle.HIGHEST_PROTOCOL
+            )
+        os.replace(tmpfname, fname)
+    except Exception:
+        if tmpfname is not None:
+            try:
+                os.unlink(tmpfname)
+            except OSError:
+                pass
+        utils.LOGGER.warning("Cannot write cache file %r", fname, exc_info=True)
+    else:
+        _GETINFOS_CACHE_MODIFIED = False
+
+
+def getinfos_cache_info():
+    """Returns the number of hits and misses of the getinfos() cache, and
+    its current size.
+
+    """
+    return dict(_GETINFOS_CACHE_STATS, size=len(_GETINFOS_CACHE))
+
+
+def _getinfos_cache_key(spec):
+    """Returns the key used to cache the getinfos() result for `spec`, or
+    None when the result should not be cached.
+
+    """
+    if "infos" in spec:
+        # the results depend on the existing "infos" (JA3, HASSH),
+        # and are cheap to compute anyway
+        return None
+    return (
+        spec.get("recontype"),
+        spec.get("source"),
+        hashlib.sha256(
+            repr((spec.get("value"), spec.get("targetval"))).encode()
+        ).digest(),
+    )
+
+
 def getinfos(spec):
     """This functions takes a document from a passive sensor, and
     prepares its "infos" field (which is not added but returned).
 
+    The last results (up to config.PASSIVE_GETINFOS_CACHE_SIZE) are
+    kept in memory, since sensors tend to see the same values (e.g.,
+    certificates) over and over.
+
     """
+    global _GETINFOS_CACHE_MODIFIED
     function = _GETINFOS_FUNCTIONS.get(spec.get("recontype"))
     if isinstance(function, dict):
         function = function.get(spec.get("source"))
     if function is None:
         return {}
-    return function(spec)
+    if not config.PASSIVE_GETINFOS_CACHE_SIZE:
+        return function(spec)
+    key = _getinfos_cache_key(spec)
+    if key is None:
+        return function(spec)
+    if not _GETINFOS_CACHE_LOADED:
+        _load_getinfos_cache()
+    if key in _GETINFOS_CACHE:
+        _GETINFOS_CACHE_STATS["hits"] += 1
+        _GETINFOS_CACHE.move_to_end(key)
+        result = _GETINFOS_CACHE[key]
+    else:
+        _GETINFOS_CACHE_STATS["misses"] += 1
+        result = function(spec)
+        _GETINFOS_CACHE[key] = result
+        _GETINFOS_CACHE_MODIFIED = True
+        if len(_GETINFOS_CACHE) > config.PASSIVE_GETINFOS_CACHE_SIZE:
+            _GETINFOS_CACHE.popitem(last=False)
+    # the results are modified by the callers
+    return deepcopy(result)
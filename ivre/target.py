@@ -418,8 +418,8 @@ class TargetZMapPreScan(TargetFile):
         self.infos["zmap_pre_scan"] = zmap_opts[:]
         zmap_opts = [zmap] + zmap_opts + ["-o", "-"]
         with tempfile.NamedTemporaryFile(delete=False, mode="w") as self.tmpfile:
-            for start, count in target.targets.ranges.values():
-                for net in utils.range2nets((start, start + count - 1)):
+            for start, stop in target.targets.iter_int_ranges():
+                for net in utils.range2nets((start, stop)):
                     self.tmpfile.write("%s\n" % net)
         zmap_opts += ["-w", self.tmpfile.name]
         # pylint: disable=consider-using-with
@@ -466,8 +466,8 @@ class TargetNmapPreScan(TargetZMapPreScan):
         # using a temporary file
         with tempfile.NamedTemporaryFile(delete=False, mode="w") as self.tmpfile:
             nmap_opts = [nmap, "-iL", self.tmpfile.name, "-oG", "-"] + nmap_opts
-            for start, count in target.targets.ranges.values():
-                for net in utils.range2nets((start, start + count - 1)):
+            for start, stop in target.targets.iter_int_ranges():
+                for net in utils.range2nets((start, stop)):
                     self.tmpfile.write("%s\n" % net)
         # pylint: disable=consider-using-with
         self.proc = subprocess.Popen(nmap_opts, stdout=subprocess.PIPE)
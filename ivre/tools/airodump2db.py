@@ -22,7 +22,7 @@
 
 from argparse import ArgumentParser
 from functools import partial
-from typing import Any, Dict, Generator, List, Optional, Tuple
+from typing import Any, Dict, Generator, List, Optional
 
 
 from ivre.db import DBPassive, db
@@ -30,11 +30,12 @@ from ivre.parser.airodump import Airodump
 from ivre.passive import _prepare_rec, getinfos
 from ivre.tools.passiverecon2db import _get_ignore_rules
 from ivre.types import Record
+from ivre.utils import touch_db_stamp
 
 
 def _handle_rec(
     sensor: Optional[str],
-    ignore_rules: Dict[str, Dict[str, List[Tuple[int, int]]]],
+    ignore_rules: Dict[str, Dict[str, Any]],
     line: Dict[str, Any],
 ) -> Generator[Record, None, None]:
     yield from _prepare_rec(
@@ -45,7 +46,7 @@ def _handle_rec(
 def rec_iter(
     filenames: List[str],
     sensor: Optional[str],
-    ignore_rules: Dict[str, Dict[str, List[Tuple[int, int]]]],
+    ignore_rules: Dict[str, Dict[str, Any]],
 ) -> Generator[Record, None, None]:
     for fname in filenames:
         with Airodump(fname) as fdesc:
@@ -156,3 +157,4 @@ def main() -> None:
         getinfos=getinfos,
         separated_timestamps=False,
     )
+    touch_db_stamp("passive")
@@ -22,22 +22,50 @@
 from argparse import ArgumentParser
 from datetime import datetime
 import subprocess
-from typing import cast, Iterable
-
-
-from scapy.all import ARP, Packet, PcapReader  # type: ignore
+from typing import Any, Dict, Iterator
 
 
 from ivre import config
 from ivre.db import db
+from ivre.parser.arp import ArpPcapFile
+from ivre.utils import LOGGER
+
 
+def scapy_reader(fname: str) -> Iterator[Dict[str, Any]]:
+    """Yields the records for the ARP packets from a PCAP file, using
+    tcpdump and Scapy. This is much slower than ArpPcapFile, and only
+    used for the files it cannot read.
+
+    """
+    # pylint: disable=import-outside-toplevel
+    from scapy.all import ARP, PcapReader  # type: ignore
 
-def reader(fname: str) -> Iterable[Packet]:
     # pylint: disable=consider-using-with
     proc = subprocess.Popen(
         ["tcpdump", "-n", "-r", fname, "-w", "-", "arp"], stdout=subprocess.PIPE
     )
-    return cast(Iterable[Packet], PcapReader(proc.stdout))
+    for pkt in PcapReader(proc.stdout):
+        yield {
+            "dst": pkt[ARP].pdst,
+            "src": pkt[ARP].psrc,
+            "mac_src": pkt[ARP].hwsrc,
+            "mac_dst": pkt[ARP].hwdst,
+            "start_time": datetime.fromtimestamp(pkt.time),
+            "end_time": datetime.fromtimestamp(pkt.time),
+            "op": pkt.sprintf("%ARP.op%").upper().replace("-", "_"),
+            "proto": "arp",
+        }
+
+
+def reader(fname: str) -> Iterator[Dict[str, Any]]:
+    try:
+        parser = ArpPcapFile(fname)
+    except ValueError as exc:
+        LOGGER.debug("Cannot read %r without Scapy (%s), using Scapy", fname, exc)
+        yield from scapy_reader(fname)
+        return
+    with parser:
+        yield from parser
 
 
 def main() -> None:
@@ -52,17 +80,7 @@ def main() -> None:
 
     bulk = db.flow.start_bulk_insert()
     for fname in args.files:
-        for pkt in reader(fname):
-            rec = {
-                "dst": pkt[ARP].pdst,
-                "src": pkt[ARP].psrc,
-                "mac_src": pkt[ARP].hwsrc,
-                "mac_dst": pkt[ARP].hwdst,
-                "start_time": datetime.fromtimestamp(pkt.time),
-                "end_time": datetime.fromtimestamp(pkt.time),
-                "op": pkt.sprintf("%ARP.op%").upper().replace("-", "_"),
-                "proto": "arp",
-            }
+        for rec in reader(fname):
             if rec["dst"] != "0.0.0.0" and rec["src"] != "0.0.0.0":
                 db.flow.any2flow(bulk, "arp", rec)
     db.flow.bulk_commit(bulk)
@@ -27,6 +27,7 @@ from typing import Generator, List
 from ivre.activecli import displayfunction_json
 from ivre.db import db, DB
 from ivre.types import Record
+from ivre.utils import touch_db_stamp
 from ivre.view import from_passive, from_nmap, to_view
 
 
@@ -60,6 +61,11 @@ def main() -> None:
         action="store_true",
         help="For test output, print out formatted results.",
     )
+    parser.add_argument(
+        "--threads",
+        action="store_true",
+        help="Read each source (nmap, passive) in its own thread.",
+    )
     parser.add_argument(
         "--no-merge",
         action="store_true",
@@ -101,18 +107,21 @@ def main() -> None:
             parser.error('Cannot use "passive" (no Passive database exists)')
         fltpass = db.passive.parse_args(args, fltpass)
         _from = [from_passive(fltpass, category=view_category)]
-    if args.test:
-
-        def output(host: Record) -> None:
-            return displayfunction_json([host], db.view)
-
-    elif args.no_merge:
-        output = db.view.store_host
-    else:
-        output = db.view.store_or_merge_host
     # Output results
-    itr = to_view(_from)
+    itr = to_view(_from, threads=args.threads)
     if not itr:
         return
-    for elt in itr:
-        output(elt)
+    if args.test:
+        for elt in itr:
+            displayfunction_json([elt], db.view)
+    elif args.no_merge:
+        db.view.start_store_hosts()
+        writer = db.view.hosts_writer()
+        for elt in itr:
+            writer.append(elt)
+        writer.flush()
+        db.view.stop_store_hosts()
+    else:
+        db.view.store_or_merge_hosts(itr)
+    if not args.test:
+        touch_db_stamp("view")
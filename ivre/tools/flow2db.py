@@ -20,6 +20,8 @@
 
 
 from argparse import ArgumentParser
+import multiprocessing
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 
 from ivre import config
@@ -28,25 +30,76 @@ from ivre.db import db
 
 # from ivre.parser.airodump import Airodump
 from ivre.parser.argus import Argus
-from ivre.parser.netflow import NetFlow
+from ivre.parser.netflow import NetFlow, netflow_parser
 from ivre.parser.iptables import Iptables
+from ivre.types import Record
 
-PARSERS_CHOICE = {
+PARSERS_CHOICE: Dict[str, Callable[..., Any]] = {
     # 'airodump': Airodump,
     "argus": Argus,
-    "netflow": NetFlow,
+    "netflow": netflow_parser,
+    "nfdump": NetFlow,
     "iptables": Iptables,
 }
 
 
-PARSERS_MAGIC = {
+PARSERS_MAGIC: Dict[bytes, Callable[..., Any]] = {
     # NetFlow
-    b"\x0c\xa5\x01\x00": NetFlow,
+    b"\x0c\xa5\x01\x00": netflow_parser,
     # Argus
     b"\x83\x10\x00\x20": Argus,
 }
 
 
+def get_parser(fname: str, ftype: Optional[str]) -> Optional[Callable[..., Any]]:
+    if ftype is not None:
+        return PARSERS_CHOICE[ftype]
+    with utils.open_file(fname) as fdesc_tmp:
+        try:
+            return PARSERS_MAGIC[fdesc_tmp.read(4)]
+        except KeyError:
+            utils.LOGGER.warning(
+                "Cannot find the appropriate parser for file %r",
+                fname,
+            )
+    return None
+
+
+def parse_file(
+    fname: str, ftype: Optional[str], pcap_filter: Optional[str]
+) -> Iterator[Record]:
+    fileparser = get_parser(fname, ftype)
+    if fileparser is None:
+        return
+    with fileparser(fname, pcap_filter) as fdesc:
+        for rec in fdesc:
+            if rec:
+                yield rec
+
+
+def _parse_file(args: Tuple[str, Optional[str], Optional[str]]) -> List[Record]:
+    """Parses a file in a worker process (--jobs)"""
+    try:
+        return list(parse_file(*args))
+    except Exception:
+        utils.LOGGER.warning("Exception (file %r)", args[0], exc_info=True)
+        return []
+
+
+def parse_files_parallel(
+    fnames: Iterable[str], ftype: Optional[str], pcap_filter: Optional[str], jobs: int
+) -> Iterator[Record]:
+    """Parses the files `fnames` using `jobs` worker processes, and
+    yields the records, in the order of `fnames`.
+
+    """
+    with multiprocessing.Pool(processes=jobs) as pool:
+        for records in pool.imap(
+            _parse_file, ((fname, ftype, pcap_filter) for fname in fnames)
+        ):
+            yield from records
+
+
 def main() -> None:
     """Update the flow database from log files"""
     parser = ArgumentParser(description=__doc__)
@@ -61,31 +114,33 @@ def main() -> None:
     parser.add_argument(
         "-C", "--no-cleanup", help="avoid port cleanup heuristics", action="store_true"
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="COUNT",
+        type=int,
+        default=1,
+        help="Parse COUNT files in parallel (in separate processes).",
+    )
     args = parser.parse_args()
 
     if args.verbose:
         config.DEBUG = True
 
-    for fname in args.files:
-        try:
-            fileparser = PARSERS_CHOICE[args.type]
-        except KeyError:
-            with utils.open_file(fname) as fdesc_tmp:
-                try:
-                    fileparser = PARSERS_MAGIC[fdesc_tmp.read(4)]
-                except KeyError:
-                    utils.LOGGER.warning(
-                        "Cannot find the appropriate parser for file %r",
-                        fname,
-                    )
-                    continue
-        bulk = db.flow.start_bulk_insert()
-        with fileparser(fname, args.pcap_filter) as fdesc:
-            for rec in fdesc:
-                if not rec:
-                    continue
-                db.flow.flow2flow(bulk, rec)
-        db.flow.bulk_commit(bulk)
+    bulk = db.flow.start_bulk_insert()
+    if args.jobs > 1:
+        records = parse_files_parallel(
+            args.files, args.type, args.pcap_filter, args.jobs
+        )
+    else:
+        records = (
+            rec
+            for fname in args.files
+            for rec in parse_file(fname, args.type, args.pcap_filter)
+        )
+    for rec in records:
+        db.flow.flow2flow(bulk, rec)
+    db.flow.bulk_commit(bulk)
 
     if not args.no_cleanup:
-        db.flow.cleanup_flows()
+        db.flow.cleanup_flows(bulk)
@@ -88,6 +88,12 @@ def main() -> None:
         action="store_true",
         help="Create missing indexes (will lock the " "database).",
     )
+    parser.add_argument(
+        "--cleanup",
+        action="store_true",
+        help="Fix the flows whose source and destination seem to have been "
+        "swapped (to run periodically when importing with --no-cleanup).",
+    )
     parser.add_argument(
         "--node-filters",
         "-n",
@@ -279,6 +285,10 @@ def main() -> None:
         db.flow.ensure_indexes()
         sys.exit(0)
 
+    if args.cleanup:
+        db.flow.cleanup_flows()
+        sys.exit(0)
+
     if args.fields is not None and not args.fields:
         # Print fields list
         print_fields()
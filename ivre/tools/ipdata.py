@@ -55,13 +55,14 @@ def main() -> None:
         torun.append((cast(Callable, db.data.build_dumps), [], {}))
     for function, fargs, fkargs in torun:
         function(*fargs, **fkargs)
-    for addr in args.ip:
-        if addr.isdigit():
-            addr = utils.int2ip(int(addr))
+    addrs = [utils.int2ip(int(addr)) if addr.isdigit() else addr for addr in args.ip]
+    for addr, asinfo, location in zip(
+        addrs, db.data.as_byip_many(addrs), db.data.location_byip_many(addrs)
+    ):
         print(addr)
         info = utils.get_addr_type(addr)
         if info:
             print("    address_type %s" % info)
-        for subinfo in [db.data.as_byip(addr), db.data.location_byip(addr)]:
+        for subinfo in [asinfo, location]:
             for key, value in (subinfo or {}).items():
                 print("    %s %s" % (key, value))
@@ -254,6 +254,7 @@ def disp_recs_delete(
     flt: Filter, sort: Sort, limit: Optional[int], skip: Optional[int]
 ) -> None:
     db.passive.remove(flt)
+    utils.touch_db_stamp("passive")
 
 
 def main() -> None:
@@ -301,6 +302,7 @@ def main() -> None:
             if ans.lower() != "y":
                 sys.exit(0)
         db.passive.init()
+        utils.touch_db_stamp("passive")
         sys.exit(0)
     if args.ensure_indexes:
         if os.isatty(sys.stdin.fileno()):
@@ -315,6 +317,7 @@ def main() -> None:
         sys.exit(0)
     if args.dnsbl_update:
         db.passive.update_dns_blacklist()
+        utils.touch_db_stamp("passive")
         sys.exit(0)
     if args.short:
         disp_recs = disp_recs_short
@@ -22,7 +22,7 @@
 
 from argparse import ArgumentParser
 from functools import partial
-from typing import Dict, Generator, List, Optional, Tuple
+from typing import Any, Dict, Generator, List, Optional, Tuple
 
 
 from ivre.db import DBPassive, db
@@ -30,13 +30,13 @@ from ivre.parser.p0f import P0fFile
 from ivre.passive import handle_rec, getinfos
 from ivre.tools.passiverecon2db import _get_ignore_rules
 from ivre.types import Record
-from ivre.utils import LOGGER
+from ivre.utils import LOGGER, touch_db_stamp
 
 
 def rec_iter(
     filenames: List[str],
     sensor: Optional[str],
-    ignore_rules: Dict[str, Dict[str, List[Tuple[int, int]]]],
+    ignore_rules: Dict[str, Dict[str, Any]],
 ) -> Generator[Tuple[Optional[int], Record], None, None]:
     ignorenets = ignore_rules.get("IGNORENETS", {})
     neverignore = ignore_rules.get("NEVERIGNORE", {})
@@ -124,6 +124,7 @@ def main() -> None:
         rec_iter(args.files, args.sensor, ignore_rules),
         getinfos=getinfos,
     )
+    touch_db_stamp("passive")
 
 
 if __name__ == "__main__":
@@ -24,45 +24,40 @@ from argparse import ArgumentParser
 import functools
 import signal
 import sys
-from typing import Any, Dict, Generator, Iterable, List, Optional, Tuple
+from typing import Any, Callable, Dict, Generator, Iterable, Optional, Tuple
 
 
+from ivre import config
 import ivre.db
 import ivre.passive
 import ivre.parser.zeek
 from ivre.types import Record
-from ivre.utils import force_ip2int
-
-
-signal.signal(signal.SIGINT, signal.SIG_IGN)
-signal.signal(signal.SIGTERM, signal.SIG_IGN)
+from ivre.utils import LOGGER, touch_db_stamp
 
 
 def _get_ignore_rules(
     ignore_spec: Optional[str],
-) -> Dict[str, Dict[str, List[Tuple[int, int]]]]:
+) -> Dict[str, Dict[str, Any]]:
     """Executes the ignore_spec file and returns the ignore_rules
     dictionary.
 
     """
-    ignore_rules: Dict[str, Dict[str, List[Tuple[int, int]]]] = {}
+    ignore_rules: Dict[str, Dict[str, Any]] = {}
     if ignore_spec is not None:
         with open(ignore_spec, "rb") as fdesc:
             # pylint: disable=exec-used
             exec(compile(fdesc.read(), ignore_spec, "exec"), ignore_rules)
-    subdict = ignore_rules.get("IGNORENETS")
-    if subdict:
-        for subkey, values in subdict.items():
-            subdict[subkey] = [
-                (force_ip2int(val[0]), force_ip2int(val[1])) for val in values
-            ]
+    if "IGNORENETS" in ignore_rules:
+        ignore_rules["IGNORENETS"] = ivre.passive.compile_ignorenets(
+            ignore_rules["IGNORENETS"]
+        )
     return ignore_rules
 
 
 def rec_iter(
     zeek_parser: Iterable[Dict[str, Any]],
     sensor: Optional[str],
-    ignore_rules: Dict[str, Dict[str, List[Tuple[int, int]]]],
+    ignore_rules: Dict[str, Dict[str, Any]],
 ) -> Generator[Tuple[Optional[int], Record], None, None]:
     for line in zeek_parser:
         line["timestamp"] = line.pop("ts")
@@ -76,7 +71,54 @@ def rec_iter(
         )
 
 
+def get_insert_function(bulk_mode: str = "bulk") -> Callable[..., None]:
+    """Returns the function used to insert the records in the passive
+    database, according to `bulk_mode` ("bulk", "local-bulk" or
+    "no-bulk").
+
+    """
+    function: Callable[..., None]
+    if bulk_mode == "local-bulk":
+        function = ivre.db.db.passive.insert_or_update_local_bulk
+    elif bulk_mode == "no-bulk":
+        function = functools.partial(
+            ivre.db.DBPassive.insert_or_update_bulk,
+            ivre.db.db.passive,
+        )
+    else:
+        function = ivre.db.db.passive.insert_or_update_bulk
+    return function
+
+
+def insert_zeek_file(
+    zeek_parser: ivre.parser.zeek.ZeekFile,
+    sensor: Optional[str],
+    ignore_rules: Dict[str, Dict[str, Any]],
+    bulk_mode: str = "bulk",
+) -> None:
+    """Inserts the records from `zeek_parser` (a ZeekFile instance, for
+    the output of the passiverecon Zeek script) in the passive
+    database.
+
+    """
+    get_insert_function(bulk_mode)(
+        rec_iter(zeek_parser.iter_records(), sensor, ignore_rules),
+        getinfos=ivre.passive.getinfos,
+    )
+    touch_db_stamp("passive")
+    if config.PASSIVE_GETINFOS_CACHE_PERSIST:
+        # Needed in passivereconworker's pool processes, where the
+        # exit handlers do not run
+        ivre.passive.save_getinfos_cache()
+    LOGGER.debug(
+        "getinfos() cache: %(hits)d hits, %(misses)d misses, %(size)d entries",
+        ivre.passive.getinfos_cache_info(),
+    )
+
+
 def main() -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
     parser = ArgumentParser(description=__doc__)
     parser.add_argument("--sensor", "-s", help="Sensor name")
     parser.add_argument("--ignore-spec", "-i", help="Filename containing ignore rules")
@@ -92,15 +134,14 @@ def main() -> None:
     args = parser.parse_args()
     ignore_rules = _get_ignore_rules(args.ignore_spec)
     if (not (args.no_bulk or args.local_bulk)) or args.bulk:
-        function = ivre.db.db.passive.insert_or_update_bulk
+        bulk_mode = "bulk"
     elif args.local_bulk:
-        function = ivre.db.db.passive.insert_or_update_local_bulk
+        bulk_mode = "local-bulk"
     else:
-        function = functools.partial(
-            ivre.db.DBPassive.insert_or_update_bulk,
-            ivre.db.db.passive,
-        )
-    zeek_parser = ivre.parser.zeek.ZeekFile(sys.stdin.buffer)
-    function(
-        rec_iter(zeek_parser, args.sensor, ignore_rules), getinfos=ivre.passive.getinfos
+        bulk_mode = "no-bulk"
+    insert_zeek_file(
+        ivre.parser.zeek.ZeekFile(sys.stdin.buffer),
+        args.sensor,
+        ignore_rules,
+        bulk_mode=bulk_mode,
     )
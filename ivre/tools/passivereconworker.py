@@ -21,7 +21,9 @@
 
 
 from argparse import ArgumentParser
+import multiprocessing
 import os
+import queue
 import re
 import shutil
 import signal
@@ -31,6 +33,9 @@ from typing import Any, Dict, List, Match, Optional
 
 
 from ivre import config, utils
+import ivre.db
+from ivre.parser.zeek import ZeekFile
+from ivre.tools.passiverecon2db import _get_ignore_rules, insert_zeek_file
 
 
 SENSORS: Dict[str, str] = {}  # shortname: fullname
@@ -38,6 +43,7 @@ FILEFORMAT = "^(?P<sensor>%s)\\.(?P<datetime>[0-9-]+)\\.log(?:\\.gz)?$"
 SLEEPTIME = 2
 CMDLINE = "%(progname)s -s %(sensor)s"
 WANTDOWN = False
+_WORKER_CONFIG: Dict[str, Any] = {}
 
 
 def shutdown(signum: int, _: Any) -> None:
@@ -51,11 +57,12 @@ def shutdown(signum: int, _: Any) -> None:
 
 
 def getnextfiles(
-    directory: str, sensor: Optional[str] = None, count: int = 1
+    directory: str, sensor: Optional[str] = None, count: Optional[int] = 1
 ) -> List[Match[str]]:
-    """Returns a list of maximum `count` filenames (as FILEFORMAT matches)
-    to process, given the `directory` and the `sensor` (or, if it is
-    `None`, from any sensor).
+    """Returns a list of maximum `count` (or, if it is `None`, all)
+    filenames (as FILEFORMAT matches) to process, given the
+    `directory` and the `sensor` (or, if it is `None`, from any
+    sensor).
 
     """
     if sensor is None:
@@ -115,26 +122,16 @@ def worker(progname: str, directory: str, sensor: Optional[str] = None) -> None:
         if config.DEBUG:
             utils.LOGGER.debug("Handling %s", fname)
         fname = os.path.join(directory, "current", fname)
-        fdesc = utils.open_file(fname)
         handled_ok = True
-        for line in fdesc:
+        with utils.open_file(fname) as fdesc:
             try:
-                proc.stdin.write(line)
-            except ValueError:
-                utils.LOGGER.warning(
-                    "Error while handling line %r. " "Trying again", line
-                )
-                proc = create_process(progname, fname_sensor)
-                assert proc.stdin is not None
-                procs[fname_sensor] = proc
-                # Second (and last) try
-                try:
-                    proc.stdin.write(line)
-                    utils.LOGGER.warning("  ... OK")
-                except ValueError:
-                    handled_ok = False
-                    utils.LOGGER.warning("  ... KO")
-        fdesc.close()
+                shutil.copyfileobj(fdesc, proc.stdin)
+                proc.stdin.flush()
+            except (OSError, ValueError):
+                utils.LOGGER.warning("Error while handling file %r", fname)
+                handled_ok = False
+                # The process will be created again for the next file
+                del procs[fname_sensor]
         if handled_ok:
             os.unlink(fname)
             utils.LOGGER.debug("  ... OK")
@@ -147,6 +144,115 @@ def worker(progname: str, directory: str, sensor: Optional[str] = None) -> None:
         proc.wait()
 
 
+def _pool_init(ignore_spec: Optional[str], bulk_mode: str) -> None:
+    """Initializes a worker process of the pool used by
+    `pool_worker()`; each process has its own database connection
+    (and caches).
+
+    """
+    # The main process handles the signals and stops the workers.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    _WORKER_CONFIG["ignore_rules"] = _get_ignore_rules(ignore_spec)
+    _WORKER_CONFIG["bulk_mode"] = bulk_mode
+
+
+def _pool_handle_file(directory: str, fname: str, sensor: str) -> bool:
+    """Inserts the content of the file `fname` (in `directory`/current)
+    in the passive database, from a worker process. The file is
+    removed when it has been processed without error, and moved to
+    `directory`/error otherwise.
+
+    """
+    fname = os.path.join(directory, "current", fname)
+    utils.LOGGER.debug("Handling %s", fname)
+    # The previous file from this sensor may have been handled by
+    # another process
+    ivre.db.db.passive.invalidate_cache()
+    try:
+        with ZeekFile(fname) as zeek_parser:
+            insert_zeek_file(
+                zeek_parser,
+                sensor,
+                _WORKER_CONFIG["ignore_rules"],
+                bulk_mode=_WORKER_CONFIG["bulk_mode"],
+            )
+    except Exception:
+        utils.LOGGER.warning(
+            "Error while handling file %r, moving it to %r",
+            fname,
+            os.path.join(directory, "error"),
+            exc_info=True,
+        )
+        try:
+            shutil.move(fname, os.path.join(directory, "error"))
+        except (OSError, shutil.Error):
+            utils.LOGGER.warning("Cannot move file %r", fname, exc_info=True)
+        return False
+    os.unlink(fname)
+    return True
+
+
+def pool_worker(
+    directory: str,
+    sensor: Optional[str] = None,
+    processes: Optional[int] = None,
+    ignore_spec: Optional[str] = None,
+    bulk_mode: str = "bulk",
+) -> None:
+    """This function is the main loop of the in-process mode: the files
+    are inserted in the database by a pool of `processes` worker
+    processes.
+
+    Files from different sensors are handled in parallel, while the
+    files from a given sensor are handled one after the other, in
+    order.
+
+    """
+    utils.makedirs(os.path.join(directory, "current"))
+    utils.makedirs(os.path.join(directory, "error"))
+    # Used to wake up the main loop as soon as a file has been
+    # processed
+    done: "queue.Queue[Any]" = queue.Queue()
+    # sensor: result of the file being processed
+    running: Dict[str, "multiprocessing.pool.AsyncResult[bool]"] = {}
+    with multiprocessing.Pool(
+        processes=processes, initializer=_pool_init, initargs=(ignore_spec, bulk_mode)
+    ) as pool:
+        while not WANTDOWN:
+            for fname_m in getnextfiles(directory, sensor=sensor, count=None):
+                fname_sensor = fname_m.groupdict()["sensor"]
+                if fname_sensor in running:
+                    continue
+                fname = fname_m.group()
+                # Our "lock system": if we can move the file, it's ours
+                try:
+                    shutil.move(
+                        os.path.join(directory, fname),
+                        os.path.join(directory, "current"),
+                    )
+                except shutil.Error:
+                    continue
+                running[fname_sensor] = pool.apply_async(
+                    _pool_handle_file,
+                    (directory, fname, SENSORS.get(fname_sensor, fname_sensor)),
+                    callback=done.put,
+                    error_callback=done.put,
+                )
+            # We wait for a file to be processed, or for a while
+            # before we look for new files
+            try:
+                done.get(timeout=SLEEPTIME)
+            except queue.Empty:
+                pass
+            for fname_sensor, result in list(running.items()):
+                if result.ready():
+                    del running[fname_sensor]
+        # SHUTDOWN: we wait for the files being processed
+        pool.close()
+        pool.join()
+
+
 def main() -> None:
     """Parses the arguments and call worker()"""
     # Set the signal handler
@@ -168,8 +274,31 @@ def main() -> None:
     parser.add_argument(
         "--progname",
         metavar="PROG",
-        help="Program to run (defaults to ivre passiverecon2db).",
-        default="ivre passiverecon2db",
+        help="Program to run, one process per sensor, fed with the files "
+        "content (e.g., ivre passiverecon2db); by default, the files are "
+        "processed by a pool of worker processes.",
+    )
+    parser.add_argument(
+        "--processes",
+        metavar="COUNT",
+        type=int,
+        help="Number of worker processes (defaults to the number of CPUs; "
+        "not used with --progname).",
+    )
+    parser.add_argument(
+        "--ignore-spec",
+        "-i",
+        help="Filename containing ignore rules (not used with --progname).",
+    )
+    parser.add_argument(
+        "--local-bulk",
+        action="store_true",
+        help="Use local (memory) bulk inserts (not used with --progname).",
+    )
+    parser.add_argument(
+        "--no-bulk",
+        action="store_true",
+        help="Do not use bulk inserts (not used with --progname).",
     )
     args = parser.parse_args()
     if args.sensor is not None:
@@ -185,4 +314,19 @@ def main() -> None:
         sensor = args.sensor.split(":", 1)[0]
     else:
         sensor = None
-    worker(args.progname, args.directory, sensor=sensor)
+    if args.progname is not None:
+        worker(args.progname, args.directory, sensor=sensor)
+        return
+    if args.local_bulk:
+        bulk_mode = "local-bulk"
+    elif args.no_bulk:
+        bulk_mode = "no-bulk"
+    else:
+        bulk_mode = "bulk"
+    pool_worker(
+        args.directory,
+        sensor=sensor,
+        processes=args.processes,
+        ignore_spec=args.ignore_spec,
+        bulk_mode=bulk_mode,
+    )
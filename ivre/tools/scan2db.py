@@ -21,11 +21,25 @@
 
 
 from argparse import ArgumentParser
+import multiprocessing
 import os
+import pickle
 import sys
-from typing import Generator, Iterable, List
+import tempfile
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
 
 
+from ivre import config
 import ivre.db
 from ivre.types import Record
 import ivre.utils
@@ -33,6 +47,20 @@ from ivre.view import nmap_record_to_view
 import ivre.xmlnmap
 
 
+# The methods of the nmap backend that write to the database; in
+# parallel mode (--jobs), the worker processes record their calls
+# (in a temporary file), and the main process replays them.
+_WRITE_METHODS = [
+    "store_host",
+    "store_hosts",
+    "store_or_merge_host",
+    "store_scan_doc",
+    "update_scan_doc",
+]
+_WORKER_OUTPUT: Optional[IO[bytes]] = None
+_WORKER_KARGS: Dict[str, Any] = {}
+
+
 def recursive_filelisting(
     base_directories: Iterable[str], error: List[bool]
 ) -> Generator[str, None, None]:
@@ -55,6 +83,157 @@ def recursive_filelisting(
                 yield os.path.join(root, leaffile)
 
 
+def _check_exists(
+    scans: Iterable[str], error: List[bool]
+) -> Generator[str, None, None]:
+    for scan in scans:
+        if not os.path.exists(scan):
+            ivre.utils.LOGGER.warning("file %r does not exist", scan)
+            error[0] = True
+            continue
+        yield scan
+
+
+class ViewUpdater:
+    """Callback used to merge the hosts in the view (--update-view).
+
+    The view records are buffered, records of the same address within
+    a batch (of VIEW_BATCH_SIZE records) are merged in memory, and
+    the resulting records are then merged in the view (using
+    `.store_or_merge_hosts()`).
+
+    """
+
+    def __init__(self) -> None:
+        self.records: Dict[str, Record] = {}
+
+    def __call__(self, host: Record) -> None:
+        rec = nmap_record_to_view(host)
+        addr = rec["addr"]
+        if addr in self.records:
+            self.records[addr] = ivre.db.db.view.merge_host_docs(
+                self.records[addr], rec
+            )
+        else:
+            self.records[addr] = rec
+            if len(self.records) >= config.VIEW_BATCH_SIZE:
+                self.flush()
+
+    def flush(self) -> None:
+        ivre.db.db.view.store_or_merge_hosts(
+            self.records[addr] for addr in sorted(self.records, key=ivre.utils.ip2int)
+        )
+        self.records = {}
+
+
+def _record_call(method: str) -> Callable[..., None]:
+    def _record(*args: Any) -> None:
+        assert _WORKER_OUTPUT is not None
+        pickle.dump((method, args), _WORKER_OUTPUT, protocol=pickle.HIGHEST_PROTOCOL)
+
+    return _record
+
+
+def _worker_init(kargs: Dict[str, Any]) -> None:
+    """Initializes a worker process for the parallel mode: the write
+    methods of the nmap backend are replaced by functions that record
+    their calls.
+
+    """
+    database = ivre.db.db.nmap
+    for method in _WRITE_METHODS:
+        setattr(database, method, _record_call(method))
+    database.start_store_hosts = database.stop_store_hosts = lambda: None
+    _WORKER_KARGS.update(kargs)
+
+
+def _worker_parse(fname: str) -> Tuple[str, bytes, Optional[bool], str]:
+    """Parses a scan result file in a worker process. Returns the file
+    name, its hash, the result (True when the file has been parsed,
+    False when it was not, None on error) and the name of the file
+    where the database writes have been recorded.
+
+    """
+    global _WORKER_OUTPUT
+    scanid = ivre.utils.hash_file(fname, hashtype="sha256")
+    with tempfile.NamedTemporaryFile(
+        prefix="ivre-scan2db-", suffix=".pickle", delete=False
+    ) as fdesc:
+        _WORKER_OUTPUT = fdesc
+        try:
+            result: Optional[bool] = ivre.db.db.nmap.store_scan(fname, **_WORKER_KARGS)
+        except Exception:
+            ivre.utils.LOGGER.warning("Exception (file %r)", fname, exc_info=True)
+            result = None
+        finally:
+            _WORKER_OUTPUT = None
+    return fname, scanid, result, fdesc.name
+
+
+def store_scans_parallel(
+    scans: Iterable[str],
+    jobs: int,
+    callback: Optional[Callable[[Record], None]],
+    **kargs: Any,
+) -> Generator[Tuple[str, Optional[bool]], None, None]:
+    """Parses the scan result files `scans` using `jobs` worker
+    processes, and stores the results using the nmap backend from the
+    main process, in the order of `scans`.
+
+    Yields, for each file, its name and the result: True when it has
+    been imported, False when it has not (e.g., when it was already
+    present in the database), None on error.
+
+    """
+    database = ivre.db.db.nmap
+    with multiprocessing.Pool(
+        processes=jobs, initializer=_worker_init, initargs=(kargs,)
+    ) as pool:
+        for fname, scanid, result, tmpname in pool.imap(
+            _worker_parse, scans, chunksize=1
+        ):
+            try:
+                if result and database.is_scan_present(scanid):
+                    # the same file content has been seen earlier
+                    ivre.utils.LOGGER.debug(
+                        "Scan already present in Database (%r).", fname
+                    )
+                    result = False
+                elif result is not False:
+                    _replay(database, tmpname, callback)
+            except Exception:
+                ivre.utils.LOGGER.warning("Exception (file %r)", fname, exc_info=True)
+                result = None
+            finally:
+                os.unlink(tmpname)
+            yield fname, result
+
+
+def _replay(
+    database: ivre.db.DBNmap,
+    fname: str,
+    callback: Optional[Callable[[Record], None]],
+) -> None:
+    database.start_store_hosts()
+    try:
+        with open(fname, "rb") as fdesc:
+            while True:
+                try:
+                    method, args = pickle.load(fdesc)
+                except EOFError:
+                    break
+                getattr(database, method)(*args)
+                if callback is None:
+                    continue
+                if method == "store_hosts":
+                    for host in args[0]:
+                        callback(host)
+                elif method in {"store_host", "store_or_merge_host"}:
+                    callback(args[0])
+    finally:
+        database.stop_store_hosts()
+
+
 def main() -> None:
     parser = ArgumentParser(description=__doc__)
     parser.add_argument("scan", nargs="*", metavar="SCAN", help="Scan results")
@@ -102,6 +281,14 @@ def main() -> None:
         action="store_true",
         help="Import all files from given directories.",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="COUNT",
+        type=int,
+        default=1,
+        help="Parse COUNT files in parallel (in separate processes).",
+    )
     parser.add_argument(
         "--update-view", action="store_true", help="Merge hosts in current view"
     )
@@ -128,34 +315,42 @@ def main() -> None:
         scans = recursive_filelisting(args.scan, error)
     else:
         scans = args.scan
+    callback: Optional[ViewUpdater]
     if not args.update_view or args.no_update_view:
         callback = None
     else:
-
-        def callback(x: Record) -> None:
-            ivre.db.db.view.store_or_merge_host(nmap_record_to_view(x))
-
+        callback = ViewUpdater()
+    existing_scans = _check_exists(scans, error)
+    kargs = {
+        "categories": categories,
+        "source": args.source,
+        "needports": args.ports,
+        "needopenports": args.open_ports,
+        "force_info": args.force_info,
+        "masscan_probes": args.masscan_probes,
+        "zgrab_port": args.zgrab_port,
+    }
     count = 0
-    for scan in scans:
-        if not os.path.exists(scan):
-            ivre.utils.LOGGER.warning("file %r does not exist", scan)
-            error[0] = True
-            continue
-        try:
-            if database.store_scan(
-                scan,
-                categories=categories,
-                source=args.source,
-                needports=args.ports,
-                needopenports=args.open_ports,
-                force_info=args.force_info,
-                masscan_probes=args.masscan_probes,
-                callback=callback,
-                zgrab_port=args.zgrab_port,
-            ):
+    if args.jobs > 1 and database is ivre.db.db.nmap:
+        for _, result in store_scans_parallel(
+            existing_scans, args.jobs, callback, **kargs
+        ):
+            if result:
                 count += 1
-        except Exception:
-            ivre.utils.LOGGER.warning("Exception (file %r)", scan, exc_info=True)
-            error[0] = True
+            elif result is None:
+                error[0] = True
+    else:
+        for scan in existing_scans:
+            try:
+                if database.store_scan(scan, callback=callback, **kargs):
+                    count += 1
+            except Exception:
+                ivre.utils.LOGGER.warning("Exception (file %r)", scan, exc_info=True)
+                error[0] = True
+    if callback is not None:
+        callback.flush()
+        ivre.utils.touch_db_stamp("view")
+    if (count or error[0]) and database is ivre.db.db.nmap:
+        ivre.utils.touch_db_stamp("nmap")
     ivre.utils.LOGGER.info("%d results imported.", count)
     sys.exit(error[0])
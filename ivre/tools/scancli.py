@@ -23,7 +23,7 @@ import sys
 from typing import Callable
 
 
-from ivre import db, graphroute, nmapout
+from ivre import db, graphroute, nmapout, utils
 from ivre.activecli import (
     display_short,
     display_distinct,
@@ -120,6 +120,12 @@ def main() -> None:
         default="NA",
         help='String to use for "Not Applicable" value ' '(defaults to "NA")',
     )
+    parser.add_argument(
+        "--rebuild-rollups",
+        action="store_true",
+        help="Rebuild (and check) the precomputed counts used for the "
+        "most common top values.",
+    )
     args = parser.parse_args()
 
     out = sys.stdout
@@ -135,6 +141,7 @@ def main() -> None:
             if ans.lower() != "y":
                 sys.exit(-1)
         db.db.nmap.init()
+        utils.touch_db_stamp("nmap")
         sys.exit(0)
     if args.ensure_indexes:
         if os.isatty(sys.stdin.fileno()):
@@ -144,6 +151,11 @@ def main() -> None:
                 sys.exit(-1)
         db.db.nmap.ensure_indexes()
         sys.exit(0)
+    if args.rebuild_rollups:
+        errors = db.db.nmap.rebuild_rollups()
+        if errors:
+            utils.LOGGER.warning("%d wrong or missing count(s) fixed", errors)
+        sys.exit(0)
     if args.top is not None:
         sys.stdout.writelines(db.db.nmap.display_top(args.top, hostfilter, args.limit))
         sys.exit(0)
@@ -165,6 +177,7 @@ def main() -> None:
         sys.exit(0)
     if args.delete:
         displayfunction_remove(hostfilter, db.db.nmap)
+        utils.touch_db_stamp("nmap")
         sys.exit(0)
     if args.json:
 
@@ -56,6 +56,8 @@ def main() -> None:
         "bottle",
         "OpenSSL",
         "tinydb",
+        "lz4",
+        "lzo",
     ]:
         try:
             version = __import__(module).__version__
@@ -26,7 +26,7 @@ import sys
 from typing import Callable
 
 
-from ivre import graphroute
+from ivre import graphroute, utils
 from ivre.db import db
 from ivre.nmapout import displayhosts
 from ivre.activecli import (
@@ -131,6 +131,12 @@ def main() -> None:
         default="NA",
         help='String to use for "Not Applicable" value ' '(defaults to "NA")',
     )
+    parser.add_argument(
+        "--rebuild-rollups",
+        action="store_true",
+        help="Rebuild (and check) the precomputed counts used for the "
+        "most common top values.",
+    )
 
     args = parser.parse_args()
 
@@ -145,6 +151,7 @@ def main() -> None:
             if ans.lower() not in ["y", "yes"]:
                 sys.exit(0)
         db.view.init()
+        utils.touch_db_stamp("view")
         sys.exit(0)
     if args.ensure_indexes:
         if os.isatty(sys.stdin.fileno()):
@@ -154,6 +161,11 @@ def main() -> None:
                 sys.exit(-1)
         db.view.ensure_indexes()
         sys.exit(0)
+    if args.rebuild_rollups:
+        errors = db.view.rebuild_rollups()
+        if errors:
+            utils.LOGGER.warning("%d wrong or missing count(s) fixed", errors)
+        sys.exit(0)
 
     if args.top is not None:
         sys.stdout.writelines(db.view.display_top(args.top, flt, args.limit))
@@ -176,6 +188,7 @@ def main() -> None:
         sys.exit(0)
     if args.delete:
         displayfunction_remove(flt, db.view)
+        utils.touch_db_stamp("view")
         sys.exit(0)
     if args.json:
 
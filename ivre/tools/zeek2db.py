@@ -80,9 +80,10 @@ def _sip_paths_search_tcp(paths: Iterable[str]) -> bool:
 
 
 def sip2flow(bulk: Bulk, rec: Record) -> None:
-    found_tcp = _sip_paths_search_tcp(rec["response_path"]) or _sip_paths_search_tcp(
-        rec["request_path"]
-    )
+    # unset fields are omitted in JSON logs
+    found_tcp = _sip_paths_search_tcp(
+        rec.get("response_path") or []
+    ) or _sip_paths_search_tcp(rec.get("request_path") or [])
     rec["proto"] = "tcp" if found_tcp else "udp"
     db.flow.any2flow(bulk, "sip", rec)
 
@@ -103,8 +104,8 @@ def rdp2flow(bulk: Bulk, rec: Record) -> None:
 
 
 def dns2flow(bulk: Bulk, rec: Record) -> None:
-    rec["answers"] = [elt.lower() for elt in (rec["answers"] if rec["answers"] else [])]
-    rec["query"] = rec["query"].lower() if rec["query"] else None
+    rec["answers"] = [elt.lower() for elt in rec.get("answers") or []]
+    rec["query"] = rec["query"].lower() if rec.get("query") else None
     db.flow.any2flow(bulk, "dns", rec)
 
 
@@ -162,10 +163,10 @@ def main() -> None:
             else:
                 utils.LOGGER.debug("Log format not (yet) supported for %r", fname)
                 continue
-            for line in zeekf:
+            for line in zeekf.iter_records():
                 if not line:
                     continue
                 func(bulk, _zeek2flow(line))
             db.flow.bulk_commit(bulk)
             if zeekf.path == "conn" and not args.no_cleanup:
-                db.flow.cleanup_flows()
+                db.flow.cleanup_flows(bulk)
@@ -29,20 +29,25 @@ import argparse
 from bisect import bisect_left
 import base64
 import bz2
+from collections import OrderedDict
 import datetime
 import functools
 import gzip
 import hashlib
+import heapq
 from io import BytesIO
 import logging
 import math
 import os
+import pickle
 import re
 import shutil
 import socket
+import stat
 import struct
 import subprocess
 import sys
+import tempfile
 import time
 from types import TracebackType
 from typing import (
@@ -66,6 +71,11 @@ from typing import (
 from urllib.parse import urlparse
 
 
+try:
+    from re import _parser as sre_parse  # type: ignore
+except ImportError:
+    # Python < 3.11
+    import sre_parse
 try:
     from OpenSSL import crypto as osslc  # type: ignore
     from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
@@ -82,7 +92,7 @@ else:
     USE_PIL = True
 
 
-from ivre import config
+from ivre import VERSION, config
 from ivre.types import NmapProbe, NmapProbeRec, NmapServiceMatch, Record
 
 
@@ -1180,22 +1190,169 @@ def guess_srv_port(port1: int, port2: int, proto: str = "tcp") -> int:
     return cmpval
 
 
+_PARSED_FILES_CACHE_WRITE_FAILED = False
+
+
+def check_cache_file(fdesc: BinaryIO) -> bool:
+    """Returns True when the (open) cache file `fdesc` can be trusted:
+    it must be owned by the current user, and neither the file nor
+    its directory can be written by other users. Since loading pickled
+    data can run arbitrary code, the cache files that do not pass this
+    check must not be loaded.
+
+    """
+    if not hasattr(os, "getuid"):
+        return True
+    uid = os.getuid()
+    for fstat in [
+        os.fstat(fdesc.fileno()),
+        os.stat(os.path.dirname(os.path.abspath(fdesc.name))),
+    ]:
+        if fstat.st_uid != uid or fstat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            return False
+    return True
+
+
+def load_parsed_file(fname: str, parser: Callable[[str], Any]) -> Any:
+    """Returns the result of `parser(fname)`, using an on-disk cache:
+    the parsed data is stored (using pickle) in a directory under
+    `config.CACHE_PATH`, and is used as long as IVRE's version, the
+    modification time and the size of `fname` do not change. The
+    cache file is ignored when it fails the checks of
+    `check_cache_file()`.
+
+    """
+    global _PARSED_FILES_CACHE_WRITE_FAILED
+    if not config.CACHE_PATH:
+        return parser(fname)
+    fstat = os.stat(fname)
+    key = (VERSION, fname, fstat.st_mtime_ns, fstat.st_size)
+    cachefname = os.path.join(
+        config.CACHE_PATH,
+        "parsed",
+        "%s-%s.pickle"
+        % (os.path.basename(fname), hashlib.sha256(fname.encode()).hexdigest()[:16]),
+    )
+    # The key and the data are pickled separately, so that the data
+    # (which may use classes from another version) is only loaded
+    # when the key matches.
+    try:
+        with open(cachefname, "rb") as fdesc:
+            if not check_cache_file(fdesc):
+                LOGGER.warning(
+                    "Ignoring cache file %r: not owned by the current user or "
+                    "writable by other users",
+                    cachefname,
+                )
+            elif pickle.load(fdesc) == key:
+                return pickle.load(fdesc)
+    except FileNotFoundError:
+        pass
+    except Exception:
+        LOGGER.warning("Cannot read cache file %r", cachefname, exc_info=True)
+    data = parser(fname)
+    tmpfname = None
+    try:
+        makedirs(os.path.dirname(cachefname))
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(cachefname), delete=False
+        ) as tmpfdesc:
+            tmpfname = tmpfdesc.name
+            pickle.dump(key, tmpfdesc, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(data, tmpfdesc, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpfname, cachefname)
+    except Exception:
+        if tmpfname is not None:
+            try:
+                os.unlink(tmpfname)
+            except OSError:
+                pass
+        # e.g., CACHE_PATH not writable by the Web server's user: this
+        # is not an error, and it would happen for each file.
+        if not _PARSED_FILES_CACHE_WRITE_FAILED:
+            _PARSED_FILES_CACHE_WRITE_FAILED = True
+            LOGGER.debug("Cannot write cache file %r", cachefname, exc_info=True)
+    return data
+
+
+def touch_db_stamp(purpose: str) -> None:
+    """Records that the database for `purpose` ("nmap", "view",
+    "passive", etc.) has been modified, by touching a file under
+    `config.DB_STAMPS_PATH`; this is used by the Web application to
+    invalidate its cached results.
+
+    """
+    if not config.DB_STAMPS_PATH:
+        return
+    fname = os.path.join(config.DB_STAMPS_PATH, purpose)
+    try:
+        makedirs(config.DB_STAMPS_PATH)
+        with open(fname, "ab"):
+            pass
+        os.utime(fname)
+    except OSError:
+        LOGGER.warning("Cannot update stamp file %r", fname, exc_info=True)
+
+
+def get_db_stamp(purpose: str) -> Optional[int]:
+    """Returns the last time (in nanoseconds) the database for
+    `purpose` has been recorded as modified by touch_db_stamp(), or
+    None when unknown.
+
+    """
+    if not config.DB_STAMPS_PATH:
+        return None
+    try:
+        return os.stat(os.path.join(config.DB_STAMPS_PATH, purpose)).st_mtime_ns
+    except OSError:
+        return None
+
+
+class LazyPattern:
+    """A regular expression, compiled on first use. Only the pattern
+    and the flags are pickled.
+
+    """
+
+    __slots__ = ["pattern", "flags", "_regexp"]
+
+    def __init__(self, pattern: bytes, flags: int = 0) -> None:
+        self.pattern = pattern
+        self.flags = flags
+        self._regexp: Optional[Pattern[bytes]] = None
+
+    def __reduce__(self) -> Tuple[Type["LazyPattern"], Tuple[bytes, int]]:
+        return (self.__class__, (self.pattern, self.flags))
+
+    @property
+    def regexp(self) -> Pattern[bytes]:
+        if self._regexp is None:
+            self._regexp = re.compile(self.pattern, flags=self.flags)
+        return self._regexp
+
+    def search(self, string: bytes) -> Optional[Match[bytes]]:
+        return self.regexp.search(string)
+
+
 _NMAP_PROBES: Dict[
     str,
     Dict[str, NmapProbeRec],
 ] = {}
 _NMAP_PROBES_POPULATED = False
-_NMAP_CUR_PROBE: Optional[NmapProbe] = None
-_NMAP_CUR_FALLBACK: Optional[List[str]] = None
 
 
-def _read_nmap_probes() -> None:
-    global _NMAP_CUR_PROBE, _NMAP_CUR_FALLBACK, _NMAP_PROBES_POPULATED
-    _NMAP_CUR_PROBE = None
-    _NMAP_CUR_FALLBACK = None
+def _parse_nmap_probes(
+    fname: str,
+) -> Tuple[
+    Dict[str, Dict[str, NmapProbeRec]],
+    Dict[Tuple[str, str], "_NmapFingerprintsFilter"],
+]:
+    probes: Dict[str, Dict[str, NmapProbeRec]] = {}
+    cur_probe: Optional[NmapProbe] = None
+    cur_fallback: Optional[List[str]] = None
 
     def parse_line(line: bytes) -> None:
-        global _NMAP_PROBES, _NMAP_CUR_PROBE, _NMAP_CUR_FALLBACK
+        nonlocal cur_probe, cur_fallback
         if line.startswith(b"match "):
             line = line[6:]
             soft = False
@@ -1203,23 +1360,21 @@ def _read_nmap_probes() -> None:
             line = line[10:]
             soft = True
         elif line.startswith(b"fallback "):
-            assert _NMAP_CUR_FALLBACK is not None
-            _NMAP_CUR_FALLBACK.append(line[9:].decode())
+            assert cur_fallback is not None
+            cur_fallback.append(line[9:].decode())
             return
         elif line.startswith(b"Probe "):
-            _NMAP_CUR_PROBE = []
-            _NMAP_CUR_FALLBACK = []
+            cur_probe = []
+            cur_fallback = []
             proto, name, probe = line[6:].split(b" ", 2)
             if not (len(probe) >= 3 and probe[:2] == b"q|" and probe[-1:] == b"|"):
                 LOGGER.warning("Invalid nmap probe %r", probe)
             else:
                 probe = nmap_decode_data(probe[2:-1].decode(), arbitrary_escapes=True)
-            assert _NMAP_CUR_PROBE is not None
-            assert _NMAP_CUR_FALLBACK is not None
-            _NMAP_PROBES.setdefault(proto.lower().decode(), {})[name.decode()] = {
+            probes.setdefault(proto.lower().decode(), {})[name.decode()] = {
                 "probe": probe,
-                "fp": _NMAP_CUR_PROBE,
-                "fallbacks": _NMAP_CUR_FALLBACK,
+                "fp": cur_probe,
+                "fallbacks": cur_fallback,
             }
             return
         else:
@@ -1237,7 +1392,7 @@ def _read_nmap_probes() -> None:
             data = data[1:]
             index = data.index(sep)
             value = data[:index]
-            value_out: Union[Pattern[bytes], str]
+            value_out: Union[LazyPattern, str]
             data = data[index + 1 :]
             flag = b""
             if data:
@@ -1252,7 +1407,7 @@ def _read_nmap_probes() -> None:
                     value = value[:3] + b"(?:\\\\n|$)"
                 elif value.endswith(b"\\n"):
                     value = value[:-2] + b"(?:\\n|$)"
-                value_out = re.compile(
+                value_out = LazyPattern(
                     value,
                     flags=sum(
                         getattr(re, f) if hasattr(re, f) else 0
@@ -1270,19 +1425,32 @@ def _read_nmap_probes() -> None:
             else:
                 info[key] = (value_out, flag)
             data = data.lstrip(b" ")
-        assert _NMAP_CUR_PROBE is not None
-        _NMAP_CUR_PROBE.append((service.decode(), info))
+        assert cur_probe is not None
+        cur_probe.append((service.decode(), info))
+
+    with open(fname, "rb") as fdesc:
+        for fline in fdesc:
+            parse_line(fline[:-1])
+    # The fingerprints filters are computed here, so that they are
+    # cached with the probes.
+    filters = {
+        (proto, name): _NmapFingerprintsFilter(probe_data["fp"])
+        for proto, proto_probes in probes.items()
+        for name, probe_data in proto_probes.items()
+    }
+    return probes, filters
+
 
+def _read_nmap_probes() -> None:
+    global _NMAP_PROBES, _NMAP_FINGERPRINTS_FILTERS, _NMAP_PROBES_POPULATED
     try:
         assert config.NMAP_SHARE_PATH is not None
-        with open(
-            os.path.join(config.NMAP_SHARE_PATH, "nmap-service-probes"), "rb"
-        ) as fdesc:
-            for fline in fdesc:
-                parse_line(fline[:-1])
+        _NMAP_PROBES, _NMAP_FINGERPRINTS_FILTERS = load_parsed_file(
+            os.path.join(config.NMAP_SHARE_PATH, "nmap-service-probes"),
+            _parse_nmap_probes,
+        )
     except (AttributeError, AssertionError, TypeError, IOError):
         LOGGER.warning("Cannot read Nmap service fingerprint file.", exc_info=True)
-    del _NMAP_CUR_PROBE, _NMAP_CUR_FALLBACK
     _NMAP_PROBES_POPULATED = True
 
 
@@ -1299,11 +1467,178 @@ def get_nmap_probes(proto: str) -> Dict[bytes, str]:
     return {value["probe"]: name for name, value in _NMAP_PROBES[proto].items()}
 
 
+def _sre_literals(items: Any, nocase: bool) -> List[bytes]:
+    """Returns the literal strings that any string matched by the
+    parsed regular expression `items` (as returned by sre_parse) has
+    to contain.
+
+    """
+    result = []
+    cur: List[int] = []
+    for opcode, value in items:
+        if opcode is sre_parse.LITERAL:
+            cur.append(value)
+            continue
+        if cur:
+            result.append(bytes(cur))
+            cur = []
+        if opcode is sre_parse.SUBPATTERN:
+            # value: (group, add_flags, del_flags, items)
+            if nocase or not value[1] & sre_parse.SRE_FLAG_IGNORECASE:
+                result.extend(_sre_literals(value[-1], nocase))
+        elif opcode in {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT}:
+            # value: (min, max, items)
+            if value[0] >= 1:
+                result.extend(_sre_literals(value[2], nocase))
+    if cur:
+        result.append(bytes(cur))
+    return result
+
+
+def _sre_prefix(items: Any, nocase: bool) -> bytes:
+    """Returns the literal string that any string matched by the
+    parsed regular expression `items` (as returned by sre_parse),
+    once its anchor has been removed, starts with.
+
+    """
+    cur: List[int] = []
+    for opcode, value in items:
+        if opcode is sre_parse.LITERAL:
+            cur.append(value)
+            continue
+        if opcode is sre_parse.SUBPATTERN and (
+            nocase or not value[1] & sre_parse.SRE_FLAG_IGNORECASE
+        ):
+            cur.extend(_sre_prefix(value[-1], nocase))
+        break
+    return bytes(cur)
+
+
+class _NmapFingerprintsFilter:
+    """Prefilter for the fingerprints of an Nmap probe.
+
+    For each fingerprint, the literal prefix (when the regular
+    expression is anchored at the beginning of the data) and the
+    longest literal substring that a matching output has to contain
+    are extracted from the regular expression. The `.candidates()`
+    method uses them to skip the fingerprints that cannot match a
+    given output, so that only candidate regular expressions are run.
+
+    """
+
+    def __init__(self, fingerprints: NmapProbe) -> None:
+        # (substring, index) lists for the fingerprints that have a
+        # prefix (by prefix) and for the others; prefixes and
+        # substrings are lowered for case-insensitive regexps
+        self.by_prefix: Dict[bytes, List[Tuple[bytes, int]]] = {}
+        self.by_prefix_nocase: Dict[bytes, List[Tuple[bytes, int]]] = {}
+        self.others: List[Tuple[bytes, int]] = []
+        self.others_nocase: List[Tuple[bytes, int]] = []
+        for i, (_, fingerprint) in enumerate(fingerprints):
+            prefix, substring, nocase = self._parse(fingerprint["m"][0])
+            if prefix:
+                (self.by_prefix_nocase if nocase else self.by_prefix).setdefault(
+                    prefix, []
+                ).append((substring, i))
+            else:
+                (self.others_nocase if nocase else self.others).append((substring, i))
+        self.prefix_lengths = sorted({len(prefix) for prefix in self.by_prefix})
+        self.prefix_lengths_nocase = sorted(
+            {len(prefix) for prefix in self.by_prefix_nocase}
+        )
+
+    @staticmethod
+    def _parse(regexp: LazyPattern) -> Tuple[bytes, bytes, bool]:
+        try:
+            parsed = sre_parse.parse(regexp.pattern, regexp.flags)
+        except Exception:
+            LOGGER.warning("Cannot parse regexp %r", regexp.pattern, exc_info=True)
+            return b"", b"", bool(regexp.flags & re.IGNORECASE)
+        # flags, including the inline ones (e.g., "(?i)")
+        try:
+            flags = parsed.state.flags
+        except AttributeError:
+            # Python < 3.8
+            flags = parsed.pattern.flags
+        nocase = bool(flags & re.IGNORECASE)
+        items = list(parsed)
+        literals = _sre_literals(items, nocase)
+        substring = max(literals, key=len) if literals else b""
+        prefix = b""
+        if items and items[0][0] is sre_parse.AT:
+            if items[0][1] is sre_parse.AT_BEGINNING_STRING or (
+                items[0][1] is sre_parse.AT_BEGINNING
+                and not flags & re.MULTILINE
+            ):
+                prefix = _sre_prefix(items[1:], nocase)
+        if nocase:
+            return prefix.lower(), substring.lower(), nocase
+        return prefix, substring, nocase
+
+    def candidates(self, output: bytes) -> Iterable[int]:
+        """Returns the indexes (in increasing order) of the
+        fingerprints that may match `output`.
+
+        """
+        indexes = []
+        for data, by_prefix, lengths, others in [
+            (output, self.by_prefix, self.prefix_lengths, self.others),
+            (
+                output.lower(),
+                self.by_prefix_nocase,
+                self.prefix_lengths_nocase,
+                self.others_nocase,
+            ),
+        ]:
+            indexes.append([i for substring, i in others if substring in data])
+            for length in lengths:
+                if length > len(data):
+                    break
+                try:
+                    candidates = by_prefix[data[:length]]
+                except KeyError:
+                    continue
+                indexes.append([i for substring, i in candidates if substring in data])
+        return heapq.merge(*indexes)
+
+
+_NMAP_FINGERPRINTS_FILTERS: Dict[Tuple[str, str], _NmapFingerprintsFilter] = {}
+_NMAP_SVC_FP_CACHE: "OrderedDict[Tuple[bytes, str, str, bool], NmapServiceMatch]" = (
+    OrderedDict()
+)
+
+
 def match_nmap_svc_fp(
     output: bytes, proto: str = "tcp", probe: str = "NULL", soft: bool = False
 ) -> NmapServiceMatch:
     """Take output from a given probe and return the closest nmap
-    fingerprint."""
+    fingerprint.
+
+    The last results (up to config.NMAP_SVC_FP_CACHE_SIZE) are kept
+    in memory, indexed by a digest of `output` (banners may be large).
+
+    """
+    if not config.NMAP_SVC_FP_CACHE_SIZE:
+        return _match_nmap_svc_fp(output, proto=proto, probe=probe, soft=soft)
+    key = (hashlib.sha256(output).digest(), proto, probe, soft)
+    if key in _NMAP_SVC_FP_CACHE:
+        _NMAP_SVC_FP_CACHE.move_to_end(key)
+        result = _NMAP_SVC_FP_CACHE[key]
+    else:
+        result = _match_nmap_svc_fp(output, proto=proto, probe=probe, soft=soft)
+        _NMAP_SVC_FP_CACHE[key] = result
+        if len(_NMAP_SVC_FP_CACHE) > config.NMAP_SVC_FP_CACHE_SIZE:
+            _NMAP_SVC_FP_CACHE.popitem(last=False)
+    # the results may be modified by the callers
+    result = result.copy()
+    if "cpe" in result:
+        result["cpe"] = result["cpe"][:]
+    return result
+
+
+def _match_nmap_svc_fp(
+    output: bytes, proto: str = "tcp", probe: str = "NULL", soft: bool = False
+) -> NmapServiceMatch:
     softmatch: NmapServiceMatch = {}
     result: NmapServiceMatch = {}
     try:
@@ -1316,7 +1651,14 @@ def match_nmap_svc_fp(
         pass
     else:
         fallbacks = probe_data.get("fallbacks")
-        for service, fingerprint in fingerprints:
+        try:
+            fpfilter = _NMAP_FINGERPRINTS_FILTERS[(proto, probe)]
+        except KeyError:
+            fpfilter = _NMAP_FINGERPRINTS_FILTERS[
+                (proto, probe)
+            ] = _NmapFingerprintsFilter(fingerprints)
+        for i in fpfilter.candidates(output):
+            service, fingerprint = fingerprints[i]
             match = fingerprint["m"][0].search(output)
             if match is not None:
                 if probe == "NULL" and service == "landesk-rc":
@@ -1381,13 +1723,11 @@ def match_nmap_svc_fp(
     return softmatch
 
 
-_NMAP_PAYLOADS = {}
+_NMAP_PAYLOADS: Dict[bytes, str] = {}
 _NMAP_PAYLOADS_POPULATED = False
 
 
-def _read_nmap_payloads() -> None:
-    global _NMAP_PAYLOADS_POPULATED
-
+def _parse_nmap_payloads(fname: str) -> Dict[bytes, str]:
     def _parse_line(line: str) -> Generator[str, None, None]:
         status = 0
         for c in line:
@@ -1405,35 +1745,45 @@ def _read_nmap_payloads() -> None:
                 if c == '"':
                     status = 0
 
+    payloads = {}
+    cur_probe = None
+    cur_line = []
+    with open(fname, "r") as fdesc:
+        for line in fdesc:
+            line = "".join(_parse_line(line.strip()))
+            if not line.strip():
+                continue
+            if line.startswith("source "):
+                continue
+            if line.startswith("udp "):
+                line_l = line.strip().split(" ", 2)[1:]
+                if cur_probe is not None:
+                    payloads[nmap_decode_data("".join(cur_line))] = cur_probe
+                cur_probe = line_l.pop(0)
+                if line_l:
+                    line = line_l[0]
+                    if len(line) > 3 and line[0] == line[-1] == '"':
+                        line = line[1:-1]
+                    cur_line = [line]
+                else:
+                    cur_line = []
+            elif line.startswith('"'):
+                if len(line.strip()) > 1 and line[-1] == '"':
+                    line = line[1:-1]
+                cur_line.append(line)
+    if cur_probe is not None:
+        payloads[nmap_decode_data("".join(cur_line))] = cur_probe
+    return payloads
+
+
+def _read_nmap_payloads() -> None:
+    global _NMAP_PAYLOADS, _NMAP_PAYLOADS_POPULATED
     try:
-        cur_probe = None
-        cur_line = []
         assert config.NMAP_SHARE_PATH is not None
-        with open(os.path.join(config.NMAP_SHARE_PATH, "nmap-payloads"), "r") as fdesc:
-            for line in fdesc:
-                line = "".join(_parse_line(line.strip()))
-                if not line.strip():
-                    continue
-                if line.startswith("source "):
-                    continue
-                if line.startswith("udp "):
-                    line_l = line.strip().split(" ", 2)[1:]
-                    if cur_probe is not None:
-                        _NMAP_PAYLOADS[nmap_decode_data("".join(cur_line))] = cur_probe
-                    cur_probe = line_l.pop(0)
-                    if line_l:
-                        line = line_l[0]
-                        if len(line) > 3 and line[0] == line[-1] == '"':
-                            line = line[1:-1]
-                        cur_line = [line]
-                    else:
-                        cur_line = []
-                elif line.startswith('"'):
-                    if len(line.strip()) > 1 and line[-1] == '"':
-                        line = line[1:-1]
-                    cur_line.append(line)
-        if cur_probe is not None:
-            _NMAP_PAYLOADS[nmap_decode_data("".join(cur_line))] = cur_probe
+        _NMAP_PAYLOADS = load_parsed_file(
+            os.path.join(config.NMAP_SHARE_PATH, "nmap-payloads"),
+            _parse_nmap_payloads,
+        )
     except (AttributeError, AssertionError, TypeError, IOError):
         LOGGER.warning("Cannot read Nmap service fingerprint file.", exc_info=True)
     _NMAP_PAYLOADS_POPULATED = True
@@ -1445,33 +1795,40 @@ def get_nmap_udp_payloads() -> Dict[bytes, str]:
     return _NMAP_PAYLOADS
 
 
-_IKESCAN_VENDOR_IDS: List[Tuple[bytes, Pattern[bytes]]]
+_IKESCAN_VENDOR_IDS: List[Tuple[bytes, LazyPattern]]
 _IKESCAN_VENDOR_IDS_POPULATED = False
 
 
+def _parse_ikescan_vendor_ids(fname: str) -> List[Tuple[bytes, LazyPattern]]:
+    with open(fname, "rb") as fdesc:
+        sep = re.compile(b"\\t+")
+        return [
+            (
+                line[0],
+                LazyPattern(line[1].replace(b"[[:xdigit:]]", b"[0-9a-f]"), re.I),
+            )
+            for line in (
+                sep.split(line, 1)
+                for line in (line.strip().split(b"#", 1)[0] for line in fdesc)
+                if line
+            )
+        ]
+
+
 def _read_ikescan_vendor_ids() -> None:
     global _IKESCAN_VENDOR_IDS, _IKESCAN_VENDOR_IDS_POPULATED
     try:
         assert config.DATA_PATH is not None
-        with open(os.path.join(config.DATA_PATH, "ike-vendor-ids"), "rb") as fdesc:
-            sep = re.compile(b"\\t+")
-            _IKESCAN_VENDOR_IDS = [
-                (
-                    line[0],
-                    re.compile(line[1].replace(b"[[:xdigit:]]", b"[0-9a-f]"), re.I),
-                )
-                for line in (
-                    sep.split(line, 1)
-                    for line in (line.strip().split(b"#", 1)[0] for line in fdesc)
-                    if line
-                )
-            ]
+        _IKESCAN_VENDOR_IDS = load_parsed_file(
+            os.path.join(config.DATA_PATH, "ike-vendor-ids"),
+            _parse_ikescan_vendor_ids,
+        )
     except (AttributeError, AssertionError, IOError):
         LOGGER.warning("Cannot read ike-scan vendor IDs file.", exc_info=True)
     _IKESCAN_VENDOR_IDS_POPULATED = True
 
 
-def get_ikescan_vendor_ids() -> List[Tuple[bytes, Pattern[bytes]]]:
+def get_ikescan_vendor_ids() -> List[Tuple[bytes, LazyPattern]]:
     global _IKESCAN_VENDOR_IDS, _IKESCAN_VENDOR_IDS_POPULATED
     if not _IKESCAN_VENDOR_IDS_POPULATED:
         _read_ikescan_vendor_ids()
@@ -1506,11 +1863,11 @@ def _int2macmask(mask: int) -> int:
     return (0xFFFFFFFFFFFF000000000000 >> mask) & 0xFFFFFFFFFFFF
 
 
-def _read_wireshark_manuf_db() -> None:
-    global _WIRESHARK_MANUF_DB_LAST_ADDR, _WIRESHARK_MANUF_DB_VALUES, _WIRESHARK_MANUF_DB_POPULATED
-
-    if config.WIRESHARK_SHARE_PATH is None:
-        return
+def _parse_wireshark_manuf_db(
+    fname: str,
+) -> Tuple[List[int], List[Optional[Tuple[str, Optional[str]]]]]:
+    last_addrs: List[int] = []
+    values: List[Optional[Tuple[str, Optional[str]]]] = []
 
     def parse_line(line: str) -> None:
         line = line.split("#", 1)[0]
@@ -1547,27 +1904,33 @@ def _read_wireshark_manuf_db() -> None:
                 line,
             )
             return
-        if (
-            _WIRESHARK_MANUF_DB_LAST_ADDR
-            and _WIRESHARK_MANUF_DB_LAST_ADDR[-1] != addr_int - 1
-        ):
-            _WIRESHARK_MANUF_DB_LAST_ADDR.append(addr_int - 1)
-            _WIRESHARK_MANUF_DB_VALUES.append(None)
-        elif _WIRESHARK_MANUF_DB_VALUES and _WIRESHARK_MANUF_DB_VALUES[-1] == (
-            manuf,
-            comment,
-        ):
-            _WIRESHARK_MANUF_DB_LAST_ADDR.pop()
-            _WIRESHARK_MANUF_DB_VALUES.pop()
-        _WIRESHARK_MANUF_DB_LAST_ADDR.append(
-            (addr_int & _int2macmask(mask)) + 2 ** (48 - mask) - 1
-        )
-        _WIRESHARK_MANUF_DB_VALUES.append((manuf, comment))
+        if last_addrs and last_addrs[-1] != addr_int - 1:
+            last_addrs.append(addr_int - 1)
+            values.append(None)
+        elif values and values[-1] == (manuf, comment):
+            last_addrs.pop()
+            values.pop()
+        last_addrs.append((addr_int & _int2macmask(mask)) + 2 ** (48 - mask) - 1)
+        values.append((manuf, comment))
+
+    with open(fname, "r") as fdesc:
+        for line in fdesc:
+            parse_line(line[:-1])
+    return last_addrs, values
+
+
+def _read_wireshark_manuf_db() -> None:
+    global _WIRESHARK_MANUF_DB_LAST_ADDR, _WIRESHARK_MANUF_DB_VALUES, _WIRESHARK_MANUF_DB_POPULATED
+
+    if config.WIRESHARK_SHARE_PATH is None:
+        return
 
     try:
-        with open(os.path.join(config.WIRESHARK_SHARE_PATH, "manuf"), "r") as fdesc:
-            for line in fdesc:
-                parse_line(line[:-1])
+        last_addrs, values = load_parsed_file(
+            os.path.join(config.WIRESHARK_SHARE_PATH, "manuf"),
+            _parse_wireshark_manuf_db,
+        )
+        _WIRESHARK_MANUF_DB_LAST_ADDR, _WIRESHARK_MANUF_DB_VALUES = last_addrs, values
     except (AttributeError, TypeError, IOError):
         LOGGER.warning("Cannot read Wireshark manufacturer database.", exc_info=True)
     _WIRESHARK_MANUF_DB_POPULATED = True
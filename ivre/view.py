@@ -21,7 +21,10 @@
 
 
 from datetime import datetime
+import heapq
+from queue import Empty, Queue
 from textwrap import wrap
+from threading import Event, Thread
 
 
 from ivre.active.cpe import add_cpe_values
@@ -29,7 +32,7 @@ from ivre.active.data import create_ssl_output, set_openports_attribute
 from ivre.data import scanners
 from ivre.db import db
 from ivre.passive import SCHEMA_VERSION as PASSIVE_SCHEMA_VERSION
-from ivre import utils
+from ivre import config, utils
 from ivre.xmlnmap import SCHEMA_VERSION as ACTIVE_SCHEMA_VERSION, add_hostname
 
 
@@ -706,20 +709,27 @@ def from_passive(flt, category=None):
     records = passive_to_view(flt, category=category)
     cur_addr = None
     cur_rec = {}
+    # records are sorted by address: their "infos" are resolved by
+    # batches, using one walk of the IP data databases per batch
+    pending = []
     for rec in records:
         if cur_addr is None:
             cur_addr = rec["addr"]
             cur_rec = rec
         elif cur_addr != rec["addr"]:
             # TODO: add_addr_info should be optional
-            cur_rec["infos"] = {}
-            for func in [db.data.country_byip, db.data.as_byip, db.data.location_byip]:
-                cur_rec["infos"].update(func(cur_addr) or {})
-            yield cur_rec
+            pending.append(cur_rec)
+            if len(pending) >= config.DATA_BATCH_SIZE:
+                db.data.add_addr_infos_many(pending)
+                yield from pending
+                pending = []
             cur_rec = rec
             cur_addr = rec["addr"]
         else:
             cur_rec = db.view.merge_host_docs(cur_rec, rec)
+    if pending:
+        db.data.add_addr_infos_many(pending)
+        yield from pending
     if cur_rec:
         yield cur_rec
 
@@ -780,18 +790,65 @@ def from_nmap(flt, category=None):
         yield cur_rec
 
 
-def to_view(itrs):
-    """Takes a list of iterators over view-formated results, and returns an
-    iterator over merged results, sorted by ip.
+def _threaded_iterator(itr, batch_size=100, max_batches=16):
+    """Consumes the iterator `itr` in a separate thread, and returns an
+    iterator over its values. The values are passed to the calling
+    thread by batches of `batch_size` values, and at most
+    `max_batches` batches are kept in memory.
+
+    When the returned iterator is closed (or garbage collected) before
+    the end, the thread stops and closes `itr` when possible.
 
     """
+    queue = Queue(maxsize=max_batches)
+    stop = Event()
+
+    def _consume():
+        batch = []
+        try:
+            for value in itr:
+                batch.append(value)
+                if len(batch) >= batch_size:
+                    queue.put((batch, None))
+                    batch = []
+                    if stop.is_set():
+                        if hasattr(itr, "close"):
+                            itr.close()
+                        return
+        except Exception as exc:
+            queue.put((batch, exc))
+        else:
+            queue.put((batch, StopIteration()))
+
+    Thread(target=_consume, daemon=True).start()
+    try:
+        while True:
+            batch, exc = queue.get()
+            yield from batch
+            if isinstance(exc, StopIteration):
+                return
+            if exc is not None:
+                raise exc
+    finally:
+        # Empty the queue so that the thread, if it is waiting to put
+        # a batch, can see that it has to stop.
+        stop.set()
+        while True:
+            try:
+                queue.get_nowait()
+            except Empty:
+                break
+
+
+def to_view(itrs, threads=False):
+    """Takes a list of iterators over view-formated results, and returns an
+    iterator over merged results, sorted by ip.
 
-    def next_record(rec, updt):
-        if rec is None:
-            return updt
-        return db.view.merge_host_docs(rec, updt)
+    The iterators are merged using a heap, keyed on the addresses (as
+    integers). When `threads` is True, each iterator is consumed in
+    its own thread.
 
-    next_recs = []
+    """
 
     def prepare_record(rec):
         for port in rec.get("ports", []):
@@ -804,45 +861,34 @@ def to_view(itrs):
                     )
         return rec
 
-    # We cannot use a `for itr in itrs` loop here because itrs is
-    # modified in the loop.
-    i = 0
-    while i < len(itrs):
+    if threads:
+        itrs = [_threaded_iterator(itr) for itr in itrs]
+    # The heap contains (address, iterator index, record) tuples; the
+    # iterator index ensures that records with the same address are
+    # merged in the order of `itrs`.
+    heap = []
+    for i, itr in enumerate(itrs):
+        for rec in itr:
+            heap.append((utils.ip2int(rec["addr"]), i, rec))
+            break
+    heapq.heapify(heap)
+    cur_addr = None
+    cur_rec = None
+    while heap:
+        addr, i, rec = heap[0]
         try:
-            next_recs.append(next(itrs[i]))
+            nextrec = next(itrs[i])
         except StopIteration:
-            # We need to remove the corresponding iterator from itrs,
-            # which happens to be the n-th where n is the current
-            # length of next_recs.
-            del itrs[len(next_recs)]  # Do not increment i here
+            heapq.heappop(heap)
+        else:
+            heapq.heapreplace(heap, (utils.ip2int(nextrec["addr"]), i, nextrec))
+        if cur_rec is None:
+            cur_rec = rec
+        elif addr == cur_addr:
+            cur_rec = db.view.merge_host_docs(cur_rec, rec)
         else:
-            i += 1
-    next_addrs = [rec["addr"] for rec in next_recs]
-    cur_rec = None
-    try:
-        cur_addr = min(next_addrs, key=utils.ip2int)
-    except ValueError:
-        # next_addrs is empty
-        cur_addr = None
-    while next_recs:
-        # We cannot use a `for i in range(len(itrs))` loop because
-        # itrs is modified in the loop.
-        i = 0
-        while i < len(itrs):
-            if next_addrs[i] == cur_addr:
-                cur_rec = next_record(cur_rec, next_recs[i])
-                try:
-                    next_recs[i] = next(itrs[i])
-                except StopIteration:
-                    del next_addrs[i]
-                    del next_recs[i]
-                    del itrs[i]
-                    continue  # Do not increment i here
-                next_addrs[i] = next_recs[i]["addr"]
-            i += 1
-        if next_addrs and cur_addr not in next_addrs:
             yield prepare_record(cur_rec)
-            cur_rec = None
-            cur_addr = min(next_addrs)
+            cur_rec = rec
+        cur_addr = addr
     if cur_rec is not None:
         yield prepare_record(cur_rec)
@@ -28,7 +28,7 @@ application.
 
 from collections import namedtuple
 import datetime
-from functools import wraps
+from functools import partial, wraps
 import json
 import os
 import tempfile
@@ -425,12 +425,8 @@ def get_top(subdb, field):
     :>jsonarr int value: count for this value
 
     """
-    subdb = {
-        "passive": db.passive,
-        "scans": db.nmap,
-        "view": db.view,
-    }[subdb]
-    flt_params = get_base(subdb)
+    purpose = {"passive": "passive", "scans": "nmap", "view": "view"}[subdb]
+    subdb = getattr(db, purpose)
     if field[0] in "-!":
         field = field[1:]
         least = True
@@ -444,11 +440,18 @@ def get_top(subdb, field):
         except ValueError:
             field = "%s:%s" % (field, topnbr)
             topnbr = 15
-    cursor = subdb.topvalues(
-        field,
-        flt=flt_params.flt,
-        least=least,
-        topnbr=topnbr,
+    cache_key = webutils.get_cache_key("top", purpose, field, topnbr, least)
+    flt_params = get_base(subdb)
+    cursor = webutils.RESULTS_CACHE.get(
+        cache_key,
+        purpose,
+        partial(
+            subdb.topvalues,
+            field,
+            flt=flt_params.flt,
+            least=least,
+            topnbr=topnbr,
+        ),
     )
     if flt_params.fmt == "ndjson":
         for rec in cursor:
@@ -495,18 +498,21 @@ def get_distinct(subdb, field):
     :>jsonarr int value: count for this value
 
     """
-    subdb = {
-        "passive": db.passive,
-        "scans": db.nmap,
-        "view": db.view,
-    }[subdb]
+    purpose = {"passive": "passive", "scans": "nmap", "view": "view"}[subdb]
+    subdb = getattr(db, purpose)
+    cache_key = webutils.get_cache_key("distinct", purpose, field)
     flt_params = get_base(subdb)
-    cursor = subdb.distinct(
-        field,
-        flt=flt_params.flt,
-        sort=flt_params.sortby,
-        limit=flt_params.limit or subdb.no_limit,
-        skip=flt_params.skip,
+    cursor = webutils.RESULTS_CACHE.get(
+        cache_key,
+        purpose,
+        partial(
+            subdb.distinct,
+            field,
+            flt=flt_params.flt,
+            sort=flt_params.sortby,
+            limit=flt_params.limit or subdb.no_limit,
+            skip=flt_params.skip,
+        ),
     )
     if flt_params.fmt == "ndjson":
         for rec in cursor:
@@ -720,6 +726,11 @@ def import_files(subdb, source, categories, files):
                 utils.LOGGER.warning("Could not import %s", fdesc.name)
         except Exception:
             utils.LOGGER.warning("Could not import %s", fdesc.name, exc_info=True)
+    if files:
+        # Even failed imports may have stored some results
+        utils.touch_db_stamp("nmap")
+        if subdb == "view":
+            utils.touch_db_stamp("view")
     return count
 
 
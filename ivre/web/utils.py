@@ -22,13 +22,17 @@ script.
 
 """
 
+from collections import OrderedDict
 import datetime
 import functools
 import hmac
+import json
 import os
 import re
 import shlex
 import sys
+import threading
+import time
 
 try:
     import MySQLdb  # type: ignore
@@ -192,25 +196,34 @@ def _parse_query(dbase, query):
     }[query[0]](dbase, *query[1:])
 
 
-def get_init_flt(dbase):
-    """Return a filter corresponding to the current user's
-    privileges.
+def get_init_query():
+    """Return the query (as used in WEB_DEFAULT_INIT_QUERY and
+    WEB_INIT_QUERIES) corresponding to the current user's privileges,
+    or None when the user can only access to the "Shared" results and
+    to his own results (when WEB_PUBLIC_SRV is set).
 
     """
-    init_queries = {
-        key: _parse_query(dbase, value)
-        for key, value in config.WEB_INIT_QUERIES.items()
-    }
     user = get_user()
-    if user in init_queries:
-        return init_queries[user]
+    if user in config.WEB_INIT_QUERIES:
+        return config.WEB_INIT_QUERIES[user]
     if isinstance(user, str) and "@" in user:
         realm = user[user.index("@") :]
-        if realm in init_queries:
-            return init_queries[realm]
+        if realm in config.WEB_INIT_QUERIES:
+            return config.WEB_INIT_QUERIES[realm]
     if config.WEB_PUBLIC_SRV:
+        return None
+    return config.WEB_DEFAULT_INIT_QUERY or "full"
+
+
+def get_init_flt(dbase):
+    """Return a filter corresponding to the current user's
+    privileges.
+
+    """
+    query = get_init_query()
+    if query is None:
         return dbase.searchcategory(["Shared", get_anonymized_user()])
-    return _parse_query(dbase, config.WEB_DEFAULT_INIT_QUERY)
+    return _parse_query(dbase, query)
 
 
 def flt_from_query(dbase, query, base_flt=None):
@@ -848,3 +861,105 @@ def parse_filter(dbase, data):
     return getattr(dbase, func)(
         *(parse_arg(a) for a in args), **{k: parse_arg(v) for k, v in kargs.items()}
     )
+
+
+def get_cache_key(*args):
+    """Return a key identifying the results of a query, made of the
+    query (q= parameter, parsed), the filter (f= parameter,
+    normalized), the current user's privileges and `args`.
+
+    This function must be called before the parameters are consumed
+    (e.g., by query_from_params()).
+
+    """
+    if request.params.get("q"):
+        query = query_from_params({"q": request.params["q"]})
+    else:
+        query = []
+    flt = json.loads(request.params.get("f", "{}"))
+    init_query = get_init_query()
+    if init_query is None:
+        init_query = ("user", get_user())
+    return (
+        json.dumps(query),
+        json.dumps(flt, sort_keys=True),
+        init_query,
+    ) + args
+
+
+class ResultsCache:
+    """Results of queries (the top values and distinct values), kept
+    in memory.
+
+    A result is used for WEB_TOP_CACHE_TTL seconds, unless the
+    database for its purpose has been modified since it has been
+    computed (see ivre.utils.touch_db_stamp()). When
+    WEB_TOP_CACHE_STALE is set, an expired result is still returned
+    during that many seconds, while a new one is computed in the
+    background. At most WEB_TOP_CACHE_SIZE results are kept; the least
+    recently used are dropped first. The cache is disabled unless
+    DB_STAMPS_PATH is set.
+
+    """
+
+    def __init__(self):
+        # key -> (computation time, stamp, result)
+        self.entries = OrderedDict()
+        self.refreshing = set()
+        self.lock = threading.Lock()
+
+    def _store(self, key, computed, stamp, result):
+        with self.lock:
+            self.entries[key] = (computed, stamp, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > config.WEB_TOP_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def _refresh(self, key, purpose, compute):
+        try:
+            computed = time.time()
+            stamp = utils.get_db_stamp(purpose)
+            self._store(key, computed, stamp, list(compute()))
+        except Exception:
+            utils.LOGGER.warning("Cannot refresh cached result", exc_info=True)
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def get(self, key, purpose, compute):
+        """Return the result (as a list) of compute() for `key`, for
+        a query on the database for `purpose`.
+
+        """
+        if not (config.WEB_TOP_CACHE_SIZE and config.DB_STAMPS_PATH):
+            return list(compute())
+        now = time.time()
+        stamp = utils.get_db_stamp(purpose)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[1] == stamp:
+                    self.entries.move_to_end(key)
+                else:
+                    # the database has been modified
+                    del self.entries[key]
+                    entry = None
+        if entry is not None:
+            age = now - entry[0]
+            if age < config.WEB_TOP_CACHE_TTL:
+                return entry[2]
+            if age < config.WEB_TOP_CACHE_TTL + config.WEB_TOP_CACHE_STALE:
+                with self.lock:
+                    refresh = key not in self.refreshing
+                    self.refreshing.add(key)
+                if refresh:
+                    threading.Thread(
+                        target=self._refresh, args=(key, purpose, compute), daemon=True
+                    ).start()
+                return entry[2]
+        result = list(compute())
+        self._store(key, now, stamp, result)
+        return result
+
+
+RESULTS_CACHE = ResultsCache()
@@ -1746,6 +1746,14 @@ class NmapHandler(ContentHandler):
     def _addhost(self):
         """Subclasses may store self._curhost here."""
 
+    def flush(self):
+        """Subclasses that buffer the host records before storing them
+        must store them here. This is called at the end of the
+        document, and when the parsing fails (e.g., truncated file
+        from an interrupted scan).
+
+        """
+
     def _storescan(self):
         """Subclasses may store self._curscan here."""
 
@@ -2892,6 +2900,10 @@ class Nmap2DB(NmapHandler):
         self._add_addr_infos = add_addr_infos
         self.source = source
         self.callback = callback
+        self._hosts = db.nmap.hosts_writer(
+            callback=self._host_stored,
+            prepare=db.data.add_addr_infos_many if add_addr_infos else None,
+        )
         NmapHandler.__init__(
             self,
             fname,
@@ -2911,13 +2923,8 @@ class Nmap2DB(NmapHandler):
         if self.categories:
             self._curhost["categories"] = self.categories[:]
         if self._add_addr_infos:
+            # set by self._hosts.prepare() (by batches)
             self._curhost["infos"] = {}
-            for func in [
-                self._db.data.country_byip,
-                self._db.data.as_byip,
-                self._db.data.location_byip,
-            ]:
-                self._curhost["infos"].update(func(self._curhost["addr"]) or {})
         if self.source:
             self._curhost["source"] = self.source
         # We are about to insert data based on this file, so we want
@@ -2925,9 +2932,17 @@ class Nmap2DB(NmapHandler):
         if not self.scan_doc_saved:
             self.scan_doc_saved = True
             self._storescan()
-        self._db.nmap.store_or_merge_host(self._curhost)
+        self._hosts.append(self._curhost)
+
+    def _host_stored(self, host):
         if self.callback is not None:
-            self.callback(self._curhost)
+            self.callback(host)
+
+    def flush(self):
+        self._hosts.flush()
+
+    def endDocument(self):
+        self.flush()
 
     def _storescan(self):
         ident = self._db.nmap.store_scan_doc(self._curscan)
@@ -18,14 +18,19 @@
 
 
 from ast import literal_eval
+import atexit
+import bz2
 from contextlib import contextmanager
 from datetime import datetime, timedelta
 from distutils.spawn import find_executable as which
 import errno
-from functools import reduce
+from functools import partial, reduce
 from glob import glob
+import hashlib
 from io import BytesIO
+import ipaddress
 import json
+import multiprocessing
 import os
 import pipes
 import random
@@ -34,26 +39,33 @@ from select import select
 import shutil
 import signal
 import socket
+import stat
+import struct
 import subprocess
 import sys
 import tarfile
 import tempfile
+import threading
 import time
 import unittest
 from urllib.request import HTTPError, Request, urlopen
-from urllib.parse import quote
+from urllib.parse import quote, urlparse
 
 
 import ivre
 import ivre.config
 import ivre.db
 import ivre.flow
+import ivre.geoiputils
 import ivre.mathutils
+import ivre.parser.arp
 import ivre.parser.zeek
 import ivre.parser.iptables
+import ivre.parser.netflow
 import ivre.passive
 import ivre.target
 import ivre.utils
+import ivre.view
 import ivre.web.utils
 import ivre.xmlnmap
 import ivre.analyzer
@@ -137,29 +149,44 @@ def _parse_cli_top_out(out):
     return data[::-1]
 
 
-def run_passiverecon_worker(bulk_mode=None):
+def run_passiverecon_worker(
+    bulk_mode=None, directory="logs", use_progname=True, env=None
+):
+    """Runs ivre passivereconworker on `directory`, with `--progname` (one
+    ivre passiverecon2db process per sensor) when `use_progname` is
+    True, or with its pool of worker processes otherwise. When `env` is
+    not None, it is used as the environment of the worker.
+
+    """
     time.sleep(1)  # Hack for Travis CI
+    if use_progname:
+        args = []
+    else:
+        # --bulk is the default (and is not accepted) here
+        args = [] if bulk_mode == "--bulk" else [bulk_mode]
     pid = os.fork()
     if pid < 0:
         raise Exception("Cannot fork")
     if pid:
-        # Wait for child process to handle every file in "logs"
-        while any(walk[2] for walk in os.walk("logs")):
+        # Wait for child process to handle every file in `directory`
+        # (the files that cannot be handled are moved to "error")
+        while any(
+            os.path.isfile(os.path.join(path, fname))
+            for path in [directory, os.path.join(directory, "current")]
+            if os.path.isdir(path)
+            for fname in os.listdir(path)
+        ):
             print("Waiting for passivereconworker")
             time.sleep(2)
         os.kill(pid, signal.SIGINT)
         os.waitpid(pid, 0)
-    elif USE_COVERAGE:
-        os.execvp(
-            sys.executable,
-            COVERAGE
-            + [
-                "run",
-                "--parallel-mode",
-                which("ivre"),
-                "passivereconworker",
-                "--directory",
-                "logs",
+        return
+    if env is not None:
+        os.environ.clear()
+        os.environ.update(env)
+    if USE_COVERAGE:
+        if use_progname:
+            args = [
                 "--progname",
                 " ".join(
                     pipes.quote(elt)
@@ -172,18 +199,245 @@ def run_passiverecon_worker(bulk_mode=None):
                         bulk_mode,
                     ]
                 ),
-            ],
+            ]
+        os.execvp(
+            sys.executable,
+            COVERAGE
+            + [
+                "run",
+                "--parallel-mode",
+                which("ivre"),
+                "passivereconworker",
+                "--directory",
+                directory,
+            ]
+            + args,
         )
     else:
-        os.execlp(
-            "ivre",
-            "ivre",
-            "passivereconworker",
-            "--directory",
-            "logs",
-            "--progname",
-            "ivre passiverecon2db %s" % bulk_mode,
+        if use_progname:
+            args = ["--progname", "ivre passiverecon2db %s" % bulk_mode]
+        os.execlp("ivre", "ivre", "passivereconworker", "--directory", directory, *args)
+
+
+def _nfcapd_record(
+    map_id,
+    first,
+    last,
+    prot,
+    src,
+    dst,
+    sport,
+    dport,
+    pkts,
+    nbytes,
+    out_pkts,
+    out_bytes,
+    tcp_flags=0,
+    ipv6=False,
+    counters_64=False,
+):
+    """Builds a flow record (type 10) for an nfcapd file, `first` and
+    `last` being timestamps in milliseconds. The extension maps are
+    written by `_nfcapd_file()`.
+
+    """
+    flags = (1 if ipv6 else 0) | (6 if counters_64 else 0)
+    body = struct.pack(
+        "<HHHHIIBBBBHHHBB",
+        flags,
+        map_id,
+        first % 1000,
+        last % 1000,
+        first // 1000,
+        last // 1000,
+        0,
+        tcp_flags,
+        prot,
+        0,
+        sport,
+        dport,
+        0,
+        0,
+        0,
+    )
+    for addr in [src, dst]:
+        if ipv6:
+            addr = int(ipaddress.ip_address(addr))
+            body += struct.pack("<QQ", addr >> 64, addr & 0xFFFFFFFFFFFFFFFF)
+        else:
+            body += socket.inet_aton(addr)[::-1]
+    body += struct.pack("<QQ" if counters_64 else "<II", pkts, nbytes)
+    # map 1: [4, 6, 14, 16] / map 2: [9, 15, 17]
+    if map_id == 1:
+        body += b"\x00" * 8 + struct.pack("<II", out_pkts, out_bytes)
+    else:
+        body += b"\x00" * 4 + struct.pack("<QQ", out_pkts, out_bytes)
+    return struct.pack("<HH", 10, len(body) + 4) + body
+
+
+def _nfcapd_file(fname, blocks, compress=False):
+    """Writes an nfcapd file (nfdump 1.6 "layout version 1"), with
+    `blocks` (lists of records) as data blocks; the first block starts
+    with the extension maps, and a non-data block is added at the
+    end.
+
+    """
+    ext_maps = b""
+    for map_id, ext_ids in [(1, [4, 6, 14, 16]), (2, [9, 15, 17])]:
+        ext_ids = ext_ids + [0] * (2 - len(ext_ids) % 2)
+        ext_maps += struct.pack(
+            "<HHHH%dH" % len(ext_ids), 2, 8 + 2 * len(ext_ids), map_id, 0, *ext_ids
+        )
+    with open(fname, "wb") as fdesc:
+        fdesc.write(
+            struct.pack("<HHII128s", 0xA50C, 1, 8 if compress else 0, len(blocks), b"")
+        )
+        # stat record
+        fdesc.write(b"\x00" * 136)
+        for i, records in enumerate(blocks):
+            data = b"".join(records)
+            count = len(records)
+            if i == 0:
+                data = ext_maps + data
+                count += 2
+            if compress:
+                data = bz2.compress(data)
+            fdesc.write(struct.pack("<IIHH", count, len(data), 2, 0) + data)
+        fdesc.write(struct.pack("<IIHH", 0, 4, 3, 0) + b"abcd")
+
+
+def _arp_payload(op, mac_src, ip_src, mac_dst, ip_dst, ptype=0x0800):
+    """Builds an ARP packet (IPv4 over Ethernet, unless `ptype` is
+    set).
+
+    """
+    return struct.pack(
+        ">HHBBH6s4s6s4s",
+        1,
+        ptype,
+        6,
+        4,
+        op,
+        bytes.fromhex(mac_src.replace(":", "")),
+        socket.inet_aton(ip_src),
+        bytes.fromhex(mac_dst.replace(":", "")),
+        socket.inet_aton(ip_dst),
+    )
+
+
+def _arp_frame(linktype, payload, ethertype=0x0806, vlans=()):
+    """Builds a frame for `linktype` (1: Ethernet, with the `vlans` tags,
+    113: Linux cooked capture, 276: Linux cooked capture v2).
+
+    """
+    mac = b"\x02\x00\x00\x00\x00\x01"
+    if linktype == 1:
+        return (
+            b"\xff" * 6
+            + mac
+            + b"".join(struct.pack(">HH", tpid, 42) for tpid in vlans)
+            + struct.pack(">H", ethertype)
+            + payload
+        )
+    if linktype == 113:
+        return struct.pack(">HHH8sH", 0, 1, 6, mac, ethertype) + payload
+    return struct.pack(">HHIHBB8s", ethertype, 0, 1, 1, 0, 6, mac) + payload
+
+
+def _pcap_file(fname, linktype, frames, endian="<", nano=False):
+    """Writes a PCAP file with `frames`, a list of (timestamp in
+    nanoseconds, frame) tuples.
+
+    """
+    with open(fname, "wb") as fdesc:
+        fdesc.write(
+            struct.pack(
+                endian + "IHHiIII",
+                0xA1B23C4D if nano else 0xA1B2C3D4,
+                2,
+                4,
+                0,
+                0,
+                65535,
+                linktype,
+            )
+        )
+        for nsecs, frame in frames:
+            sec, frac = divmod(nsecs, 1000000000)
+            if not nano:
+                frac //= 1000
+            fdesc.write(
+                struct.pack(endian + "IIII", sec, frac, len(frame), len(frame)) + frame
+            )
+
+
+def _pcapng_block(endian, btype, body):
+    body += b"\x00" * (-len(body) % 4)
+    return (
+        struct.pack(endian + "II", btype, len(body) + 12)
+        + body
+        + struct.pack(endian + "I", len(body) + 12)
+    )
+
+
+def _pcapng_file(fname, linktype, frames, endian="<", nano=False):
+    """Writes a PCAP-NG file with `frames`, a list of (timestamp in
+    nanoseconds, frame) tuples, using enhanced packet blocks.
+
+    """
+    with open(fname, "wb") as fdesc:
+        fdesc.write(
+            _pcapng_block(
+                endian, 0x0A0D0D0A, struct.pack(endian + "IHHq", 0x1A2B3C4D, 1, 0, -1)
+            )
+        )
+        # if_tsresol option for nanosecond timestamps
+        options = struct.pack(endian + "HHB3x", 9, 1, 9) if nano else b""
+        fdesc.write(
+            _pcapng_block(
+                endian,
+                1,
+                struct.pack(endian + "HHI", linktype, 0, 65535)
+                + options
+                + struct.pack(endian + "HH", 0, 0),
+            )
         )
+        for nsecs, frame in frames:
+            tstamp = nsecs if nano else nsecs // 1000
+            fdesc.write(
+                _pcapng_block(
+                    endian,
+                    6,
+                    struct.pack(
+                        endian + "IIIII",
+                        0,
+                        tstamp >> 32,
+                        tstamp & 0xFFFFFFFF,
+                        len(frame),
+                        len(frame),
+                    )
+                    + frame,
+                )
+            )
+
+
+def _tinydb_log_writer(path, worker, count):
+    """Inserts `count` documents in the TinyDB log `path` and, after each
+    insertion, updates the documents already inserted, which triggers
+    compactions (used by test_tinydb, in several processes).
+
+    """
+    import ivre.db.tiny
+    from tinydb import Query, TinyDB
+    from tinydb.operations import increment
+
+    ivre.db.tiny.LogStorage.compact_min = 20
+    tdb = TinyDB(path, storage=ivre.db.tiny.LogStorage)
+    tdb.table_class = ivre.db.tiny.LogTable
+    for i in range(count):
+        tdb.insert({"worker": worker, "i": i, "updates": 0})
+        tdb.update(increment("updates"), Query().worker == worker)
+    tdb.close()
 
 
 class AgentScanner:
@@ -318,6 +572,9 @@ class IvreTests(unittest.TestCase):
 
     def tearDown(self):
         ivre.utils.cleandir("logs")
+        ivre.utils.cleandir("logs_pool")
+        ivre.utils.cleandir("logs_copy")
+        ivre.utils.cleandir("logs_pool_copy")
         ivre.utils.cleandir(".state")
         if self.new_results:
             with open(os.path.join(SAMPLES, "results"), "a") as fdesc:
@@ -540,6 +797,52 @@ class IvreTests(unittest.TestCase):
                 webroute="view",
             )
 
+    def start_rollups(self, database):
+        """Enables the roll-ups (disabled by default) until the end of
+        the current test, and builds them from the records.
+
+        """
+        if DATABASE != "mongo":
+            return
+        self.addCleanup(
+            setattr, ivre.config, "MONGODB_ROLLUPS", ivre.config.MONGODB_ROLLUPS
+        )
+        ivre.config.MONGODB_ROLLUPS = True
+        database.rebuild_rollups()
+
+    def check_rollups(self, database):
+        """Checks that the top values read from the roll-ups match the
+        results of the aggregation pipelines (a non-None `aggrflt`
+        prevents the use of the roll-ups) and that the roll-ups are
+        consistent with the records.
+
+        """
+        if DATABASE != "mongo":
+            return
+        self.assertTrue(database._rollups_enabled)
+        flts = [database.flt_empty] + [
+            database.searchcategory(cat["_id"])
+            for cat in database.topvalues("category", topnbr=None)
+        ]
+        fields = sorted(database.rollup_fields) + [
+            "script:%s" % scriptid["_id"]
+            for scriptid in database.topvalues("ports.scripts.id", topnbr=None)
+        ]
+        for field in fields:
+            for flt in flts:
+                self.assertCountEqual(
+                    list(database.topvalues(field, flt=flt, topnbr=None)),
+                    list(
+                        database.topvalues(
+                            field,
+                            flt=flt,
+                            topnbr=None,
+                            aggrflt={"field": {"$exists": True}},
+                        )
+                    ),
+                )
+        self.assertEqual(database.rebuild_rollups(), 0)
+
     def check_count_value_api(self, name_or_value, flt, database=None, **kwargs):
         count = database.count(flt)
         if name_or_value is not None:
@@ -732,7 +1035,7 @@ class IvreTests(unittest.TestCase):
 
     @classmethod
     def setUpClass(cls):
-        cls.nmap_files = (
+        cls.nmap_files = [
             os.path.join(root, fname)
             for root, _, files in os.walk(SAMPLES)
             for fname in files
@@ -740,7 +1043,7 @@ class IvreTests(unittest.TestCase):
             or fname.endswith(".json")
             or fname.endswith(".xml.bz2")
             or fname.endswith(".json.bz2")
-        )
+        ]
         cls.pcap_files = [
             os.path.join(root, fname)
             for root, _, files in os.walk(SAMPLES)
@@ -783,6 +1086,67 @@ class IvreTests(unittest.TestCase):
         # Init DB
         self.init_nmap_db()
 
+        # Parallel insertion (--jobs): the results must be the same
+        def nmap_records():
+            res, out, _ = RUN(["ivre", "scancli", "--json"])
+            self.assertEqual(res, 0)
+            records = []
+            for line in out.splitlines():
+                rec = json.loads(line)
+                rec.pop("_id", None)
+                records.append(json.dumps(rec, sort_keys=True))
+            return sorted(records)
+
+        parallel_files = [fname for fname in self.nmap_files if "-probe-" not in fname]
+        # ... and with small batches of hosts (HostsWriter &
+        # .store_hosts())
+        with tempfile.NamedTemporaryFile(delete=False) as fdesc:
+            batchenv = os.environ.copy()
+            if "IVRE_CONF" in batchenv:
+                fdesc.writelines(open(batchenv["IVRE_CONF"], "rb"))
+            fdesc.write(b"\nHOSTS_BATCH_SIZE = 3\n")
+        batchenv["IVRE_CONF"] = fdesc.name
+        parallel_results = {}
+        for name, jobs, env in [
+            ("2", "2", None),
+            ("1", "1", None),
+            ("3", "1", batchenv),
+        ]:
+            res, _, err = RUN(
+                ["ivre", "scan2db", "--port", "-c", "TEST", "-s", "SOURCE", "-j", jobs]
+                + ["--"]
+                + parallel_files,
+                env=env,
+            )
+            if res:
+                print("Error: %r" % err)
+            self.assertEqual(res, 0)
+            parallel_results[name] = nmap_records()
+            if DATABASE == "mongo" and name == "1":
+                # The hosts that cannot be inserted (here, because of
+                # a duplicate _id) are skipped, the others are stored
+                hosts = list(ivre.db.db.nmap.get(ivre.db.db.nmap.flt_empty, limit=4))
+                self.assertEqual(len(hosts), 4)
+                new_hosts = [
+                    {key: value for key, value in host.items() if key != "_id"}
+                    for host in hosts[:2]
+                ]
+                ivre.db.db.nmap.store_hosts(
+                    [hosts[0], new_hosts[0], hosts[1], hosts[2], new_hosts[1], hosts[3]]
+                )
+                self.assertEqual(
+                    ivre.db.db.nmap.count(ivre.db.db.nmap.flt_empty),
+                    len(parallel_results["1"]) + 2,
+                )
+            self.assertEqual(
+                RUN(["ivre", "scancli", "--init"], stdin=open(os.devnull))[0], 0
+            )
+        os.unlink(fdesc.name)
+        self.assertTrue(parallel_results["1"])
+        self.assertEqual(parallel_results["1"], parallel_results["2"])
+        self.assertEqual(parallel_results["1"], parallel_results["3"])
+        self.assertEqual(RUN(["ivre", "scancli", "--count"])[1], b"0\n")
+
         # Insertion / "test" insertion (JSON output)
         host_counter = 0
         scan_counter = 0
@@ -1866,7 +2230,11 @@ class IvreTests(unittest.TestCase):
         os.unlink(fdesc.name)
         # END Using the HTTP server as a database
 
+        self.start_rollups(ivre.db.db.nmap)
+        self.check_rollups(ivre.db.db.nmap)
+
     def test_53_nmap_delete(self):
+        self.start_rollups(ivre.db.db.nmap)
         # Remove
         addr = next(
             iter(ivre.db.db.nmap.get(ivre.db.db.nmap.flt_empty, sort=[("addr", -1)]))
@@ -1881,6 +2249,7 @@ class IvreTests(unittest.TestCase):
         ivre.db.db.nmap.remove_many(ivre.db.db.nmap.searchhost(addr))
         count = ivre.db.db.nmap.count(ivre.db.db.nmap.searchhost(addr))
         self.assertEqual(count, 0)
+        self.check_rollups(ivre.db.db.nmap)
 
     def test_40_passive(self):
 
@@ -1926,8 +2295,67 @@ class IvreTests(unittest.TestCase):
             )
             zeekprocess.wait()
 
+        shutil.copytree("logs", "logs_pool")
+        if DATABASE == "postgres":
+            shutil.copytree("logs", "logs_copy")
         run_passiverecon_worker(bulk_mode=bulk_mode)
 
+        # Same records with the pool of worker processes (the default
+        # mode) as with --progname
+        def passive_records():
+            return sorted(
+                json.dumps(
+                    {key: value for key, value in rec.items() if key != "_id"},
+                    default=ivre.utils.serialize,
+                    sort_keys=True,
+                )
+                for rec in ivre.db.db.passive.get(ivre.db.db.passive.flt_empty)
+            )
+
+        records = passive_records()
+        self.assertTrue(records)
+        self.assertEqual(
+            RUN(["ivre", "ipinfo", "--init"], stdin=open(os.devnull))[0], 0
+        )
+        run_passiverecon_worker(
+            bulk_mode=bulk_mode, directory="logs_pool", use_progname=False
+        )
+        self.assertFalse(os.listdir(os.path.join("logs_pool", "error")))
+        self.assertEqual(passive_records(), records)
+
+        if DATABASE == "postgres":
+            # Same records with the binary COPY format (used in --bulk
+            # mode when POSTGRES_BINARY_COPY is True) as with the text
+            # format
+            with tempfile.NamedTemporaryFile(delete=False) as fdesc:
+                binaryenv = os.environ.copy()
+                if "IVRE_CONF" in binaryenv:
+                    fdesc.writelines(open(binaryenv["IVRE_CONF"], "rb"))
+                fdesc.write(b"\nPOSTGRES_BINARY_COPY = True\n")
+            binaryenv["IVRE_CONF"] = fdesc.name
+            copy_records = []
+            for env in [None, binaryenv]:
+                if env is None and bulk_mode == "--bulk":
+                    copy_records.append(records)
+                    continue
+                self.assertEqual(
+                    RUN(["ivre", "ipinfo", "--init"], stdin=open(os.devnull))[0], 0
+                )
+                shutil.copytree("logs_copy", "logs_pool_copy")
+                run_passiverecon_worker(
+                    bulk_mode="--bulk",
+                    directory="logs_pool_copy",
+                    use_progname=False,
+                    env=env,
+                )
+                self.assertFalse(os.listdir(os.path.join("logs_pool_copy", "error")))
+                ivre.utils.cleandir("logs_pool_copy")
+                copy_records.append(passive_records())
+            os.unlink(fdesc.name)
+            ivre.utils.cleandir("logs_copy")
+            self.assertTrue(copy_records[1])
+            self.assertEqual(copy_records[1], copy_records[0])
+
         # Counting
         total_count = ivre.db.db.passive.count(ivre.db.db.passive.flt_empty)
         self.assertGreater(total_count, 0)
@@ -2824,6 +3252,104 @@ class IvreTests(unittest.TestCase):
             next(iter(ivre.db.db.passive.get(flt)))["count"],
         )
 
+        if DATABASE == "mongo":
+            # Identical specs are merged in memory, by batches of
+            # MONGODB_BATCH_SIZE specs, in bulk inserts
+            self.addCleanup(
+                setattr,
+                ivre.config,
+                "MONGODB_BATCH_SIZE",
+                ivre.config.MONGODB_BATCH_SIZE,
+            )
+            bulk_flt = ivre.db.db.passive.searchsensor("TEST_BULK")
+            base = datetime(2020, 1, 1)
+
+            def bulk_specs():
+                for i in range(10):
+                    yield base + timedelta(days=(3 * i) % 10), {
+                        "addr": "198.51.100.%d" % (i % 2 + 1),
+                        "sensor": "TEST_BULK",
+                        "recontype": "TEST_BULK",
+                        "source": "test",
+                        "value": "test",
+                        "count": i + 1,
+                    }
+
+            expected = {}
+            for timestamp, spec in bulk_specs():
+                cur = expected.setdefault(
+                    spec["addr"],
+                    {"count": 0, "firstseen": timestamp, "lastseen": timestamp},
+                )
+                cur["count"] += spec["count"]
+                cur["firstseen"] = min(cur["firstseen"], timestamp)
+                cur["lastseen"] = max(cur["lastseen"], timestamp)
+                cur["lastcount"] = spec["count"]
+
+            def bulk_results():
+                return {
+                    rec["addr"]: {
+                        "count": rec["count"],
+                        "firstseen": rec["firstseen"],
+                        "lastseen": rec["lastseen"],
+                    }
+                    for rec in ivre.db.db.passive.get(bulk_flt)
+                }
+
+            for batch_size in [3, 1000]:
+                ivre.config.MONGODB_BATCH_SIZE = batch_size
+                ivre.db.db.passive.insert_or_update_bulk(bulk_specs())
+                self.assertEqual(
+                    bulk_results(),
+                    {
+                        addr: {
+                            "count": values["count"],
+                            "firstseen": values["firstseen"],
+                            "lastseen": values["lastseen"],
+                        }
+                        for addr, values in expected.items()
+                    },
+                )
+                ivre.db.db.passive.insert_or_update_bulk(
+                    bulk_specs(), replacecount=True
+                )
+                self.assertEqual(
+                    bulk_results(),
+                    {
+                        addr: {
+                            "count": values["lastcount"],
+                            "firstseen": values["firstseen"],
+                            "lastseen": values["lastseen"],
+                        }
+                        for addr, values in expected.items()
+                    },
+                )
+                # separated_timestamps=False
+                ivre.db.db.passive.insert_or_update_bulk(
+                    (
+                        dict(
+                            spec,
+                            firstseen=timestamp - timedelta(days=1),
+                            lastseen=timestamp + timedelta(days=1),
+                        )
+                        for timestamp, spec in bulk_specs()
+                    ),
+                    separated_timestamps=False,
+                )
+                self.assertEqual(
+                    bulk_results(),
+                    {
+                        addr: {
+                            "count": values["lastcount"] + values["count"],
+                            "firstseen": values["firstseen"] - timedelta(days=1),
+                            "lastseen": values["lastseen"] + timedelta(days=1),
+                        }
+                        for addr, values in expected.items()
+                    },
+                )
+                ivre.db.db.passive.remove(bulk_flt)
+                self.assertEqual(ivre.db.db.passive.count(bulk_flt), 0)
+
         # Test DNSBL
 
         count = ivre.db.db.passive.count(
@@ -3104,6 +3630,126 @@ class IvreTests(unittest.TestCase):
             )
             self.assertEqual(new_timeslot, test_timeslot["expected"])
 
+        # Aggregated flow updates: the results must be the same as
+        # with a plain bulk
+        if DATABASE == "mongo":
+            from ivre.db.mongo import MongoDBFlowBulk
+
+            def flow_key(dst, dport):
+                return {
+                    "src_addr_0": 0,
+                    "src_addr_1": 1,
+                    "dst_addr_0": 0,
+                    "dst_addr_1": dst,
+                    "proto": "tcp",
+                    "dport": dport,
+                    "schema_version": ivre.flow.SCHEMA_VERSION,
+                }
+
+            times = [datetime(2021, 1, 1, i) for i in range(4)]
+            flow_updates = [
+                (
+                    flow_key(2, 80),
+                    {
+                        "$min": {"firstseen": times[1]},
+                        "$max": {"lastseen": times[2]},
+                        "$inc": {"count": 1, "cspkts": 3},
+                        "$addToSet": {"sports": 1000},
+                    },
+                ),
+                (
+                    flow_key(2, 80),
+                    {
+                        "$min": {"firstseen": None},
+                        "$max": {"lastseen": None},
+                        "$inc": {"count": 1, "cspkts": 2},
+                        "$addToSet": {"sports": {"$each": [1000, 1001]}},
+                    },
+                ),
+                # rejected: non-numeric "$inc" value
+                (
+                    flow_key(2, 80),
+                    {
+                        "$min": {"firstseen": times[0]},
+                        "$max": {"lastseen": times[3]},
+                        "$inc": {"count": 1, "cspkts": None},
+                    },
+                ),
+                (
+                    flow_key(3, 443),
+                    {
+                        "$min": {"firstseen": None},
+                        "$max": {"lastseen": None},
+                        "$inc": {"count": 1},
+                    },
+                ),
+                (
+                    flow_key(3, 443),
+                    {
+                        "$min": {"firstseen": times[1]},
+                        "$max": {"lastseen": times[2]},
+                        "$inc": {"count": 1, "meta.http.count": 1},
+                        "$addToSet": {
+                            "meta.http.host": {"$each": ["a.example", "a.example"]}
+                        },
+                    },
+                ),
+                (
+                    flow_key(4, 22),
+                    {"$min": {"firstseen": times[0]}, "$inc": {"count": None}},
+                ),
+                (
+                    flow_key(5, 53),
+                    {
+                        "$min": {"firstseen": times[1]},
+                        "$max": {"lastseen": times[2]},
+                        "$inc": {"count": 1},
+                    },
+                ),
+                (
+                    flow_key(5, 53),
+                    {
+                        "$min": {"firstseen": times[0]},
+                        "$max": {"lastseen": times[1]},
+                        "$inc": {"count": 1},
+                    },
+                ),
+            ]
+            flow_results = {}
+            for name in ["aggregated", "plain"]:
+                collection = ivre.db.db.flow.db["test_flows_%s" % name]
+                collection.drop()
+                self.addCleanup(collection.drop)
+                if name == "aggregated":
+                    bulk = MongoDBFlowBulk(collection)
+                    for findspec, updatespec in flow_updates:
+                        bulk.add(findspec, updatespec)
+                    bulk.execute()
+                else:
+                    bulk = collection.initialize_unordered_bulk_op()
+                    for findspec, updatespec in flow_updates:
+                        bulk.find(findspec).upsert().update(updatespec)
+                    try:
+                        bulk.execute()
+                    except Exception:
+                        # the update with a non-numeric "$inc" value
+                        pass
+                flow_results[name] = {
+                    rec["dst_addr_1"]: rec
+                    for rec in collection.find(projection={"_id": False})
+                }
+            self.assertEqual(flow_results["aggregated"], flow_results["plain"])
+            self.assertEqual(sorted(flow_results["plain"]), [2, 3, 5])
+            rec = flow_results["plain"][2]
+            self.assertIsNone(rec["firstseen"])
+            self.assertEqual(rec["lastseen"], times[2])
+            self.assertEqual(rec["count"], 2)
+            self.assertEqual(rec["cspkts"], 5)
+            self.assertEqual(rec["sports"], [1000, 1001])
+            rec = flow_results["plain"][5]
+            self.assertEqual(rec["firstseen"], times[0])
+            self.assertEqual(rec["lastseen"], times[2])
+
         #  Functional tests #
 
         # Init DB
@@ -3575,6 +4221,44 @@ class IvreTests(unittest.TestCase):
         self.assertFalse(out)
         self.check_flow_count_value("flow_count_cleanup", {}, [], None)
 
+        # The cleanup restricted to the flows imported (zeek2db) and
+        # the full cleanup (flowcli --cleanup) must give the same flows
+        def flow_records():
+            if DATABASE == "tinydb":
+                ivre.db.db.flow.invalidate_cache()
+            records = []
+            for rec in ivre.db.db.flow.get(ivre.db.db.flow.flt_empty):
+                rec.pop("_id", None)
+                for field in ["codes", "sports", "times"]:
+                    if field in rec:
+                        rec[field] = sorted(
+                            rec[field],
+                            key=partial(json.dumps, default=ivre.utils.serialize),
+                        )
+                records.append(
+                    json.dumps(rec, sort_keys=True, default=ivre.utils.serialize)
+                )
+            return sorted(records)
+
+        cleanup_restricted = flow_records()
+        res, out, err = RUN(["ivre", "flowcli", "--init"], stdin=open(os.devnull))
+        self.assertEqual(res, 0)
+        self.assertFalse(err)
+        res, out, err = RUN(
+            [
+                "ivre",
+                "zeek2db",
+                "--no-cleanup",
+                os.path.join(os.getcwd(), "samples", "mongo_conn.log"),
+            ]
+        )
+        self.assertEqual(res, 0)
+        self.assertFalse(out)
+        res, out, err = RUN(["ivre", "flowcli", "--cleanup"])
+        self.assertEqual(res, 0)
+        self.assertFalse(out)
+        self.assertEqual(flow_records(), cleanup_restricted)
+
         # Test netflow capture insertion
         res, out, err = RUN(["ivre", "flowcli", "--init"], stdin=open(os.devnull))
         self.assertEqual(res, 0)
@@ -3783,11 +4467,62 @@ class IvreTests(unittest.TestCase):
                 json.loads(udesc.read().decode()),
             )
 
+        # Batch lookups vs one address at a time
+        addrs = [
+            "8.8.8.8",
+            "8.8.4.4",
+            "8.8.8.8",
+            "8.8.8.9",
+            "1.1.1.1",
+            "10.0.0.1",
+            "0.0.0.0",
+            "255.255.255.255",
+            "2003::1",
+            "2001:db8::1",
+            "::",
+            "::ffff:8.8.8.8",
+            0x08080808,
+            0x20030000000000000000000000000001,
+        ]
+        for _ in range(1000):
+            addr = random.getrandbits(32)
+            # the neighbours are likely to be in the same network
+            addrs.extend([addr, addr ^ 1, addr ^ 0x100, ivre.utils.int2ip(addr)])
+        for _ in range(100):
+            addrs.append(random.getrandbits(128))
+        random.shuffle(addrs)
+        for subdb in [
+            ivre.db.db.data.db_asn,
+            ivre.db.db.data.db_city,
+            ivre.db.db.data.db_country,
+        ]:
+            results = subdb.lookup_many(addrs)
+            self.assertEqual(len(results), len(addrs))
+            for addr, result in zip(addrs, results):
+                self.assertEqual(result, subdb.lookup(addr), addr)
+            self.assertEqual(
+                subdb.lookup_many(iter(addrs[:10])),
+                [subdb.lookup(addr) for addr in addrs[:10]],
+            )
+            self.assertEqual(subdb.lookup_many([]), [])
+        addrs = [ivre.utils.force_int2ip(addr) for addr in addrs]
+        results = ivre.db.db.data.infos_byip_many(addrs)
+        self.assertEqual(len(results), len(addrs))
+        for addr, result in zip(addrs, results):
+            self.assertEqual(result, ivre.db.db.data.infos_byip(addr), addr)
+
         # targets manipulation
         targ1 = ivre.target.TargetCountry("PN")
         targ2 = ivre.target.TargetCountry("BV")
         self.assertCountEqual(set(targ1).union(targ2), set(targ1 + targ2))
         count_t1_t2 = len(targ1 + targ2)
+        ranges = (targ1 + targ2).targets
+        self.assertEqual(
+            [ivre.utils.int2ip(ranges[i]) for i in range(len(ranges))],
+            list(ranges.iter_addrs()),
+        )
+        with self.assertRaises(IndexError):
+            ranges[len(ranges)]
 
         res, out1, err = RUN(
             ["ivre", "runscans", "--output", "Count", "--country", "UK"]
@@ -4128,6 +4863,131 @@ class IvreTests(unittest.TestCase):
                         i + 1,
                     )
 
+        # Zeek logs, TSV and JSON formats
+        zeek_tsv = b"\n".join(
+            [
+                b"#separator \\x09",
+                b"#set_separator\t,",
+                b"#empty_field\t(empty)",
+                b"#unset_field\t-",
+                b"#path\tx509",
+                b"#open\t2020-09-13-12-26-40",
+                b"#fields\tts\tid\tcertificate.version\tcertificate.serial\t"
+                b"certificate.not_valid_before\tcertificate.not_valid_after\t"
+                b"san.dns\tbasic_constraints.ca\tbasic_constraints.path_len",
+                b"#types\ttime\tstring\tcount\tstring\ttime\ttime\tvector[string]\t"
+                b"bool\tcount",
+                b"1600000000.123\tFbcRJI2R7Yt0sXLJM\t3\t0A\t1590000000.000\t"
+                b"1610000000.500\twww.example.com,example.com\tF\t-",
+                b"1600000001.456\tFJ6N0k3nSBEmHVXMbf\t3\t0B\t1590000000.000\t"
+                b"1610000000.000\t(empty)\tT\t0",
+                b"1600000002.789\tFo9lm82gXyrVV1UNmk\t-\t-\t-\t-\t-\t-\t-",
+                b"#close\t2020-09-13-12-26-41",
+                b"",
+            ]
+        )
+
+        def zeek_json(fmt_time):
+            return b"".join(
+                json.dumps(rec).encode() + b"\n"
+                for rec in [
+                    {
+                        "_path": "x509",
+                        "_write_ts": fmt_time(1600000000.123),
+                        "ts": fmt_time(1600000000.123),
+                        "id": "FbcRJI2R7Yt0sXLJM",
+                        "certificate.version": 3,
+                        "certificate.serial": "0A",
+                        "certificate.not_valid_before": fmt_time(1590000000),
+                        "certificate.not_valid_after": fmt_time(1610000000.5),
+                        "san.dns": ["www.example.com", "example.com"],
+                        "basic_constraints.ca": False,
+                    },
+                    {
+                        "_path": "x509",
+                        "_write_ts": fmt_time(1600000001.456),
+                        "ts": fmt_time(1600000001.456),
+                        "id": "FJ6N0k3nSBEmHVXMbf",
+                        "certificate.version": 3,
+                        "certificate.serial": "0B",
+                        "certificate.not_valid_before": fmt_time(1590000000),
+                        "certificate.not_valid_after": fmt_time(1610000000),
+                        "san.dns": [],
+                        "basic_constraints.ca": True,
+                        "basic_constraints.path_len": 0,
+                    },
+                    {
+                        "_path": "x509",
+                        "_write_ts": fmt_time(1600000002.789),
+                        "ts": fmt_time(1600000002.789),
+                        "id": "Fo9lm82gXyrVV1UNmk",
+                    },
+                ]
+            )
+
+        def zeek_read_all(data, method):
+            zeekfd = ivre.parser.zeek.ZeekFile(BytesIO(data))
+            if method == "iter":
+                records = list(zeekfd)
+            elif method == "read_records":
+                records = []
+                while True:
+                    chunk = zeekfd.read_records(2)
+                    if not chunk:
+                        break
+                    records.extend(chunk)
+            else:
+                records = []
+                while True:
+                    columns = zeekfd.read_columns(2)
+                    if not columns:
+                        break
+                    nbr = len(next(iter(columns.values())))
+                    records.extend(
+                        {key: values[i] for key, values in columns.items()}
+                        for i in range(nbr)
+                    )
+            return zeekfd.path, records
+
+        zeek_path, zeek_records = zeek_read_all(zeek_tsv, "iter")
+        self.assertEqual(zeek_path, "x509")
+        self.assertEqual(len(zeek_records), 3)
+        self.assertEqual(
+            zeek_records[0],
+            {
+                "ts": datetime.fromtimestamp(1600000000.123),
+                "id": "FbcRJI2R7Yt0sXLJM",
+                "certificate_version": 3,
+                "certificate_serial": "0A",
+                "certificate_not_valid_before": datetime.fromtimestamp(1590000000),
+                "certificate_not_valid_after": datetime.fromtimestamp(1610000000.5),
+                "san_dns": ["www.example.com", "example.com"],
+                "basic_constraints_ca": False,
+                "basic_constraints_path_len": None,
+            },
+        )
+        self.assertEqual(zeek_records[1]["san_dns"], [])
+        self.assertEqual(
+            set(value for value in zeek_records[2].values() if value is not None),
+            {datetime.fromtimestamp(1600000002.789), "Fo9lm82gXyrVV1UNmk"},
+        )
+        for data in [
+            zeek_tsv,
+            # LogAscii::json_timestamps = JSON::TS_EPOCH (default)
+            zeek_json(lambda tstamp: tstamp),
+            # LogAscii::json_timestamps = JSON::TS_MILLIS
+            zeek_json(lambda tstamp: int(round(tstamp * 1000))),
+            # LogAscii::json_timestamps = JSON::TS_ISO8601
+            zeek_json(
+                lambda tstamp: time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(tstamp))
+                + ".%03dZ" % round(tstamp % 1 * 1000)
+            ),
+        ]:
+            for method in ["iter", "read_records", "read_columns"]:
+                self.assertEqual(
+                    zeek_read_all(data, method), ("x509", zeek_records), method
+                )
+
         # Iptables
         with ivre.parser.iptables.Iptables(
             os.path.join(SAMPLES, "iptables.log")
@@ -4141,6 +5001,277 @@ class IvreTests(unittest.TestCase):
 
             self.assertEqual(count, 40)
 
+        # NetFlow (nfcapd files, read without nfdump)
+        def nf_time(msecs):
+            return datetime.fromtimestamp(msecs // 1000) + timedelta(
+                milliseconds=msecs % 1000
+            )
+
+        base = 1600000000000
+        nf_blocks = [
+            [
+                _nfcapd_record(
+                    1,
+                    base + 100,
+                    base + 10200,
+                    6,
+                    "10.0.0.1",
+                    "192.168.0.1",
+                    1025,
+                    80,
+                    10,
+                    1000,
+                    8,
+                    800,
+                    tcp_flags=0x12,
+                ),
+                _nfcapd_record(
+                    2,
+                    base + 1000,
+                    base + 1500,
+                    17,
+                    "10.0.0.2",
+                    "10.0.0.3",
+                    53,
+                    40000,
+                    1 << 33,
+                    1 << 40,
+                    1,
+                    100,
+                    counters_64=True,
+                ),
+                _nfcapd_record(
+                    2,
+                    base + 2000,
+                    base + 2000,
+                    1,
+                    "10.0.0.4",
+                    "10.0.0.5",
+                    0,
+                    0x0800,
+                    3,
+                    252,
+                    2,
+                    168,
+                ),
+            ],
+            [
+                # same flow as the first record, in another block
+                _nfcapd_record(
+                    1,
+                    base + 5000,
+                    base + 20999,
+                    6,
+                    "10.0.0.1",
+                    "192.168.0.1",
+                    1025,
+                    80,
+                    5,
+                    500,
+                    4,
+                    400,
+                    tcp_flags=0x01,
+                ),
+                _nfcapd_record(
+                    1,
+                    base + 3000,
+                    base + 4000,
+                    6,
+                    "2001:db8::1",
+                    "2001:db8::2",
+                    50000,
+                    443,
+                    9,
+                    900,
+                    7,
+                    700,
+                    tcp_flags=0x18,
+                    ipv6=True,
+                ),
+            ],
+        ]
+        nf_expected = [
+            {
+                "start_time": nf_time(base + 100),
+                "end_time": nf_time(base + 20999),
+                "proto": "tcp",
+                "src": "10.0.0.1",
+                "dst": "192.168.0.1",
+                "sport": 1025,
+                "dport": 80,
+                "flow_name": "tcp 80",
+                "flags": ".A..SF",
+                "scpkts": 12,
+                "scbytes": 1200,
+                "cspkts": 15,
+                "csbytes": 1500,
+            },
+            {
+                "start_time": nf_time(base + 1000),
+                "end_time": nf_time(base + 1500),
+                "proto": "udp",
+                "src": "10.0.0.3",
+                "dst": "10.0.0.2",
+                "sport": 40000,
+                "dport": 53,
+                "flow_name": "udp 53",
+                "flags": "......",
+                "scpkts": 1 << 33,
+                "scbytes": 1 << 40,
+                "cspkts": 1,
+                "csbytes": 100,
+            },
+            {
+                "start_time": nf_time(base + 2000),
+                "end_time": nf_time(base + 2000),
+                "proto": "icmp",
+                "src": "10.0.0.4",
+                "dst": "10.0.0.5",
+                "type": 8,
+                "code": 0,
+                "flow_name": "icmp 8",
+                "flags": "......",
+                "scpkts": 2,
+                "scbytes": 168,
+                "cspkts": 3,
+                "csbytes": 252,
+            },
+            {
+                "start_time": nf_time(base + 3000),
+                "end_time": nf_time(base + 4000),
+                "proto": "tcp",
+                "src": "2001:db8::1",
+                "dst": "2001:db8::2",
+                "sport": 50000,
+                "dport": 443,
+                "flow_name": "tcp 443",
+                "flags": ".AP...",
+                "scpkts": 7,
+                "scbytes": 700,
+                "cspkts": 9,
+                "csbytes": 900,
+            },
+        ]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for compress in [False, True]:
+                fname = os.path.join(tmpdir, "nfcapd.%d" % compress)
+                _nfcapd_file(fname, nf_blocks, compress=compress)
+                nf_parser = ivre.parser.netflow.netflow_parser(fname)
+                self.assertIsInstance(nf_parser, ivre.parser.netflow.NfcapdFile)
+                with nf_parser:
+                    self.assertCountEqual(list(nf_parser), nf_expected)
+        # Same flows, as displayed by nfdump -a
+        nf_lines = [
+            (base + 100, base + 20999, "TCP", "10.0.0.1", "192.168.0.1", 1025, 80)
+            + (12, 15, 1200, 1500, ".A..SF"),
+            (base + 1000, base + 1500, "UDP", "10.0.0.2", "10.0.0.3", 53, 40000)
+            + (1, 1 << 33, 100, 1 << 40, "......"),
+            (base + 2000, base + 2000, "ICMP", "10.0.0.4", "10.0.0.5", 0, "8.0")
+            + (2, 3, 168, 252, "......"),
+            (base + 3000, base + 4000, "TCP", "2001:db8::1", "2001:db8::2", 50000)
+            + (443, 7, 9, 700, 900, ".AP..."),
+        ]
+        self.assertCountEqual(
+            [
+                ivre.parser.netflow.NetFlow.parse_line(
+                    ", ".join(
+                        [
+                            nf_time(line[0]).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+                            nf_time(line[1]).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+                        ]
+                        + [str(value) for value in line[2:]]
+                    ).encode()
+                )
+                for line in nf_lines
+            ],
+            nf_expected,
+        )
+
+        # ARP (PCAP & PCAP-NG files, read without Scapy)
+        def arp_time(nsecs, nano):
+            # nanosecond timestamps are rounded to the microsecond
+            usecs = (nsecs + 500) // 1000 if nano else nsecs // 1000
+            return datetime.fromtimestamp(usecs // 1000000).replace(
+                microsecond=usecs % 1000000
+            )
+
+        base = 1600000000 * 1000000000
+        arp_packets = [
+            # (timestamp in nanoseconds, VLAN tags, ARP packet, op)
+            (
+                base + 1000400,
+                (),
+                (1, "02:00:00:00:00:01", "10.0.0.1", "00:00:00:00:00:00", "10.0.0.2"),
+                "WHO_HAS",
+            ),
+            (
+                base + 2999999600,
+                (0x8100,),
+                (2, "02:00:00:00:00:02", "10.0.0.2", "02:00:00:00:00:01", "10.0.0.1"),
+                "IS_AT",
+            ),
+            (
+                base + 5000000000,
+                (0x88A8, 0x8100),
+                (3, "02:00:00:00:00:03", "0.0.0.0", "02:00:00:00:00:03", "0.0.0.0"),
+                "RARP_REQ",
+            ),
+            (
+                base + 6000000000,
+                (),
+                (12, "02:00:00:00:00:04", "10.0.0.4", "ff:ff:ff:ff:ff:ff", "10.0.0.5"),
+                "12",
+            ),
+        ]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for linktype in [1, 113, 276]:
+                arp_frames = [
+                    (base, _arp_frame(linktype, b"E" + b"\x00" * 27, ethertype=0x0800))
+                ]
+                for nsecs, vlans, packet, _ in arp_packets:
+                    arp_frames.append(
+                        (
+                            nsecs,
+                            _arp_frame(linktype, _arp_payload(*packet), vlans=vlans),
+                        )
+                    )
+                # not IPv4, truncated: skipped
+                packet = arp_packets[0][2]
+                arp_frames.append(
+                    (base, _arp_frame(linktype, _arp_payload(*packet, ptype=0x86DD)))
+                )
+                arp_frames.append(
+                    (base, _arp_frame(linktype, _arp_payload(*packet)[:27]))
+                )
+                for writer, endian, nano in [
+                    (_pcap_file, "<", False),
+                    (_pcap_file, ">", True),
+                    (_pcapng_file, "<", False),
+                    (_pcapng_file, ">", True),
+                ]:
+                    fname = os.path.join(tmpdir, "arp.cap")
+                    writer(fname, linktype, arp_frames, endian=endian, nano=nano)
+                    arp_expected = []
+                    for nsecs, _, packet, op in arp_packets:
+                        arp_expected.append(
+                            {
+                                "dst": packet[4],
+                                "src": packet[2],
+                                "mac_src": packet[1],
+                                "mac_dst": packet[3],
+                                "start_time": arp_time(nsecs, nano),
+                                "end_time": arp_time(nsecs, nano),
+                                "op": op,
+                                "proto": "arp",
+                            }
+                        )
+                    with ivre.parser.arp.ArpPcapFile(fname) as arp_parser:
+                        self.assertEqual(list(arp_parser), arp_expected)
+            # other link types are not supported
+            _pcap_file(fname, 0, [])
+            with self.assertRaises(ValueError):
+                ivre.parser.arp.ArpPcapFile(fname)
+
         # Web utils
         with self.assertRaises(ValueError):
             ivre.web.utils.query_from_params({"q": '"'})
@@ -4416,6 +5547,542 @@ class IvreTests(unittest.TestCase):
         for line in out.splitlines():
             self.assertTrue(isinstance(json.loads(line), dict))
 
+        # Parsed files cache
+        self.addCleanup(setattr, ivre.config, "CACHE_PATH", ivre.config.CACHE_PATH)
+        ivre.config.CACHE_PATH = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, ivre.config.CACHE_PATH)
+        cachedir = os.path.join(ivre.config.CACHE_PATH, "parsed")
+        parsed_fname = os.path.join(ivre.config.CACHE_PATH, "data.txt")
+        with open(parsed_fname, "w") as fdesc:
+            fdesc.write("data")
+        calls = []
+
+        def parser(fname):
+            calls.append(fname)
+            with open(fname) as fdesc:
+                return {"data": fdesc.read(), "call": len(calls)}
+
+        def load_parsed():
+            return ivre.utils.load_parsed_file(parsed_fname, parser)
+
+        self.assertEqual(load_parsed(), {"data": "data", "call": 1})
+        self.assertEqual(load_parsed(), {"data": "data", "call": 1})
+        (cachefname,) = os.listdir(cachedir)
+        cachefname = os.path.join(cachedir, cachefname)
+        self.assertFalse(os.stat(cachefname).st_mode & (stat.S_IRWXG | stat.S_IRWXO))
+        # the file has been modified
+        with open(parsed_fname, "w") as fdesc:
+            fdesc.write("new data")
+        self.assertEqual(load_parsed(), {"data": "new data", "call": 2})
+        self.assertEqual(load_parsed(), {"data": "new data", "call": 2})
+        # cache file or directory writable by other users
+        for call, path in enumerate([cachefname, cachedir], start=3):
+            mode = os.stat(path).st_mode
+            os.chmod(path, mode | stat.S_IWGRP)
+            self.assertEqual(load_parsed(), {"data": "new data", "call": call})
+            os.chmod(path, mode)
+            self.assertEqual(load_parsed(), {"data": "new data", "call": call})
+        # no temporary file is left when the data cannot be stored
+        os.unlink(cachefname)
+        for _ in range(2):
+            self.assertEqual(
+                ivre.utils.load_parsed_file(parsed_fname, lambda _: lambda: None)(),
+                None,
+            )
+        self.assertFalse(os.listdir(cachedir))
+
+        # Hosts writer
+        class HostsDB:
+            def __init__(self):
+                self.batches = []
+
+            def store_hosts(self, hosts):
+                self.batches.append(list(hosts))
+
+        dbase = HostsDB()
+        prepared = []
+        stored = []
+        writer = ivre.db.HostsWriter(
+            dbase,
+            callback=stored.append,
+            prepare=lambda hosts: prepared.append(len(hosts)),
+            batch_size=3,
+        )
+        writer.flush()
+        self.assertFalse(dbase.batches)
+        hosts = [{"addr": "10.0.0.%d" % i} for i in range(8)]
+        for host in hosts[:7]:
+            writer.append(host)
+        self.assertEqual(dbase.batches, [hosts[:3], hosts[3:6]])
+        self.assertEqual(stored, hosts[:6])
+        writer.append(hosts[7])
+        writer.flush()
+        writer.flush()
+        self.assertEqual(dbase.batches, [hosts[:3], hosts[3:6], hosts[6:]])
+        self.assertEqual(prepared, [3, 3, 2])
+        self.assertEqual(stored, hosts)
+        # the callback gets the records once they have been stored
+        dbase = HostsDB()
+        writer = ivre.db.HostsWriter(
+            dbase,
+            callback=lambda host: self.assertIn([host], dbase.batches),
+            batch_size=1,
+        )
+        for host in hosts:
+            writer.append(host)
+        writer.flush()
+        self.assertEqual(len(dbase.batches), len(hosts))
+        # default batch size
+        self.assertEqual(
+            ivre.db.HostsWriter(dbase).batch_size, ivre.config.HOSTS_BATCH_SIZE
+        )
+
+        # Threaded iterators (db2view --threads)
+        self.assertEqual(
+            list(
+                ivre.view._threaded_iterator(
+                    iter(range(1000)), batch_size=7, max_batches=2
+                )
+            ),
+            list(range(1000)),
+        )
+        self.assertEqual(list(ivre.view._threaded_iterator(iter([]))), [])
+
+        def failing():
+            yield 1
+            raise ValueError("failing")
+
+        itr = ivre.view._threaded_iterator(failing())
+        self.assertEqual(next(itr), 1)
+        with self.assertRaises(ValueError):
+            next(itr)
+        # the thread stops when the iterator is closed early
+        closed = threading.Event()
+
+        def endless():
+            try:
+                while True:
+                    yield 1
+            finally:
+                closed.set()
+
+        itr = ivre.view._threaded_iterator(endless(), batch_size=10, max_batches=2)
+        self.assertEqual(next(itr), 1)
+        itr.close()
+        self.assertTrue(closed.wait(10))
+
+        # GeoIP CSV dump indexes
+        self.addCleanup(setattr, ivre.config, "GEOIP_PATH", ivre.config.GEOIP_PATH)
+        ivre.config.GEOIP_PATH = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, ivre.config.GEOIP_PATH)
+
+        def write_dumps():
+            dumps = {
+                "GeoLite2-ASN.dump-IPv4.csv": [],
+                "GeoLite2-Country.dump-IPv4.csv": [],
+                "GeoLite2-RegisteredCountry.dump-IPv4.csv": [],
+                "GeoLite2-City.dump-IPv4.csv": [],
+            }
+            start = 0
+            for _ in range(2000):
+                start += random.randrange(1, 0x10000)
+                stop = start + random.randrange(0x10000)
+                country = random.choice(["FR", "DE", "US", "PN"])
+                region = random.choice(["A", "B"])
+                city = ivre.utils.encode_b64(
+                    random.choice(["Paris", "Zürich", ""]).encode("utf-8")
+                ).decode("utf-8")
+                for fname, values in [
+                    ("GeoLite2-ASN.dump-IPv4.csv", [random.randrange(1, 5)]),
+                    ("GeoLite2-Country.dump-IPv4.csv", [country]),
+                    (
+                        "GeoLite2-RegisteredCountry.dump-IPv4.csv",
+                        [random.choice([country, "FR"])],
+                    ),
+                    (
+                        "GeoLite2-City.dump-IPv4.csv",
+                        [country, region, city, random.randrange(1, 5)],
+                    ),
+                ]:
+                    dumps[fname].append(
+                        ",".join(str(val) for val in [start, stop] + values)
+                    )
+                start = stop
+            for fname, lines in dumps.items():
+                with open(os.path.join(ivre.config.GEOIP_PATH, fname), "w") as fdesc:
+                    fdesc.writelines("%s\n" % line for line in lines)
+
+        def get_ranges():
+            return [
+                list(getter(*args).iter_int_ranges())
+                for getter, args_list in [
+                    (ivre.geoiputils.get_ranges_by_asnum, [[1], [3], [5]]),
+                    (ivre.geoiputils.get_ranges_by_country, [["FR"], ["US"], ["GB"]]),
+                    (
+                        ivre.geoiputils.get_ranges_by_registered_country,
+                        [["FR"], ["PN"], ["GB"]],
+                    ),
+                    (ivre.geoiputils.get_ranges_by_location, [[1], [4], [5]]),
+                    (
+                        ivre.geoiputils.get_ranges_by_city,
+                        [["FR", "Paris"], ["DE", "Zürich"], ["US", ""], ["FR", "Nice"]],
+                    ),
+                    (
+                        ivre.geoiputils.get_ranges_by_region,
+                        [["FR", "A"], ["PN", "B"], ["FR", "C"]],
+                    ),
+                ]
+                for args in args_list
+            ]
+
+        def get_ranges_noindex():
+            # get_ranges_by_key() falls back to get_ranges_by_data() when
+            # no index can be used
+            get_dump_index = ivre.geoiputils.get_dump_index
+            ivre.geoiputils.get_dump_index = lambda *_: None
+            try:
+                return get_ranges()
+            finally:
+                ivre.geoiputils.get_dump_index = get_dump_index
+
+        write_dumps()
+        ranges = get_ranges_noindex()
+        # one unknown key per function
+        self.assertEqual(sum(1 for rnge in ranges if not rnge), 6)
+        # the index files are created on the first call, then used
+        self.assertEqual(get_ranges(), ranges)
+        indexes = sorted(
+            fname
+            for fname in os.listdir(ivre.config.GEOIP_PATH)
+            if fname.endswith(".idx")
+        )
+        self.assertEqual(len(indexes), 6)
+        mtimes = [
+            os.path.getmtime(os.path.join(ivre.config.GEOIP_PATH, fname))
+            for fname in indexes
+        ]
+        self.assertEqual(get_ranges(), ranges)
+        self.assertEqual(
+            [
+                os.path.getmtime(os.path.join(ivre.config.GEOIP_PATH, fname))
+                for fname in indexes
+            ],
+            mtimes,
+        )
+        # the index files are rebuilt when the CSV files are newer
+        write_dumps()
+        for fname in os.listdir(ivre.config.GEOIP_PATH):
+            if fname.endswith(".csv"):
+                os.utime(
+                    os.path.join(ivre.config.GEOIP_PATH, fname),
+                    (max(mtimes) + 10, max(mtimes) + 10),
+                )
+        new_ranges = get_ranges_noindex()
+        self.assertNotEqual(new_ranges, ranges)
+        self.assertEqual(get_ranges(), new_ranges)
+        # the CSV files are used when the index files cannot be
+        # written (directories are used here, since the tests may run
+        # as root)
+        for fname in indexes:
+            fname = os.path.join(ivre.config.GEOIP_PATH, fname)
+            os.unlink(fname)
+            os.mkdir(fname)
+        self.assertEqual(get_ranges(), new_ranges)
+        # no temporary file is left
+        self.assertCountEqual(
+            os.listdir(ivre.config.GEOIP_PATH),
+            list(ivre.geoiputils.DUMP_INDEXES) + indexes,
+        )
+
+        # Passive IGNORENETS rules
+        ignorenets = ivre.passive.compile_ignorenets(
+            {
+                "DNS_ANSWER": [
+                    ("10.0.1.0", "10.0.1.255"),
+                    # adjacent to the previous range
+                    ("10.0.0.0", "10.0.0.255"),
+                    # included in the previous range
+                    ("10.0.0.128", "10.0.0.200"),
+                    # overlaps the next range
+                    (ivre.utils.ip2int("192.168.0.0"), "192.168.0.10"),
+                    ("192.168.0.5", "192.168.0.20"),
+                    ("2001:db8::", "2001:db8::ffff"),
+                ],
+                "SSL_SERVER": [],
+            }
+        )
+        self.assertEqual(sorted(ignorenets), ["DNS_ANSWER", "SSL_SERVER"])
+        self.assertEqual(
+            ignorenets["DNS_ANSWER"].starts,
+            [
+                ivre.utils.ip2int("10.0.0.0"),
+                ivre.utils.ip2int("192.168.0.0"),
+                ivre.utils.ip2int("2001:db8::"),
+            ],
+        )
+        self.assertEqual(
+            ignorenets["DNS_ANSWER"].stops,
+            [
+                ivre.utils.ip2int("10.0.1.255"),
+                ivre.utils.ip2int("192.168.0.20"),
+                ivre.utils.ip2int("2001:db8::ffff"),
+            ],
+        )
+
+        def ignored(addr, recontype="DNS_ANSWER", source="A", neverignore=None):
+            return not list(
+                ivre.passive._prepare_rec(
+                    {
+                        "recontype": recontype,
+                        "source": source,
+                        "addr": addr,
+                        "value": "www.example.com",
+                    },
+                    ignorenets,
+                    neverignore or {},
+                )
+            )
+
+        for addr in [
+            "10.0.0.0",
+            "10.0.0.255",
+            "10.0.1.0",
+            "10.0.1.255",
+            "192.168.0.0",
+            "192.168.0.20",
+            "2001:db8::",
+            "2001:db8::ffff",
+        ]:
+            self.assertTrue(ignored(addr), addr)
+            self.assertFalse(ignored(addr, recontype="HTTP_SERVER_HEADER"), addr)
+            self.assertFalse(ignored(addr, neverignore={"DNS_ANSWER": ["A"]}), addr)
+        for addr in [
+            "0.0.0.0",
+            "9.255.255.255",
+            "10.0.2.0",
+            "192.167.255.255",
+            "192.168.0.21",
+            "255.255.255.255",
+            "::",
+            "2001:db7:ffff:ffff:ffff:ffff:ffff:ffff",
+            "2001:db8::1:0",
+            "ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff",
+        ]:
+            self.assertFalse(ignored(addr), addr)
+        self.assertFalse(ignored("10.0.0.1", recontype="SSL_SERVER", source="cert"))
+        # uncompiled rules are rejected
+        with self.assertRaises(TypeError):
+            list(
+                ivre.passive._prepare_rec(
+                    {"recontype": "DNS_ANSWER", "source": "A", "addr": "10.0.0.1"},
+                    {
+                        "DNS_ANSWER": [
+                            ("10.0.0.0", "10.0.0.255"),
+                            ("10.0.2.0", "10.0.2.255"),
+                        ]
+                    },
+                    {},
+                )
+            )
+
+        # getinfos() cache
+        for attr in [
+            "CACHE_PATH",
+            "PASSIVE_GETINFOS_CACHE_PERSIST",
+            "PASSIVE_GETINFOS_CACHE_SIZE",
+        ]:
+            self.addCleanup(setattr, ivre.config, attr, getattr(ivre.config, attr))
+        for attr in ["_GETINFOS_CACHE_LOADED", "_GETINFOS_CACHE_MODIFIED"]:
+            self.addCleanup(setattr, ivre.passive, attr, getattr(ivre.passive, attr))
+        self.addCleanup(atexit.unregister, ivre.passive.save_getinfos_cache)
+        self.addCleanup(ivre.passive._GETINFOS_CACHE.clear)
+        ivre.config.CACHE_PATH = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, ivre.config.CACHE_PATH)
+        ivre.config.PASSIVE_GETINFOS_CACHE_PERSIST = False
+        ivre.config.PASSIVE_GETINFOS_CACHE_SIZE = 2
+        ivre.passive._GETINFOS_CACHE.clear()
+        cache_info = ivre.passive.getinfos_cache_info()
+
+        def getinfos_stats():
+            info = ivre.passive.getinfos_cache_info()
+            return (
+                info["hits"] - cache_info["hits"],
+                info["misses"] - cache_info["misses"],
+                info["size"],
+            )
+
+        def dns_spec(name):
+            return {"recontype": "DNS_ANSWER", "source": "A", "value": name}
+
+        result = ivre.passive.getinfos(dns_spec("www.example.com"))
+        self.assertEqual(
+            result, {"infos": {"domain": ["www.example.com", "example.com", "com"]}}
+        )
+        self.assertEqual(getinfos_stats(), (0, 1, 1))
+        # the results returned can be modified without changing the
+        # cached values
+        result["infos"]["domain"].append("test")
+        result = ivre.passive.getinfos(dns_spec("www.example.com"))
+        self.assertEqual(
+            result, {"infos": {"domain": ["www.example.com", "example.com", "com"]}}
+        )
+        self.assertEqual(getinfos_stats(), (1, 1, 1))
+        result["infos"]["domain"].append("test")
+        self.assertEqual(
+            ivre.passive.getinfos(dns_spec("www.example.com"))["infos"]["domain"],
+            ["www.example.com", "example.com", "com"],
+        )
+        self.assertEqual(getinfos_stats(), (2, 1, 1))
+        # the least recently used results are dropped
+        ivre.passive.getinfos(dns_spec("www.example.net"))
+        ivre.passive.getinfos(dns_spec("www.example.org"))
+        self.assertEqual(getinfos_stats(), (2, 3, 2))
+        ivre.passive.getinfos(dns_spec("www.example.org"))
+        ivre.passive.getinfos(dns_spec("www.example.com"))
+        self.assertEqual(getinfos_stats(), (3, 4, 2))
+        # JA3 & HASSH results depend on the existing "infos": not cached
+        for recontype, source in [
+            ("SSL_CLIENT", "ja3"),
+            ("SSH_CLIENT_HASSH", "hassh"),
+        ]:
+            raw = "%s-%s" % (recontype, source)
+            self.assertEqual(
+                ivre.passive.getinfos(
+                    {
+                        "recontype": recontype,
+                        "source": source,
+                        "value": "ignored",
+                        "infos": {"raw": raw},
+                    }
+                ),
+                {
+                    "infos": {
+                        "raw": raw,
+                        "sha1": hashlib.sha1(raw.encode()).hexdigest(),
+                        "sha256": hashlib.sha256(raw.encode()).hexdigest(),
+                    }
+                },
+            )
+        self.assertEqual(getinfos_stats(), (3, 4, 2))
+        # persistent cache
+        ivre.config.PASSIVE_GETINFOS_CACHE_PERSIST = True
+        ivre.passive.save_getinfos_cache()
+        getinfos_fname = os.path.join(ivre.config.CACHE_PATH, "passive-getinfos.pickle")
+        self.assertFalse(
+            os.stat(getinfos_fname).st_mode & (stat.S_IRWXG | stat.S_IRWXO)
+        )
+        self.assertEqual(
+            os.listdir(ivre.config.CACHE_PATH), ["passive-getinfos.pickle"]
+        )
+        for mode, stats in [(0o600, (4, 4, 2)), (0o620, (4, 5, 1))]:
+            os.chmod(getinfos_fname, mode)
+            ivre.passive._GETINFOS_CACHE.clear()
+            ivre.passive._GETINFOS_CACHE_LOADED = False
+            ivre.passive.getinfos(dns_spec("www.example.org"))
+            self.assertEqual(getinfos_stats(), stats)
+
+        # Web results cache
+        for attr in [
+            "DB_STAMPS_PATH",
+            "WEB_DEFAULT_INIT_QUERY",
+            "WEB_INIT_QUERIES",
+            "WEB_PUBLIC_SRV",
+            "WEB_TOP_CACHE_SIZE",
+            "WEB_TOP_CACHE_STALE",
+            "WEB_TOP_CACHE_TTL",
+        ]:
+            self.addCleanup(setattr, ivre.config, attr, getattr(ivre.config, attr))
+        ivre.config.WEB_TOP_CACHE_SIZE = 1000
+        ivre.config.WEB_TOP_CACHE_STALE = 0
+        ivre.config.WEB_TOP_CACHE_TTL = 300
+        calls = []
+
+        def compute(value):
+            calls.append(value)
+            return iter([value])
+
+        # disabled without DB_STAMPS_PATH
+        ivre.config.DB_STAMPS_PATH = None
+        cache = ivre.web.utils.ResultsCache()
+        self.assertEqual(cache.get("key1", "nmap", partial(compute, 1)), [1])
+        self.assertEqual(cache.get("key1", "nmap", partial(compute, 2)), [2])
+        self.assertEqual(calls, [1, 2])
+        self.assertFalse(cache.entries)
+        ivre.config.DB_STAMPS_PATH = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, ivre.config.DB_STAMPS_PATH)
+        del calls[:]
+        # miss, then hit
+        self.assertEqual(cache.get("key1", "nmap", partial(compute, 1)), [1])
+        self.assertEqual(cache.get("key1", "nmap", partial(compute, 2)), [1])
+        self.assertEqual(cache.get("key2", "nmap", partial(compute, 3)), [3])
+        self.assertEqual(cache.get("key3", "passive", partial(compute, 4)), [4])
+        self.assertEqual(calls, [1, 3, 4])
+        # a modification of the "nmap" database drops its results only
+        ivre.utils.touch_db_stamp("nmap")
+        self.assertEqual(cache.get("key1", "nmap", partial(compute, 5)), [5])
+        self.assertEqual(cache.get("key1", "nmap", partial(compute, 6)), [5])
+        self.assertEqual(cache.get("key3", "passive", partial(compute, 7)), [4])
+        self.assertEqual(calls, [1, 3, 4, 5])
+        stamp = os.path.join(ivre.config.DB_STAMPS_PATH, "nmap")
+        os.utime(stamp, ns=(0, 0))
+        self.assertEqual(cache.get("key1", "nmap", partial(compute, 8)), [8])
+        ivre.utils.touch_db_stamp("nmap")
+        self.assertGreater(os.stat(stamp).st_mtime_ns, 0)
+        self.assertEqual(cache.get("key1", "nmap", partial(compute, 9)), [9])
+        self.assertEqual(calls, [1, 3, 4, 5, 8, 9])
+        # expired results
+        ivre.config.WEB_TOP_CACHE_TTL = 0
+        self.assertEqual(cache.get("key1", "nmap", partial(compute, 10)), [10])
+        ivre.config.WEB_TOP_CACHE_TTL = 300
+        self.assertEqual(cache.get("key1", "nmap", partial(compute, 11)), [10])
+        # least recently used results are dropped first
+        ivre.config.WEB_TOP_CACHE_SIZE = 2
+        self.assertEqual(cache.get("key4", "nmap", partial(compute, 12)), [12])
+        self.assertEqual(list(cache.entries), ["key1", "key4"])
+        # disabled with WEB_TOP_CACHE_SIZE = 0
+        ivre.config.WEB_TOP_CACHE_SIZE = 0
+        self.assertEqual(cache.get("key1", "nmap", partial(compute, 13)), [13])
+        self.assertEqual(calls, [1, 3, 4, 5, 8, 9, 10, 12, 13])
+
+        # Cache keys
+        def cache_key(query_string, user=None, *args):
+            environ = {"QUERY_STRING": query_string}
+            if user is not None:
+                environ["REMOTE_USER"] = user
+            ivre.web.utils.request.bind(environ)
+            return ivre.web.utils.get_cache_key(*args)
+
+        ivre.config.WEB_DEFAULT_INIT_QUERY = None
+        ivre.config.WEB_INIT_QUERIES = {"admin": "full", "@realm": "noaccess"}
+        ivre.config.WEB_PUBLIC_SRV = True
+        key = cache_key("q=country:FR&f={}", "user1", "top", "port")
+        self.assertEqual(
+            key,
+            (
+                json.dumps([[False, "country", "FR"]]),
+                json.dumps({}),
+                ("user", "user1"),
+                "top",
+                "port",
+            ),
+        )
+        self.assertEqual(key, cache_key("q=country:FR", "user1", "top", "port"))
+        self.assertNotEqual(key, cache_key("q=country:FR", "user2", "top", "port"))
+        self.assertNotEqual(key, cache_key("q=country:FR", None, "top", "port"))
+        self.assertNotEqual(key, cache_key("q=country:US", "user1", "top", "port"))
+        self.assertNotEqual(key, cache_key("q=country:FR", "user1", "top", "service"))
+        self.assertEqual(cache_key("", "admin")[2], "full")
+        self.assertEqual(cache_key("", "user@realm")[2], "noaccess")
+        self.assertEqual(
+            cache_key("f=%7B%22a%22%3A1%2C%22b%22%3A2%7D", "admin"),
+            cache_key("f=%7B%22b%22%3A2%2C%22a%22%3A1%7D", "admin"),
+        )
+        ivre.config.WEB_PUBLIC_SRV = False
+        self.assertEqual(
+            cache_key("", "user1")[2],
+            cache_key("", "user2")[2],
+        )
+
     def test_scans(self):
         "Run scans, with and without agents"
 
@@ -4781,6 +6448,14 @@ class IvreTests(unittest.TestCase):
         self.assertEqual(ret, 0)
         # One entry in test should actually be one entry at the end.
         self.check_value("view_count_active", len(out.splitlines()))
+        # Same results when each source is read in its own thread
+        for source in ["passive", "all"]:
+            ret, out1, _ = RUN(["ivre", "db2view", "--test", source])
+            self.assertEqual(ret, 0)
+            self.assertTrue(out1)
+            ret, out2, _ = RUN(["ivre", "db2view", "--test", "--threads", source])
+            self.assertEqual(ret, 0)
+            self.assertEqual(sorted(out1.splitlines()), sorted(out2.splitlines()))
 
         # Test passive filters
         # FIXME : positionnal IP filter is broken
@@ -5574,7 +7249,11 @@ class IvreTests(unittest.TestCase):
         os.unlink(fdesc.name)
         # END Using the HTTP server as a database
 
+        self.start_rollups(ivre.db.db.view)
+        self.check_rollups(ivre.db.db.view)
+
     def test_55_view_delete(self):
+        self.start_rollups(ivre.db.db.view)
         # Remove
         addr = next(
             iter(ivre.db.db.view.get(ivre.db.db.view.flt_empty, sort=[("addr", -1)]))
@@ -5593,6 +7272,405 @@ class IvreTests(unittest.TestCase):
             time.sleep(ELASTIC_INSERT_TEMPO)
         count = ivre.db.db.view.count(ivre.db.db.view.searchhost(addr))
         self.assertEqual(count, 0)
+        self.check_rollups(ivre.db.db.view)
+
+    def test_tinydb(self):
+        import ivre.db.tiny
+
+        seed = random.randrange(1 << 32)
+        rnd = random.Random(seed)
+
+        def tinydb_instance(cls, url, indexes):
+            orig_indexes = ivre.config.TINYDB_INDEXES
+            ivre.config.TINYDB_INDEXES = indexes
+            try:
+                dbase = cls(url)
+                table = dbase.db.table(dbase.db.default_table_name)
+            finally:
+                ivre.config.TINYDB_INDEXES = orig_indexes
+            self.assertEqual(
+                isinstance(table, ivre.db.tiny.IndexedTable),
+                indexes,
+            )
+            return dbase
+
+        def random_addr():
+            return "10.0.0.%d" % rnd.randrange(32)
+
+        def random_host():
+            host = {
+                "addr": random_addr(),
+                "source": rnd.choice(["src1", "src2"]),
+                "categories": rnd.sample(["cat1", "cat2", "cat3"], rnd.randrange(3)),
+                "ports": [],
+            }
+            for _ in range(rnd.randrange(4)):
+                port = {
+                    "port": rnd.choice([22, 80, 443, 8080]),
+                    "protocol": rnd.choice(["tcp", "udp"]),
+                    "state_state": rnd.choice(["open", "open", "closed"]),
+                }
+                if rnd.random() < 0.7:
+                    port["service_name"] = rnd.choice(["ssh", "http", "https"])
+                host["ports"].append(port)
+            return host
+
+        def random_nmap_filter(dbase, depth=0):
+            choice = rnd.random()
+            if depth < 2 and choice < 0.15:
+                return dbase.flt_and(
+                    random_nmap_filter(dbase, depth + 1),
+                    random_nmap_filter(dbase, depth + 1),
+                )
+            if depth < 2 and choice < 0.25:
+                return dbase.flt_or(
+                    random_nmap_filter(dbase, depth + 1),
+                    random_nmap_filter(dbase, depth + 1),
+                )
+            if depth < 2 and choice < 0.3:
+                return ~random_nmap_filter(dbase, depth + 1)
+            neg = rnd.random() < 0.2
+            return rnd.choice(
+                [
+                    lambda: dbase.searchhost(random_addr(), neg=neg),
+                    lambda: dbase.searchhosts(
+                        [random_addr() for _ in range(3)], neg=neg
+                    ),
+                    lambda: dbase.searchrange("10.0.0.8", "10.0.0.15", neg=neg),
+                    lambda: dbase.searchport(
+                        rnd.choice([22, 80, 443, 8080]),
+                        protocol=rnd.choice(["tcp", "udp"]),
+                        neg=neg,
+                    ),
+                    lambda: dbase.searchports(
+                        [22, 80], neg=neg, any_=not neg and rnd.random() < 0.5
+                    ),
+                    lambda: dbase.searchservice(rnd.choice(["ssh", "http"])),
+                    lambda: dbase.searchservice(["ssh", "https"]),
+                    lambda: dbase.searchservice(
+                        rnd.choice(["http", "https", False]),
+                        port=rnd.choice([80, 443, 8080, None]),
+                    ),
+                    lambda: dbase.searchopenport(neg=neg),
+                    lambda: dbase.searchcategory("cat1", neg=neg),
+                    lambda: dbase.searchsource("src1", neg=neg),
+                ]
+            )()
+
+        def random_spec():
+            return {
+                "addr": random_addr(),
+                "sensor": rnd.choice(["s1", "s2"]),
+                "recontype": rnd.choice(["HTTP_SERVER_HEADER", "DNS_ANSWER"]),
+                "source": rnd.choice(["SERVER", "A", None]),
+                "value": rnd.choice(["v1", "v2", "v3"]),
+                "port": rnd.choice([53, 80]),
+            }
+
+        def random_passive_filter(dbase, depth=0):
+            choice = rnd.random()
+            if depth < 2 and choice < 0.15:
+                return dbase.flt_and(
+                    random_passive_filter(dbase, depth + 1),
+                    random_passive_filter(dbase, depth + 1),
+                )
+            if depth < 2 and choice < 0.25:
+                return dbase.flt_or(
+                    random_passive_filter(dbase, depth + 1),
+                    random_passive_filter(dbase, depth + 1),
+                )
+            if depth < 2 and choice < 0.3:
+                return ~random_passive_filter(dbase, depth + 1)
+            spec = random_spec()
+            return rnd.choice(
+                [
+                    lambda: dbase.searchhost(spec["addr"]),
+                    lambda: dbase.searchhosts([random_addr() for _ in range(3)]),
+                    lambda: dbase.searchrecontype(spec["recontype"]),
+                    lambda: dbase.searchrecontype(["HTTP_SERVER_HEADER", "DNS_ANSWER"]),
+                    lambda: dbase.flt_and(
+                        dbase.searchrecontype(spec["recontype"]),
+                        dbase.searchval("source", spec["source"]),
+                    ),
+                    lambda: dbase.flt_and(
+                        *(
+                            dbase.searchval(key, spec[key])
+                            for key in ["recontype", "source", "value"]
+                        )
+                    ),
+                    lambda: dbase.searchsensor(spec["sensor"]),
+                    lambda: dbase.searchport(spec["port"]),
+                ]
+            )()
+
+        # Indexes (IndexedTable): same results with and without them,
+        # when the data is modified by the instance itself or by
+        # another one
+        for cls, random_filter in [
+            (ivre.db.tiny.TinyDBNmap, random_nmap_filter),
+            (ivre.db.tiny.TinyDBPassive, random_passive_filter),
+        ]:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                url = urlparse("tinydb://%s" % tmpdir)
+                indexed = tinydb_instance(cls, url, True)
+                other = tinydb_instance(cls, url, True)
+                plain = tinydb_instance(cls, url, False)
+                instances = [indexed, other, plain]
+                if cls is ivre.db.tiny.TinyDBNmap:
+                    indexed.store_hosts([random_host() for _ in range(200)])
+                else:
+                    for _ in range(200):
+                        indexed.insert_or_update(time.time(), random_spec())
+                for _ in range(400):
+                    dbase = rnd.choice(instances)
+                    action = rnd.random()
+                    if action < 0.1:
+                        if cls is ivre.db.tiny.TinyDBNmap:
+                            dbase.store_host(random_host())
+                        else:
+                            dbase.insert_or_update(time.time(), random_spec())
+                    elif action < 0.15:
+                        flt = random_filter(dbase)
+                        if cls is ivre.db.tiny.TinyDBNmap:
+                            dbase.remove_many(flt)
+                        else:
+                            dbase.remove(flt)
+                    elif action < 0.25:
+                        dbase.db.update(
+                            {
+                                "addr": dbase.ip2internal(random_addr()),
+                                "source": rnd.choice(["src1", "src2", "A"]),
+                            },
+                            random_filter(dbase),
+                        )
+                    else:
+                        flt = random_filter(dbase)
+                        results = [
+                            sorted(rec["_id"] for rec in dbase.get(flt))
+                            if cls is ivre.db.tiny.TinyDBNmap
+                            else sorted(rec.doc_id for rec in dbase.db.search(flt))
+                            for dbase in instances
+                        ]
+                        msg = "filter %r, seed %d" % (flt, seed)
+                        self.assertEqual(results[0], results[2], msg)
+                        self.assertEqual(results[1], results[2], msg)
+                        self.assertEqual(indexed.count(flt), len(results[2]), msg)
+                for dbase in instances:
+                    dbase.invalidate_cache()
+
+        # Log storage (LogStorage): same content as a JSON file, with
+        # two instances, frequent compactions and reopenings
+        from tinydb import Query, TinyDB
+        from tinydb.database import Document
+
+        def random_doc():
+            doc = {
+                "addr": rnd.randrange(20),
+                "recontype": rnd.choice("ABC"),
+                "source": rnd.choice(["x", "y", None]),
+                "value": rnd.choice(["v1", "v2", 3]),
+            }
+            if rnd.random() < 0.5:
+                doc["ports"] = [
+                    {"port": rnd.choice([22, 80, 443])} for _ in range(rnd.randrange(3))
+                ]
+            return doc
+
+        def random_cond():
+            q = Query()
+            return rnd.choice(
+                [
+                    lambda: q.addr == rnd.randrange(22),
+                    lambda: q.addr >= rnd.randrange(20),
+                    lambda: q.ports.any(q.port == rnd.choice([22, 80, 443])),
+                    lambda: (q.recontype == rnd.choice("ABC"))
+                    & (q.source == rnd.choice(["x", "y", None]))
+                    & (q.value == rnd.choice(["v1", 3])),
+                ]
+            )()
+
+        def content(tdb):
+            # empty tables are not kept by LogStorage
+            return {
+                name: sorted((doc.doc_id, dict(doc)) for doc in tdb.table(name).all())
+                for name in tdb.tables()
+                if len(tdb.table(name))
+            }
+
+        def open_log(path, indexes):
+            tdb = TinyDB(path, storage=ivre.db.tiny.LogStorage)
+            if indexes:
+                tdb.table_class = partial(
+                    ivre.db.tiny.IndexedTable,
+                    indexes=[("addr",), ("recontype", "source", "value")],
+                )
+            else:
+                tdb.table_class = ivre.db.tiny.LogTable
+            return tdb
+
+        orig_compact_min = ivre.db.tiny.LogStorage.compact_min
+        ivre.db.tiny.LogStorage.compact_min = 20
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                logpath = os.path.join(tmpdir, "test.tinylog")
+
+                ref = TinyDB(os.path.join(tmpdir, "test.json"))
+                logdbs = [open_log(logpath, True), open_log(logpath, False)]
+                inodes = set()
+                for _ in range(1500):
+                    i = rnd.randrange(2)
+                    tdb = logdbs[i]
+                    name = rnd.choice(["_default", "_default", "other"])
+                    table, ref_table = tdb.table(name), ref.table(name)
+                    action = rnd.random()
+                    if action < 0.15:
+                        doc = random_doc()
+                        ref_table.insert(Document(doc, table.insert(doc)))
+                    elif action < 0.18:
+                        docs = [random_doc() for _ in range(rnd.randrange(10))]
+                        ref_table.insert_multiple(
+                            Document(doc, doc_id)
+                            for doc, doc_id in zip(docs, table.insert_multiple(docs))
+                        )
+                    elif action < 0.28:
+                        cond = random_cond()
+                        fields = {"addr": rnd.randrange(20), "value": "v3"}
+                        self.assertEqual(
+                            sorted(table.update(fields, cond)),
+                            sorted(ref_table.update(fields, cond)),
+                        )
+                    elif action < 0.31:
+                        doc_ids = [
+                            doc.doc_id for doc in ref_table.all() if rnd.random() < 0.1
+                        ]
+                        fields = {"ports": [{"port": 8080}]}
+                        table.update(fields, doc_ids=doc_ids)
+                        ref_table.update(fields, doc_ids=doc_ids)
+                    elif action < 0.38:
+                        cond, doc = random_cond(), random_doc()
+                        if ref_table.contains(cond):
+                            ref_table.update(doc, cond)
+                            table.upsert(doc, cond)
+                        else:
+                            ref_table.insert(Document(doc, table.upsert(doc, cond)[0]))
+                    elif action < 0.42:
+                        cond = random_cond()
+                        self.assertEqual(
+                            sorted(table.remove(cond)),
+                            sorted(ref_table.remove(cond)),
+                        )
+                    elif action < 0.44:
+                        doc_ids = [
+                            doc.doc_id for doc in ref_table.all() if rnd.random() < 0.2
+                        ]
+                        table.remove(doc_ids=doc_ids)
+                        ref_table.remove(doc_ids=doc_ids)
+                    elif action < 0.45:
+                        table.truncate()
+                        ref_table.truncate()
+                    elif action < 0.46:
+                        tdb.drop_table("other")
+                        ref.drop_table("other")
+                    elif action < 0.48:
+                        tdb.close()
+                        logdbs[i] = open_log(logpath, i == 0)
+                    elif action < 0.49:
+                        # failed write (incomplete line), ignored and then
+                        # removed by the next write
+                        with open(logpath, "ab") as fdesc:
+                            fdesc.write(b'_default\t1\t{"addr": ')
+                    else:
+                        cond = random_cond()
+                        result = sorted(
+                            (doc.doc_id, dict(doc)) for doc in ref_table.search(cond)
+                        )
+                        for tdb in logdbs:
+                            self.assertEqual(
+                                sorted(
+                                    (doc.doc_id, dict(doc))
+                                    for doc in tdb.table(name).search(cond)
+                                ),
+                                result,
+                                "seed %d" % seed,
+                            )
+                    inodes.add(os.stat(logpath).st_ino)
+                result = content(ref)
+                for tdb in logdbs:
+                    self.assertEqual(content(tdb), result, "seed %d" % seed)
+                    tdb.close()
+                tdb = open_log(logpath, False)
+                self.assertEqual(content(tdb), result, "seed %d" % seed)
+                tdb.close()
+                # compacted
+                self.assertGreater(len(inodes), 1)
+            # concurrent writes (and compactions) from several processes
+            with tempfile.TemporaryDirectory() as tmpdir:
+                logpath = os.path.join(tmpdir, "test.tinylog")
+                procs = [
+                    multiprocessing.Process(
+                        target=_tinydb_log_writer, args=(logpath, worker, 100)
+                    )
+                    for worker in range(4)
+                ]
+                for proc in procs:
+                    proc.start()
+                for proc in procs:
+                    proc.join()
+                    self.assertEqual(proc.exitcode, 0)
+                tdb = open_log(logpath, False)
+                docs = tdb.all()
+                self.assertEqual(len(set(doc.doc_id for doc in docs)), 400)
+                self.assertCountEqual(
+                    [(doc["worker"], doc["i"], doc["updates"]) for doc in docs],
+                    [(worker, i, 100 - i) for worker in range(4) for i in range(100)],
+                )
+                tdb.close()
+        finally:
+            ivre.db.tiny.LogStorage.compact_min = orig_compact_min
+
+        # Conversion of a JSON database, compaction
+        orig_log_storage = ivre.config.TINYDB_LOG_STORAGE
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                dbase = ivre.db.tiny.TinyDB(urlparse("tinydb://%s" % tmpdir))
+                jsonpath = os.path.join(tmpdir, "test.json")
+                logpath = os.path.join(tmpdir, "test.tinylog")
+                ivre.config.TINYDB_LOG_STORAGE = False
+                tdb = dbase._open_db("test")
+                tdb.insert_multiple({"i": i} for i in range(10))
+                tdb.table("other").insert({"x": 1})
+                ref = content(tdb)
+                tdb.close()
+                ivre.config.TINYDB_LOG_STORAGE = True
+                with self.assertLogs(ivre.utils.LOGGER, level="WARNING"):
+                    tdb = dbase._open_db("test")
+                self.assertIsInstance(tdb.storage, ivre.db.tiny.LogStorage)
+                self.assertEqual(content(tdb), ref)
+                self.assertFalse(os.path.exists(jsonpath))
+                self.assertTrue(os.path.exists("%s.bak" % jsonpath))
+                tdb.insert({"i": 10})
+                ref = content(tdb)
+                # the compacted file keeps the mode, no temporary file
+                # is left
+                os.chmod(logpath, 0o640)
+                tdb.storage.compact()
+                self.assertEqual(stat.S_IMODE(os.stat(logpath).st_mode), 0o640)
+                self.assertCountEqual(
+                    os.listdir(tmpdir), ["test.tinylog", "test.json.bak"]
+                )
+                tdb.close()
+                tdb = dbase._open_db("test")
+                self.assertEqual(content(tdb), ref)
+                tdb.close()
+                # the log file is not used without TINYDB_LOG_STORAGE
+                ivre.config.TINYDB_LOG_STORAGE = False
+                with self.assertLogs(ivre.utils.LOGGER, level="WARNING") as logs:
+                    tdb = dbase._open_db("test")
+                self.assertIn(logpath, logs.output[0])
+                self.assertEqual(content(tdb), {})
+                tdb.close()
+        finally:
+            ivre.config.TINYDB_LOG_STORAGE = orig_log_storage
 
     def test_conf(self):
         # Ensure env var IVRE_CONF is taken into account
@@ -5632,6 +7710,7 @@ TESTS = set(
         "90_cleanup",
         "conf",
         "scans",
+        "tinydb",
         "utils",
     ]
 )
@@ -5639,8 +7718,8 @@ TESTS = set(
 
 DATABASES = {
     # **excluded** tests
-    "mongo": ["utils"],
-    "postgres": ["60_flow", "scans", "utils"],
+    "mongo": ["tinydb", "utils"],
+    "postgres": ["60_flow", "scans", "tinydb", "utils"],
     "sqlite": [
         "30_nmap",
         "50_view",
@@ -5648,6 +7727,7 @@ DATABASES = {
         "55_view_delete",
         "60_flow",
         "scans",
+        "tinydb",
         "utils",
     ],
     "elastic": [
@@ -5658,6 +7738,7 @@ DATABASES = {
         "60_flow",
         "90_cleanup",
         "scans",
+        "tinydb",
         "utils",
     ],
     "maxmind": [
@@ -5670,6 +7751,7 @@ DATABASES = {
         "60_flow",
         "90_cleanup",
         "scans",
+        "tinydb",
     ],
     "tinydb": ["utils"],
 }